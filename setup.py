@@ -41,8 +41,10 @@ setup(
 					("organizer", "src/organizer"),
 					]),
 	classifiers = classifiers,
-	packages = ["organizer"],
+	packages = ["organizer", "organizer.benchmarks"],
+	package_data = {"organizer.benchmarks": ["baseline.json"]},
 	install_requires = ['decorator'],
+	extras_require = {'numpy': ['numpy'], 'test': ['numpy']},
 	data_files = [
 		("/usr/share/applications", ["organizer.desktop"]),
 	],
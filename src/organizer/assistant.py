@@ -84,15 +84,38 @@ class Assistant(object):
     path = None
     nature = None
     destination = None
-    subdirs = None
-
-    def __init__(self, memory, path):
+    listings = None
+    guesses = None
+    speculated = ()
+    _speculated = ()
+    _resolved = None
+    _unresolved_from = None
+
+    def __init__(self, memory, path, listings=None, guesses=None):
         """Every Assistant requires a memory.Memory object, and a path pointing to
-        a file or directory to organize."""
+        a file or directory to organize.  The optional listings is a
+        destinations.Listings object shared by the destinations it uses,
+        and the optional guesses a destinations.Guesses object they share."""
         self.memory = memory
+        self.listings = listings
+        self.guesses = guesses
         path = os.path.abspath(path)
         self._path = path
-        self.subdirs = []
+        self._subdirs = []
+
+    @property
+    def subdirs(self):
+        """The Subdirs the organizee goes in, with their hints.  When there
+        is no destination, these are only worked out once asked for, since
+        rendering the schemes of the nature is slow to get ready and a
+        batch run skips such organizees without looking at them."""
+        if self._unresolved_from is not None:
+            self._resolve_subdirs(self._unresolved_from)
+        return self._subdirs
+
+    @subdirs.setter
+    def subdirs(self, subdirs):
+        self._subdirs = subdirs
 
     def begin(self):
         """This method makes the initial educated guesses as to where to
@@ -109,21 +132,44 @@ class Assistant(object):
         the nature of the organizee and the destination, after
         persist_in_memory has been called."""
         if new_destination is not None:
-            new_destination = destinations.Destination(new_destination)
+            new_destination = destinations.Destination(new_destination, self.listings,
+                                                       self.guesses)
         self.destination = new_destination
         self._recompute_subdirs()
 
-    def _recompute_subdirs(self):
-        subdirs = self.subdirs[:]
+    def _resolution(self):
+        """Returns the nature hints and whether each is mandatory, resolving
+        them only once per nature."""
+        if self._resolved is None or self._resolved[0] is not self.nature:
+            naturehints = self.nature.resolve() if self.nature else ()
+            self._resolved = (self.nature,
+                              [y for _, y in naturehints],
+                              [x for x, _ in naturehints])
+        return self._resolved[1], self._resolved[2]
+
+    def _recompute_subdirs(self, start=0):
+        """Recomputes the subdirs from the one at index start down.  The
+        guesses for the subdirs above it depend only on the destination and
+        on the subdirs above them, so they are kept as they are.  Without
+        a destination, this waits until the subdirs are asked for."""
+        if self.destination is None:
+            if self._unresolved_from is not None:
+                start = min(start, self._unresolved_from)
+            self._unresolved_from = start
+            self.speculated = ()
+            return
+        self._resolve_subdirs(start)
+
+    def _resolve_subdirs(self, start):
+        self._unresolved_from = None
+        subdirs = self._subdirs[:]
+        speculated = list(self._speculated[:start])
+        naturehints, mandatories = self._resolution()
         p = None
-        if self.nature:
-            naturehints = self.nature.resolve()
-            mandatories = [x for x, _ in naturehints]
-            naturehints = [y for _, y in naturehints]
-        else:
-            naturehints = []
+        for subdir in subdirs[:start]:
+            p = str(subdir) if p is None else os.path.join(p, str(subdir))
         r = max((len(subdirs), len(naturehints)))
-        for n in range(r):
+        for n in range(start, r):
             if n + 1 > len(subdirs):
                 subdir = Subdir(self.memory)
                 subdirs.append(subdir)
@@ -133,14 +179,19 @@ class Assistant(object):
                 subdir.set_nature_hint(naturehints[n])
             else:
                 subdir.set_nature_hint(None)
+            spec = None
             if self.destination:
                 if mandatories[n]:
                     subdir.set_destination_hint(None)
                 else:
                     destguess = self.destination.guess_best_hint(str(subdir), p)
                     subdir.set_destination_hint(destguess)
+                    spec = os.path.join(self.destination.path, p) if p else self.destination.path
+            speculated.append(spec)
             p = str(subdir) if p is None else os.path.join(p, str(subdir))
         self.subdirs = subdirs
+        self._speculated = speculated
+        self.speculated = tuple(s for s in speculated if s is not None)
 
     def change_subdir(self, subdir_number, new_subdir):
         """Changes a particular subdirectory to correspond to the specified string.
@@ -149,20 +200,22 @@ class Assistant(object):
         the guesses that this program made, and the specified subdir, after
         persist_in_memory has been called."""
         subdirs = self.subdirs[:]
+        start = min(subdir_number, len(subdirs))
         while len(subdirs) < subdir_number + 1:
             subdirs.append(Subdir(self.memory))
         subdirs[subdir_number].set_user_supplied_datum(new_subdir)
         self.subdirs = subdirs
-        self._recompute_subdirs()
+        self._recompute_subdirs(start)
 
     def persist_in_memory(self):
         """Requests the assistant to save its gathered knowledge into
         its memory."""
-        if self.destination and self.destination.path:
-            self.memory.remember_destination_for_nature(self.nature.__class__,
-                                                        os.path.abspath(self.destination.path))
-        for s in self.subdirs:
-            s.persist_in_memory()
+        with self.memory.transaction():
+            if self.destination and self.destination.path:
+                self.memory.remember_destination_for_nature(self.nature.__class__,
+                                                            os.path.abspath(self.destination.path))
+            for s in self.subdirs:
+                s.persist_in_memory()
 
     @property
     def final_path(self):
@@ -182,4 +235,4 @@ class Assistant(object):
     @property
     def container_of_final_path_exists(self):
         """This returns False if the container for the final path does not exist."""
-        return self.container_of_final_path and os.path.isdir(self.container_of_final_path)
+        return self.container_of_final_path and pathutil.isdir(self.container_of_final_path)
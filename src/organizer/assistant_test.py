@@ -5,8 +5,10 @@
 import os
 import unittest
 from organizer import assistant
+from organizer import destinations
 from organizer import memory
 from organizer import natures
+from organizer import pathutil
 from organizer.testutil import createpaths, dirtree
 
 class TestAssistant(unittest.TestCase):
@@ -173,3 +175,78 @@ class TestAssistant(unittest.TestCase):
                 self.assertEqual(a.nature.__class__, natures.TVShow)
                 self.assertEqual(sb(a.final_path),
                                  "TV/Private practice/Season 6/Private.Practice.S06E18.avi")
+
+    def test_filesystem_calls_bounded(self):
+        mem = memory.SerializableMemory()
+        shows = [ "TV/Show %d/Season 1/a.avi" % n for n in range(100) ]
+        with dirtree(["Sample/Bones S01E01.avi", "Sample/Subs/Bones.srt"]) as orgd:
+            with dirtree(shows + ["TV/Bones/Season 1/b.avi"]) as dstd:
+                mem.remember_destination_for_nature(natures.TVShowFolder,
+                                                    os.path.join(dstd, "TV"))
+                with pathutil.counting() as calls:
+                    a = assistant.Assistant(mem, os.path.join(orgd, "Sample"))
+                    a.begin()
+                    assert a.container_of_final_path_exists
+                self.assertEqual(a.final_path, os.path.join(dstd, "TV/Bones/Season 1/Sample"))
+                # Neither grows with the number of shows in the destination.
+                assert calls["dirread"] <= 4, calls
+                assert calls["stat"] <= 2, calls
+                assert set(calls) <= set(["dirread", "stat"]), calls
+
+    def test_incremental_recomputation(self):
+        mem = memory.SerializableMemory()
+        with dirtree(["dl/Bones.S01E01.avi"]) as orgd:
+            with dirtree(["TV/Bones/Season 1/b.avi", "TV/Castle/Season 2/c.avi",
+                          "Shows/Bones/Season 1/b.avi"]) as dstd:
+                mem.remember_destination_for_nature(natures.TVShow, os.path.join(dstd, "TV"))
+                calls = []
+                old_guess = destinations.Destination.guess_best_hint
+                old_resolve = natures.Nature.resolve
+                def guess_best_hint(dest, hint, subpath=None):
+                    calls.append(("guess", hint))
+                    return old_guess(dest, hint, subpath)
+                def resolve(nature, schemes=None):
+                    calls.append(("resolve",))
+                    return old_resolve(nature, schemes)
+                destinations.Destination.guess_best_hint = guess_best_hint
+                natures.Nature.resolve = resolve
+                try:
+                    a = assistant.Assistant(mem, os.path.join(orgd, "dl/Bones.S01E01.avi"))
+                    a.begin()
+                    self.assertEqual(calls, [("resolve",), ("guess", "Bones")])
+                    steps = [
+                        (lambda: a.change_subdir(2, "Bones 1x01.avi"), []),
+                        (lambda: a.change_subdir(1, "Season 2"), []),
+                        (lambda: a.change_subdir(0, "castle"), [("guess", "castle")]),
+                        (lambda: a.change_destination(os.path.join(dstd, "Shows")), [("guess", "castle")]),
+                    ]
+                    for step, expected in steps:
+                        del calls[:]
+                        step()
+                        self.assertEqual(calls, expected)
+                        incremental = (a.final_path, a.speculated)
+                        a._recompute_subdirs()
+                        self.assertEqual((a.final_path, a.speculated), incremental)
+                finally:
+                    destinations.Destination.guess_best_hint = old_guess
+                    natures.Nature.resolve = old_resolve
+
+    def test_no_resolution_without_destination(self):
+        with dirtree(["dl/Bones.S01E01.avi"]) as orgd:
+            resolves = []
+            old_resolve = natures.Nature.resolve
+            def resolve(nature, schemes=None):
+                resolves.append(nature)
+                return old_resolve(nature, schemes)
+            natures.Nature.resolve = resolve
+            try:
+                a = assistant.Assistant(memory.NoMemory(), os.path.join(orgd, "dl/Bones.S01E01.avi"))
+                a.begin()
+                self.assertEqual((a.final_path, a.container_of_final_path, a.speculated),
+                                 (None, None, ()))
+                self.assertEqual(resolves, [])
+                self.assertEqual([str(s) for s in a.subdirs],
+                                 ["Bones", "Season 1", "Bones.S01E01.avi"])
+                self.assertEqual(len(resolves), 1)
+            finally:
+                natures.Nature.resolve = old_resolve
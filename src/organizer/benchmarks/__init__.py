@@ -0,0 +1,51 @@
+#!/usr/bin/python3
+
+'''Benchmarks.
+
+These measure how long the organizer takes to do its work.  Run them all
+with python3 -m organizer.benchmarks, or a single one with, for example,
+python3 -m organizer.benchmarks.parser.
+
+Every time reported is kept in results, so that a run of all of them can
+be compared against a baseline saved by an earlier run.'''
+
+import collections
+import json
+import time
+
+results = collections.OrderedDict()
+
+def measure(func, number=1, repeat=5):
+    """Calls func number times, repeat times over, and returns the best
+    time per call, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, seconds):
+    """Prints the time taken by a benchmark, and keeps it in results."""
+    results[name] = seconds
+    print("%-60s %12.1f us" % (name, seconds * 1e6))
+
+def save_baseline(path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=0, sort_keys=True)
+        f.write("\n")
+
+def regressions(path, tolerance):
+    """Returns (name, baseline, now) for every result that is more than
+    tolerance, a fraction, slower than in the baseline saved at path."""
+    with open(path) as f:
+        baseline = json.load(f)
+    slower = []
+    for name, seconds in results.items():
+        before = baseline.get(name)
+        if before is not None and seconds > before * (1 + tolerance):
+            slower.append((name, before, seconds))
+    return slower
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+'''Runs every benchmark, and compares the results with a baseline.
+
+The baseline is saved with --save-baseline.  The run fails when any
+result is slower than in the baseline by more than the tolerance, or when
+a benchmark that has a budget goes over it.'''
+
+import argparse
+import os
+import sys
+from organizer import benchmarks
+from organizer.benchmarks import library
+from organizer.benchmarks import memory
+from organizer.benchmarks import parser
+from organizer.benchmarks import startup
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+def main():
+    argparser = argparse.ArgumentParser(description="Run the organizer benchmarks.")
+    argparser.add_argument("--baseline", default=BASELINE,
+                           help="the baseline to compare with (default %(default)s)")
+    argparser.add_argument("--save-baseline", action="store_true", default=False,
+                           help="save the results as the baseline instead of comparing them with it")
+    argparser.add_argument("--tolerance", type=float, default=0.25,
+                           help="how much slower than the baseline a result may be, as a fraction (default %(default)s)")
+    args = argparser.parse_args()
+    failures = 0
+    for module in (parser, memory, library, startup):
+        failures += module.run() or 0
+    if args.save_baseline:
+        benchmarks.save_baseline(args.baseline)
+    elif os.path.exists(args.baseline):
+        for name, before, now in benchmarks.regressions(args.baseline, args.tolerance):
+            print("REGRESSION %s: %.1f us, was %.1f us (+%d%%)" % (
+                  name, now * 1e6, before * 1e6, (now / before - 1) * 100))
+            failures += 1
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+
+'''Media library benchmarks.
+
+These build a synthetic media library, with thousands of show and artist
+folders, and a download folder with a realistic mix of episodes, season
+folders with subtitles, movies, albums and compilations, then time the
+organizer working through the downloads.'''
+
+import contextlib
+import os
+import random
+import sys
+from organizer import destinations
+from organizer import memory
+from organizer import natures
+from organizer import ops
+from organizer import program
+from organizer.benchmarks import measure, report
+from organizer.testutil import dirtree
+
+WORDS = """
+alpha bones castle dexter echo falcon garden harbor island jungle kingdom
+legend mercy north ocean prairie quantum river shadow thunder union valley
+winter yellow zenith amber bishop copper desert ember frontier glacier
+hollow iron jasper kestrel lantern meadow nomad orchid pioneer quarry raven
+summit timber umbra vortex willow xenon yonder zephyr
+""".split()
+
+def name_of(rng, words=2):
+    return " ".join(rng.choice(WORDS).capitalize() for _ in range(words))
+
+def dotted(name):
+    return name.replace(" ", ".")
+
+def library(shows=2000, artists=1000, seed=0):
+    """Returns the paths of the files in a synthetic destination library,
+    with a TV folder of shows and a Music folder of artists, and the names
+    of the shows and artists in it."""
+    rng = random.Random(seed)
+    show_names = sorted(set(name_of(rng, 3) for _ in range(shows * 2)))[:shows]
+    artist_names = sorted(set(name_of(rng, 2) + " " + name_of(rng, 1)
+                              for _ in range(artists * 2)))[:artists]
+    paths = []
+    for show in show_names:
+        season = rng.randint(1, 5)
+        paths.append("TV/%s/Season %d/%s.S%02dE01.mkv" % (show, season, dotted(show), season))
+    for artist in artist_names:
+        album = name_of(rng, 2)
+        paths.append("Music/%s/%s/01 - %s.mp3" % (artist, album, name_of(rng, 2)))
+    return paths, show_names, artist_names
+
+def downloads(show_names, artist_names, count=200, seed=1):
+    """Returns the paths of the files in a synthetic download folder with
+    count items, and the items themselves."""
+    rng = random.Random(seed)
+    paths = []
+    items = []
+    for n in range(count):
+        kind = n % 6
+        show = rng.choice(show_names)
+        season, episode = rng.randint(1, 9), rng.randint(1, 24)
+        if kind in (0, 1):
+            item = "%s.S%02dE%02d.720p.HDTV.x264-GRP%d.mkv" % (dotted(show), season, episode, n)
+            paths.append("dl/" + item)
+        elif kind == 2:
+            item = "%s.S%02d.1080p.WEB-DL-GRP%d" % (dotted(show), season, n)
+            for e in range(1, 4):
+                paths.append("dl/%s/%s.S%02dE%02d.1080p.mkv" % (item, dotted(show), season, e))
+                paths.append("dl/%s/Subs/%s.S%02dE%02d.en.srt" % (item, dotted(show), season, e))
+        elif kind == 3:
+            item = "%s.%d.1080p.BluRay.x264-GRP%d.mkv" % (dotted(name_of(rng, 2)), rng.randint(1970, 2020), n)
+            paths.append("dl/" + item)
+        elif kind == 4:
+            item = "%s - %s (%d)" % (rng.choice(artist_names), name_of(rng, 2), 2000 + n % 20)
+            for t in range(1, 9):
+                paths.append("dl/%s/%02d - %s.mp3" % (item, t, name_of(rng, 2)))
+        else:
+            item = "VA - %s Hits %d" % (name_of(rng, 1), 2000 + n)
+            for t in range(1, 9):
+                paths.append("dl/%s/%02d - %s - %s.mp3" % (item, t, rng.choice(artist_names), name_of(rng, 2)))
+        items.append("dl/" + item)
+    return paths, items
+
+@contextlib.contextmanager
+def synthetic_tree(shows=2000, artists=1000, count=200):
+    """Creates a library and a download folder in a temporary directory,
+    and yields the directory, the download items in it, and the names of
+    the shows."""
+    libpaths, show_names, artist_names = library(shows, artists)
+    dlpaths, items = downloads(show_names, artist_names, count)
+    with dirtree(libpaths + dlpaths) as d:
+        yield d, [ os.path.join(d, i) for i in items ], show_names
+
+def run(shows=2000, artists=1000, count=200):
+    print("Library of %d shows and %d artists, %d downloads" % (shows, artists, count))
+    with synthetic_tree(shows, artists, count) as (d, items, show_names):
+        report("library, detect_nature per download",
+               measure(lambda: [ natures.detect_nature(i) for i in items ]) / len(items))
+
+        found = [ natures.detect_nature(i) for i in items ]
+        report("library, Nature.resolve per download",
+               measure(lambda: [ n.resolve() for n in found ]) / len(found))
+
+        hints = [ s.upper().replace(" ", ".") for s in show_names[::10] ]
+        listings = destinations.Listings()
+        def guess_cold():
+            dest = destinations.Destination(os.path.join(d, "TV"), listings)
+            dest.guess_best_hint(hints[0])
+        report("library, guess_best_hint, first guess",
+               measure(guess_cold))
+        dest = destinations.Destination(os.path.join(d, "TV"), listings)
+        report("library, guess_best_hint, later guesses",
+               measure(lambda: [ dest.guess_best_hint(h) for h in hints ]) / len(hints))
+        try:
+            import numpy
+            label = "library, guess_best_hints per hint, NumPy"
+        except ImportError:
+            label = "library, guess_best_hints per hint, pure Python"
+        report(label, measure(lambda: dest.guess_best_hints(hints)) / len(hints))
+
+        mem = memory.SerializableMemory()
+        mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+        mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+        mem.remember_destination_for_nature(natures.TVShowFolder, os.path.join(d, "TV"))
+        mem.remember_destination_for_nature(natures.Album, os.path.join(d, "Music"))
+        mem.remember_destination_for_nature(natures.Compilation, os.path.join(d, "Music"))
+        def batch():
+            p = program.BatchProgram(ops.CLIReportOperator(), mem, items,
+                                     destinations.Listings())
+            p.display_to_user = lambda msg: None
+            with open(os.devnull, "w") as null, contextlib.redirect_stdout(null):
+                p.mainloop()
+        report("library, BatchProgram.mainloop per download",
+               measure(batch, repeat=3) / len(items))
+
+if __name__ == "__main__":
+    run(*[int(a) for a in sys.argv[1:]])
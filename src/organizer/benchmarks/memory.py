@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+'''Memory benchmarks.
+
+These time how long it takes to load a memory from disk and recall one
+hint from it, and to load one, learn one hint and save it, at several
+sizes, for each format the memory can be kept in.'''
+
+import os
+import sys
+from organizer import memory
+from organizer import natures
+from organizer.benchmarks import measure, report
+from organizer.testutil import dirtest
+
+SIZES = (10000, 100000, 1000000)
+
+def make_memory(size):
+    m = memory.SerializableMemory()
+    m.remember_destination_for_nature(natures.TVShow, "/srv/media/TV")
+    for n in range(size):
+        m.remember_associated_hint("Some.Show.Name.%d" % n, "Some Show Name %d" % n)
+    return m
+
+def run(sizes=SIZES):
+    for size in sizes:
+        with dirtest() as d:
+            pickled = os.path.join(d, "organizer")
+            with open(pickled, "wb") as f:
+                f.write(make_memory(size).serialize())
+            hint = "Some.Show.Name.%d" % (size // 2)
+
+            def load_pickle():
+                with open(pickled, "rb") as f:
+                    m = memory.SerializableMemory.deserialize(f.read())
+                m.recall_associated_hint(hint)
+
+            mapped = memory.MappedMemory.open(os.path.join(d, "mmap"), pickled)
+            mapped.close()
+            def load_mapped():
+                m = memory.MappedMemory(os.path.join(d, "mmap"))
+                m.recall_associated_hint(hint)
+                m.close()
+
+            sqlite = memory.SQLiteMemory.open(os.path.join(d, "sqlite"), pickled)
+            sqlite.close()
+            def load_sqlite():
+                m = memory.SQLiteMemory(os.path.join(d, "sqlite"))
+                m.recall_associated_hint(hint)
+                m.close()
+
+            def save_pickle():
+                m = memory.SerializableMemory.deserialize(open(pickled, "rb").read())
+                m.remember_associated_hint(hint, "Learned")
+                with open(pickled, "wb") as f:
+                    f.write(m.serialize())
+            def save_mapped():
+                m = memory.MappedMemory(os.path.join(d, "mmap"))
+                m.remember_associated_hint(hint, "Learned")
+                m.save()
+                m.close()
+            def save_sqlite():
+                m = memory.SQLiteMemory(os.path.join(d, "sqlite"))
+                m.remember_associated_hint(hint, "Learned")
+                m.close()
+
+            repeat = 3 if size > 100000 else 5
+            report("load and recall, pickle, %d hints" % size, measure(load_pickle, repeat=repeat))
+            report("load and recall, mapped, %d hints" % size, measure(load_mapped, repeat=repeat))
+            report("load and recall, sqlite, %d hints" % size, measure(load_sqlite, repeat=repeat))
+            report("load, learn and save, pickle, %d hints" % size, measure(save_pickle, repeat=repeat))
+            report("load, learn and save, mapped, %d hints" % size, measure(save_mapped, repeat=repeat))
+            report("load, learn and save, sqlite, %d hints" % size, measure(save_sqlite, repeat=repeat))
+
+if __name__ == "__main__":
+    run([int(s) for s in sys.argv[1:]] or SIZES)
@@ -0,0 +1,42 @@
+#!/usr/bin/python3
+
+'''File name parser benchmarks.
+
+These time the file name parser on the kind of long scene release names
+that made the old ^(.*). patterns backtrack.'''
+
+import re
+from organizer import natures
+from organizer.benchmarks import measure, report
+
+LEGACY_SEASONRES = [
+    r"^(.*).S(eason)?[. ]*([0-9]+)\s*E(p(isode)?)?[. ]*([0-9]+)",
+    r"^(.*)(.)([0-9]+)x([0-9][0-9]+)",
+]
+
+PATHOLOGICAL = [
+    ("typical", "Greys.Anatomy.S08E14.HDTV.XviD-ENCODED.avi"),
+    ("no episode marker", ("Some.Very.Long.Release.Name." * 9)[:246] + ".mkv"),
+    ("S repeated", ("a.S" * 84)[:246] + ".mkv"),
+    ("S and digits repeated", ("S. 1 " * 50)[:246] + ".mkv"),
+    ("digit run before x", "1" * 245 + "x.mkv"),
+    ("Season repeated", ("Season " * 36)[:246] + ".mkv"),
+]
+
+def legacy_parse(base):
+    for seasonre in LEGACY_SEASONRES:
+        partitioned = re.findall(seasonre, base, re.I)
+        if partitioned:
+            return partitioned
+    return None
+
+def run():
+    uncached = natures.parse_filename.__wrapped__
+    for label, name in PATHOLOGICAL:
+        report("parse_filename, legacy patterns, %s" % label,
+               measure(lambda: legacy_parse(name), number=20))
+        report("parse_filename, %s" % label,
+               measure(lambda: uncached(name), number=20))
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,94 @@
+#!/usr/bin/python3
+
+'''Startup benchmarks.
+
+These time how long a cold organizer process takes to get to work, by
+running it afresh with --help and with a batch whose only file is
+skipped, and fail when that takes longer than the budget.  The budget is
+in milliseconds, and is set with the first argument or with the
+ORGANIZER_STARTUP_BUDGET_MS environment variable.
+
+Modules that are slow to import, and that only some runs need, must not
+be imported at startup.  These are checked for as well.'''
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import organizer
+from organizer.benchmarks import report
+
+BUDGET_MS = 150
+
+LAZY_MODULES = ("jinja2", "difflib", "concurrent.futures", "traceback",
+                "organizer.ops", "organizer.transfer", "organizer.dupes",
+                "organizer.plans", "organizer.scheduler")
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(organizer.__file__))),
+                      os.pardir, "bin", "organizer")
+
+def command(*args):
+    """Returns the command line that runs the organizer with args."""
+    if os.path.isfile(SCRIPT):
+        return [sys.executable, SCRIPT] + list(args)
+    return [sys.executable, "-c",
+            "import sys; from organizer.program import mainloop; sys.exit(mainloop())"] + list(args)
+
+def environment(home):
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["PYTHONPATH"] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(organizer.__file__)))] +
+        [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    return env
+
+def time_command(cmd, env, repeat=5):
+    """Runs cmd repeat times, and returns the best time it took, in
+    seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, stdin=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def imported_at_startup(env):
+    """Returns the slow modules that importing the program pulls in."""
+    code = ("import sys; import organizer.program; "
+            "print(' '.join(m for m in %r if m in sys.modules))" % (LAZY_MODULES,))
+    out = subprocess.check_output([sys.executable, "-c", code], env=env)
+    return out.decode("utf-8").split()
+
+def run(budget_ms=None):
+    """Runs the benchmarks, and returns how many budgets were exceeded."""
+    if budget_ms is None:
+        budget_ms = float(os.environ.get("ORGANIZER_STARTUP_BUDGET_MS", BUDGET_MS))
+    failures = 0
+    with tempfile.TemporaryDirectory() as home:
+        env = environment(home)
+        skipped = os.path.join(home, "nothing.avi")
+        open(skipped, "wb").close()
+        interpreter = time_command([sys.executable, "-c", "pass"], env)
+        report("startup, bare interpreter", interpreter)
+        for label, cmd in (
+            ("startup, --help", command("--help")),
+            ("startup, batch with one skipped file", command("-b", "--no-daemon", skipped)),
+        ):
+            elapsed = time_command(cmd, env)
+            report(label, elapsed)
+            if (elapsed - interpreter) * 1000 > budget_ms:
+                print("%s took %.1f ms over the interpreter, over the budget of %.1f ms" % (
+                      label, (elapsed - interpreter) * 1000, budget_ms))
+                failures += 1
+        slow = imported_at_startup(env)
+        if slow:
+            print("imported at startup, but needed only by some runs: %s" % ", ".join(slow))
+            failures += 1
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(1 if run(float(sys.argv[1]) if len(sys.argv) > 1 else None) else 0)
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+'''Daemon.
+
+This code keeps an organizer running in the background, with its memory,
+schemes and destination listings at hand, and lets batch runs of the
+organizer hand their work to it through a Unix domain socket, instead of
+loading all of that anew every time.
+
+A client sends one JSON line with its command line arguments and working
+directory.  The daemon answers with JSON lines, each one of
+{"out": message}, {"err": message}, {"ask": prompt}, and finally
+{"exit": status}; or with {"refused": reason}, after which the client
+organizes the files itself, as it does when the connection is closed
+without a reply.  The client answers every prompt with one JSON line,
+{"yes": answer}.
+
+This module is imported by the client on every run, so it imports
+nothing else at startup.'''
+
+import json
+import os
+import socket
+import sys
+import time
+from organizer import pathutil
+
+IDLE_SECONDS = 600
+START_SECONDS = 5
+
+def socket_path():
+    """Returns the path of the socket the daemon of this user listens on."""
+    rundir = os.environ.get("XDG_RUNTIME_DIR")
+    if rundir and pathutil.isdir(rundir):
+        return os.path.join(rundir, "organizer.sock")
+    return os.path.expanduser("~/.organizer.sock")
+
+def wants_daemon(argv):
+    """Returns True if the command line is a batch run the daemon may
+    carry out.  This is a quick look; the daemon checks again."""
+    batch = False
+    for a in argv:
+        if a == "--":
+            break
+        if a in ("--daemon", "--no-daemon", "--help", "--stats", "--external-tools") or \
+           a.startswith("--watch") or a.startswith("--profile") or \
+           a.startswith("--plan") or a.startswith("--apply"):
+            return False
+        if a == "--batch":
+            batch = True
+        elif a.startswith("-") and not a.startswith("--") and not a[1:].isdigit():
+            if "h" in a[1:]:
+                return False
+            if "b" in a[1:]:
+                batch = True
+    return batch
+
+def connect(path):
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(path)
+    except OSError:
+        s.close()
+        raise
+    return s
+
+def start_daemon():
+    """Starts a daemon in the background, detached from this process."""
+    import subprocess
+    env = dict(os.environ)
+    here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(
+        [here] + [p for p in env.get("PYTHONPATH", "").split(os.pathsep) if p])
+    subprocess.Popen([sys.executable, "-m", "organizer.daemon"], env=env,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True,
+                     cwd="/")
+
+def connect_or_start(path):
+    """Connects to the daemon, starting it if it is not running.  Returns
+    None if no daemon could be reached."""
+    try:
+        return connect(path)
+    except OSError:
+        pass
+    start_daemon()
+    deadline = time.monotonic() + START_SECONDS
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        try:
+            return connect(path)
+        except OSError:
+            pass
+    return None
+
+def forward(argv, path=None):
+    """Hands the batch run described by argv to the daemon, printing what
+    the daemon reports.  Returns the exit status of the run, or None if the
+    run must be carried out by this process instead."""
+    if not wants_daemon(argv):
+        return None
+    s = connect_or_start(path or socket_path())
+    if s is None:
+        return None
+    # Writes are not buffered, so that a daemon that went away is noticed
+    # when writing, and not again when the connection is closed.
+    with s, s.makefile("rb") as f:
+        try:
+            s.sendall(json.dumps({"argv": argv, "cwd": os.getcwd()}).encode("utf-8") + b"\n")
+        except OSError:
+            return None
+        replied = False
+        try:
+            for line in f:
+                replied = True
+                reply = json.loads(line.decode("utf-8"))
+                if "out" in reply:
+                    print(reply["out"], file=sys.stdout)
+                elif "err" in reply:
+                    print(reply["err"], file=sys.stderr)
+                elif "ask" in reply:
+                    # Only batch runs are forwarded, and batch runs never
+                    # replace what is already there, as if nobody answered.
+                    print(reply["ask"], file=sys.stderr)
+                    s.sendall(json.dumps({"yes": False}).encode("utf-8") + b"\n")
+                elif "exit" in reply:
+                    return reply["exit"]
+                elif "refused" in reply:
+                    return None
+        except OSError:
+            pass
+    if not replied:
+        # The daemon was shutting down, and closed the connection without
+        # looking at the run.
+        return None
+    # The daemon went away before finishing.
+    print("The organizer daemon stopped while organizing", file=sys.stderr)
+    return 14
+
+class Daemon(object):
+    """The Daemon carries out the batch runs sent to it one at a time,
+    against a memory, schemes and listings it keeps between runs."""
+
+    def __init__(self, memory_format):
+        from organizer import program
+        self.program = program
+        self.memory_format = memory_format
+        self.memory = program.open_memory(memory_format)
+        self.listings = program.load_listings()
+        self.schemes_mtime = None
+        self.load_schemes()
+
+    def load_schemes(self):
+        """Loads the schemes again if their file changed since last time,
+        going back to the default schemes of the natures it no longer
+        names, or of all of them if it is gone."""
+        try:
+            mtime = pathutil.stat(os.path.expanduser("~/.organizer-schemes")).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime != self.schemes_mtime:
+            self.program.natures.reset_schemes()
+            if mtime is not None:
+                self.program.load_schemes()
+        self.schemes_mtime = mtime
+
+    def refusal(self, request):
+        """Returns why the request cannot be carried out here, and parses
+        its arguments into request["args"] if it can."""
+        try:
+            args = self.program.parse_args(request["argv"])
+        except SystemExit:
+            return "invalid arguments"
+        if not args.batch or args.plan or args.apply or args.watch or \
+           args.daemon or args.no_daemon:
+            return "not a batch run"
+        if args.stats or args.profile:
+            return "measuring asked for"
+        if args.external_tools:
+            return "external tools talk to the terminal"
+        if args.memory_format != self.memory_format:
+            return "memory kept in another format"
+        if args.files_from == "-":
+            return "files listed on standard input"
+        cwd = request["cwd"]
+        args.files = [ os.path.join(cwd, f) for f in args.files ]
+        args.recurse = [ os.path.join(cwd, f) for f in args.recurse ]
+        if args.files_from:
+            args.files_from = os.path.join(cwd, args.files_from)
+        request["args"] = args
+        return None
+
+    def run(self, request, send, receive=lambda: None):
+        """Carries out a request, sending what is displayed and the errors
+        and questions of the operator through send, and returns the exit
+        status.  receive returns the next reply of the client, or None if
+        it went away."""
+        args = request["args"]
+        try:
+            self.load_schemes()
+        except Exception as e:
+            send({"err": "Cannot load schemes: %s" % e})
+            return 16
+        try:
+            files_from = self.program.open_organizees(args)
+        except OSError as e:
+            send({"err": "Cannot read the list of files: %s" % e})
+            return 2
+        try:
+            return self._run(args, send, receive)
+        finally:
+            if files_from is not None:
+                files_from.close()
+
+    def _run(self, args, send, receive):
+        operator = self.program.make_operator(args, self.listings)
+        operator.report_error = lambda msg: send({"err": msg})
+
+        def ask(prompt):
+            send({"ask": prompt})
+            reply = receive()
+            return bool(reply and reply.get("yes"))
+        operator.ask = ask
+        p = self.program.make_batch_program(args, operator, self.memory, self.listings)
+        p.display_to_user = lambda msg: send({"out": msg})
+        p.display_error = lambda msg: send({"err": msg})
+        status = 0
+        try:
+            p.mainloop()
+        except Exception as e:
+            p.display_error("Unexpected exception while running: %s" % e)
+            status = 14
+        # What was learned is saved even if the run failed half way, since
+        # the daemon goes on running.
+        try:
+            self.program.flush_memory(self.memory)
+        except Exception as e:
+            p.display_error("Cannot save memory: %s" % e)
+            status = status or 18
+        if self.listings.dirty:
+            try:
+                self.program.save_listings(self.listings)
+            except Exception as e:
+                p.display_error("Cannot save destination listings: %s" % e)
+        return status
+
+    def close(self):
+        self.program.save_memory(self.memory)
+
+def serve(memory_format="sqlite", path=None, idle_seconds=IDLE_SECONDS):
+    """Runs the daemon until it has been idle for idle_seconds.  Returns
+    right away if another daemon is already running."""
+    import fcntl
+    import signal
+    import socketserver
+    import threading
+    path = path or socket_path()
+    lockfile = open(path + ".lock", "w")
+    try:
+        fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lockfile.close()
+        return 0
+    try:
+        daemon = Daemon(memory_format)
+    except Exception as e:
+        print("Cannot start the organizer daemon: %s" % e, file=sys.stderr)
+        lockfile.close()
+        return 16
+    lock = threading.Lock()
+    state = {"active": 0, "last": time.monotonic()}
+
+    class Handler(socketserver.StreamRequestHandler):
+
+        def send(self, reply):
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+        def receive(self):
+            try:
+                return json.loads(self.rfile.readline().decode("utf-8"))
+            except ValueError:
+                return None
+
+        def handle(self):
+            try:
+                request = json.loads(self.rfile.readline().decode("utf-8"))
+            except ValueError:
+                return
+            with lock:
+                state["active"] += 1
+                try:
+                    reason = daemon.refusal(request)
+                    if reason:
+                        self.send({"refused": reason})
+                        return
+                    status = daemon.run(request, self.send, self.receive)
+                    self.send({"exit": status})
+                except OSError:
+                    # The client went away.
+                    pass
+                finally:
+                    state["active"] -= 1
+                    state["last"] = time.monotonic()
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        pass
+
+    if pathutil.exists(path):
+        os.unlink(path)
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(old_umask)
+    server.timeout = 1
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while state["active"] or time.monotonic() - state["last"] < idle_seconds:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        with lock:
+            daemon.close()
+        lockfile.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(serve())
@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+
+'''Daemon tests.'''
+
+import contextlib
+import io
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+from organizer import daemon
+from organizer import memory
+from organizer import natures
+from organizer.testutil import dirtree
+
+class TestDaemon(unittest.TestCase):
+
+    tree = [
+        "dl/Bones.S01E01.avi",
+        "dl/Bones.S01E02.avi",
+        "TV/Bones/Season 1/Bones.S01E03.avi",
+    ]
+
+    def test_wants_daemon(self):
+        assert daemon.wants_daemon(["-b", "a.avi"])
+        assert daemon.wants_daemon(["-j", "4", "-bn", "a.avi"])
+        assert daemon.wants_daemon(["--batch", "--", "-h"])
+        assert not daemon.wants_daemon(["a.avi"])
+        assert not daemon.wants_daemon(["-b", "--no-daemon", "a.avi"])
+        assert not daemon.wants_daemon(["-b", "--plan", "-", "a.avi"])
+        assert not daemon.wants_daemon(["-bh"])
+
+    @contextlib.contextmanager
+    def serving(self, d):
+        """Runs a daemon for the home directory d, and yields the path of
+        its socket."""
+        j = lambda *p: os.path.join(d, *p)
+        old_home = os.environ.get("HOME")
+        os.environ["HOME"] = d
+        try:
+            mem = memory.SQLiteMemory(j(".organizer.sqlite"))
+            mem.remember_destination_for_nature(natures.TVShow, j("TV"))
+            mem.close()
+            path = j("sock")
+            server = threading.Thread(target=daemon.serve,
+                                      kwargs=dict(path=path, idle_seconds=0.5))
+            server.start()
+            while not os.path.exists(path):
+                time.sleep(0.01)
+            try:
+                yield path
+            finally:
+                server.join()
+        finally:
+            os.environ["HOME"] = old_home
+
+    def test_forward(self):
+        with dirtree(self.tree) as d:
+            j = lambda *p: os.path.join(d, *p)
+            with self.serving(d) as path:
+                old_cwd = os.getcwd()
+                os.chdir(j("dl"))
+                out = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(out):
+                        self.assertEqual(daemon.forward(["-b", "Bones.S01E01.avi"], path), 0)
+                        self.assertEqual(daemon.forward(["-bn", "Bones.S01E02.avi"], path), 0)
+                        self.assertEqual(daemon.forward(["-b", "--memory-format", "pickle",
+                                                         "Bones.S01E02.avi"], path), None)
+                finally:
+                    os.chdir(old_cwd)
+            assert os.path.isfile(j("TV/Bones/Season 1/Bones.S01E01.avi"))
+            assert os.path.isfile(j("dl/Bones.S01E02.avi"))
+            self.assertEqual(out.getvalue().splitlines(), [
+                "Would  chown %s" % j("dl/Bones.S01E02.avi"),
+                "      create %s" % j("TV/Bones/Season 1"),
+                "        move %s" % j("dl/Bones.S01E02.avi"),
+                "          to %s" % j("TV/Bones/Season 1/Bones.S01E02.avi"),
+            ])
+            assert not os.path.exists(path)
+
+    def test_closed_without_reply(self):
+        with dirtree([]) as d:
+            path = os.path.join(d, "sock")
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.bind(path)
+            s.listen(1)
+            def close_next():
+                conn, _ = s.accept()
+                conn.close()
+            closer = threading.Thread(target=close_next)
+            closer.start()
+            try:
+                self.assertEqual(daemon.forward(["-b", "a.avi"], path), None)
+            finally:
+                closer.join()
+                s.close()
+
+    def test_operator_asks_client(self):
+        with dirtree(self.tree) as d:
+            j = lambda *p: os.path.join(d, *p)
+            with open(j("TV/Bones/Season 1/Bones.S01E01.avi"), "w") as f:
+                f.write("another cut")
+            err = io.StringIO()
+            old_stdin = sys.stdin
+            # Batch runs never replace anything, whatever the user could say.
+            sys.stdin = io.StringIO("y\n")
+            try:
+                with self.serving(d) as path, contextlib.redirect_stderr(err):
+                    self.assertEqual(daemon.forward(["-b", j("dl/Bones.S01E01.avi")], path), 0)
+            finally:
+                sys.stdin = old_stdin
+            self.assertEqual(err.getvalue(), "mv: overwrite '%s'? \n" % j("TV/Bones/Season 1/Bones.S01E01.avi"))
+            assert os.path.isfile(j("dl/Bones.S01E01.avi"))
+
+    def test_operator_errors_and_prompts_are_sent(self):
+        with dirtree(self.tree) as d:
+            j = lambda *p: os.path.join(d, *p)
+            with open(j("TV/Bones/Season 1/Bones.S01E01.avi"), "w") as f:
+                f.write("another cut")
+            os.mkdir(j("TV/Bones/Season 1/Bones.S01E02.avi"))
+            old_home, old_stdin = os.environ.get("HOME"), sys.stdin
+            os.environ["HOME"] = d
+            # The daemon must not read its own standard input.
+            sys.stdin = io.StringIO("y\n")
+            try:
+                mem = memory.SQLiteMemory(j(".organizer.sqlite"))
+                mem.remember_destination_for_nature(natures.TVShow, j("TV"))
+                mem.close()
+                dm = daemon.Daemon("sqlite")
+                sent = []
+                try:
+                    for episode, answer in (("Bones.S01E01.avi", False), ("Bones.S01E02.avi", True)):
+                        request = {"argv": ["-b", episode], "cwd": j("dl")}
+                        self.assertEqual(dm.refusal(request), None)
+                        dm.run(request, sent.append, lambda: {"yes": answer})
+                finally:
+                    dm.close()
+            finally:
+                os.environ["HOME"], sys.stdin = old_home, old_stdin
+            assert {"ask": "mv: overwrite '%s'? " % j("TV/Bones/Season 1/Bones.S01E01.avi")} in sent, sent
+            assert {"err": "mv: cannot overwrite directory '%s' with non-directory" %
+                    j("TV/Bones/Season 1/Bones.S01E02.avi")} in sent, sent
+            assert os.path.isfile(j("dl/Bones.S01E01.avi"))
+
+    def test_schemes_reset_when_file_goes(self):
+        with dirtree([]) as d:
+            schemes = os.path.join(d, ".organizer-schemes")
+            with open(schemes, "w") as f:
+                f.write("[TVShow]\nschemes = exact {{ filename }}\n")
+            old_home = os.environ.get("HOME")
+            os.environ["HOME"] = d
+            try:
+                from organizer import program
+                dm = daemon.Daemon.__new__(daemon.Daemon)
+                dm.program, dm.schemes_mtime = program, None
+                dm.load_schemes()
+                self.assertEqual(len(natures.TVShow("Bones.S08E02.avi").schemes), 1)
+                os.unlink(schemes)
+                dm.load_schemes()
+                self.assertEqual(len(natures.TVShow("Bones.S08E02.avi").schemes), 3)
+            finally:
+                os.environ["HOME"] = old_home
+                natures.reset_schemes()
@@ -4,43 +4,424 @@
 
 This code handles possible destinations.'''
 
-import difflib
+import bisect
+import collections
 from organizer import pathutil
-import os.path
+import os
+import pickle
+import stat
+import threading
+import time
+
+CELLS = 4 * 1024 * 1024
+INDEXES = 64
+
+def _junk(x):
+    return x in ". -_"
+
+def _bound(matches, length):
+    """Computes a similarity ratio exactly like difflib does."""
+    return 2.0 * matches / length if length else 1.0
+
+class HintIndex(object):
+    """An index of subfolder names that finds the name most similar to a
+    hint, returning the same answer difflib.SequenceMatcher would if it
+    compared the hint against every name, while computing the full ratio
+    for as few names as possible.
+
+    Names sharing the most character trigrams with the hint are scored
+    first, to establish a good ratio early.  Every other name is then
+    considered only if its length falls in the window that could still
+    beat that ratio, and if the cheap real_quick_ratio and quick_ratio
+    upper bounds (computed from lengths and character counts) say it may
+    beat it too.  A lookup thus still goes over every name in the window,
+    if only to bound it: names that share no trigram with the hint can
+    still be the most similar, so trigrams cannot rule them out without
+    giving up on matching difflib.  Building an index costs more than a
+    lookup, so index_of() keeps the indexes of the last INDEXES sets of
+    names built."""
+
+    def __init__(self, names):
+        entries = sorted((len(n.lower()), n.lower(), n) for n in names)
+        self.lengths = [ e[0] for e in entries ]
+        self.lowered = [ e[1] for e in entries ]
+        self.names = [ e[2] for e in entries ]
+        self.counts = [ collections.Counter(l) for l in self.lowered ]
+        self.trigrams = collections.defaultdict(list)
+        for i, l in enumerate(self.lowered):
+            for gram in set(l[j:j + 3] for j in range(len(l) - 2)):
+                self.trigrams[gram].append(i)
+        self._matrix = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def _seeds(self, hint, count=8):
+        shared = collections.Counter()
+        for gram in set(hint[j:j + 3] for j in range(len(hint) - 2)):
+            shared.update(self.trigrams.get(gram, ()))
+        return [ i for i, _ in shared.most_common(count) ]
+
+    def best(self, hint, threshold=0.0):
+        """Returns a (ratio, name) tuple with the name most similar to the
+        hint, or None if no name is at least threshold similar to it.
+        Ties between ratios go to the greatest name.  This takes time linear
+        in the number of names whose lengths are in the window, as every one
+        of them is bounded; only the full ratios are computed for fewer."""
+        hint = hint.lower()
+        lb = len(hint)
+        hintcounts = collections.Counter(hint)
+        import difflib
+        matcher = difflib.SequenceMatcher(_junk)
+        matcher.set_seq2(hint)
+        best = None
+        scored = set()
+
+        def score(i):
+            scored.add(i)
+            matcher.set_seq1(self.lowered[i])
+            return (matcher.ratio(), self.names[i])
+
+        for i in self._seeds(hint):
+            candidate = score(i)
+            if best is None or candidate > best:
+                best = candidate
+
+        def floor():
+            return threshold if best is None else max(threshold, best[0])
+
+        # Lengths outside of [lb * r / (2 - r), lb * (2 - r) / r] cannot reach
+        # a ratio of r.  The window is widened by one on each side to make up
+        # for rounding, since every name in it is checked exactly anyway.
+        r = floor()
+        if r <= 0:
+            lo, hi = 0, len(self.names)
+        else:
+            lo = bisect.bisect_left(self.lengths, int(lb * r / (2 - r)) - 1)
+            hi = bisect.bisect_right(self.lengths, int(lb * (2 - r) / r) + 1)
+        for i in range(lo, hi):
+            if i in scored:
+                continue
+            la = self.lengths[i]
+            r = floor()
+            if _bound(min(la, lb), la + lb) < r:
+                continue
+            counts = self.counts[i]
+            intersection = sum(min(n, counts[c]) for c, n in hintcounts.items())
+            if _bound(intersection, la + lb) < r:
+                continue
+            candidate = score(i)
+            if best is None or candidate > best:
+                best = candidate
+        if best is None or best[0] < threshold:
+            return None
+        return best
+
+    def best_many(self, hints, threshold=0.0):
+        """Returns what best would return for each of the hints, in a list.
+        If NumPy is available, the upper bounds on the ratios of every hint
+        against every name are computed at once, as matrix operations over
+        character counts, and only the names whose bounds can still beat
+        the best ratio found are scored exactly."""
+        try:
+            import numpy
+        except ImportError:
+            return [ self.best(hint, threshold) for hint in hints ]
+        return self._best_many_numpy(numpy, hints, threshold)
+
+    def _count_matrix(self, numpy):
+        if self._matrix is None:
+            columns = dict()
+            for counts in self.counts:
+                for c in counts:
+                    columns.setdefault(c, len(columns))
+            matrix = numpy.zeros((len(self.counts), len(columns)), numpy.int32)
+            for i, counts in enumerate(self.counts):
+                for c, n in counts.items():
+                    matrix[i, columns[c]] = n
+            self._matrix = (columns, matrix, numpy.array(self.lengths, numpy.int64))
+        return self._matrix
+
+    def _best_many_numpy(self, numpy, hints, threshold):
+        import difflib
+        results = []
+        if not self.names:
+            return [ None for _ in hints ]
+        columns, matrix, lengths = self._count_matrix(numpy)
+        # Hints are bounded in chunks, so that the broadcast minimum of their
+        # counts against every name's stays within a few million cells.
+        chunk = max(1, CELLS // matrix.size)
+        for start in range(0, len(hints), chunk):
+            lowered = [ h.lower() for h in hints[start:start + chunk] ]
+            hintmatrix = numpy.zeros((len(lowered), len(columns)), numpy.int32)
+            for i, hint in enumerate(lowered):
+                for c, n in collections.Counter(hint).items():
+                    if c in columns:
+                        hintmatrix[i, columns[c]] = n
+            intersections = numpy.minimum(hintmatrix[:, None, :], matrix[None, :, :]).sum(axis=2)
+            totals = lengths[None, :] + numpy.array([ len(h) for h in lowered ])[:, None]
+            # Computed like _bound, so that the comparisons below are exact.
+            bounds = numpy.where(totals > 0, 2.0 * intersections / numpy.maximum(totals, 1), 1.0)
+            for hint, hintbounds in zip(lowered, bounds):
+                matcher = difflib.SequenceMatcher(_junk)
+                matcher.set_seq2(hint)
+                best = None
+                for i in numpy.argsort(-hintbounds, kind="stable"):
+                    r = threshold if best is None else max(threshold, best[0])
+                    if hintbounds[i] < r:
+                        break
+                    matcher.set_seq1(self.lowered[i])
+                    candidate = (matcher.ratio(), self.names[i])
+                    if best is None or candidate > best:
+                        best = candidate
+                if best is not None and best[0] < threshold:
+                    best = None
+                results.append(best)
+        return results
+
+_indexes = collections.OrderedDict()
+_indexes_lock = threading.Lock()
+
+def index_of(names):
+    """Returns a HintIndex of the names, a tuple, reusing the one built the
+    last time the same names were indexed."""
+    with _indexes_lock:
+        index = _indexes.get(names)
+        if index is not None:
+            _indexes.move_to_end(names)
+            return index
+    index = HintIndex(names)
+    with _indexes_lock:
+        index = _indexes.setdefault(names, index)
+        while len(_indexes) > INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+def list_subfolders(path):
+    """Returns the names of the subfolders in path, leaving out those whose
+    names start with a dot.  The types of the entries come with the listing
+    on most file systems, so they need not be examined one by one."""
+    try:
+        with pathutil.scandir(path) as it:
+            return sorted(e.name for e in it
+                          if not e.name.startswith(".") and e.is_dir())
+    except OSError:
+        return []
+
+class Listings(object):
+    """Listings of the subfolders of destination directories, which can be
+    reconstituted from a serialization format across runs.
+
+    Each listing is revalidated against the modification time of its
+    directory, so unchanged directories are never listed again.  Listings
+    of directories modified in the last RACY_SECONDS are not kept, because
+    a change made within the same timestamp granularity would go unseen."""
+
+    VERSION = 1
+    RACY_SECONDS = 2
+
+    def __init__(self):
+        self.entries = dict()
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def deserialize(klass, pickled):
+        """Constructs new Listings out of a pickle with data.  Listings
+        serialized by a different version start out empty."""
+        version, entries = pickle.loads(pickled)
+        l = klass()
+        if version == klass.VERSION:
+            l.entries = entries
+        return l
+
+    def serialize(self):
+        """Serializes the listings to a string."""
+        with self._lock:
+            return pickle.dumps((self.VERSION, self.entries))
+
+    def __getstate__(self):
+        with self._lock:
+            return {"entries": dict(self.entries), "dirty": self.dirty}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.entries = state["entries"]
+        self.dirty = state["dirty"]
+
+    def _trustworthy(self, st):
+        return time.time_ns() - st.st_mtime_ns > self.RACY_SECONDS * 10 ** 9
+
+    def subfolders(self, path):
+        """Returns the names of the subfolders in path, listing path only
+        if it changed since it was last listed."""
+        try:
+            st = pathutil.stat(path)
+        except OSError:
+            return []
+        if not stat.S_ISDIR(st.st_mode):
+            return []
+        cached = self.entries.get(path)
+        if cached is not None and cached[0] == st.st_mtime_ns:
+            return list(cached[1])
+        names = list_subfolders(path)
+        if self._trustworthy(st):
+            with self._lock:
+                self.entries[path] = (st.st_mtime_ns, tuple(names))
+                self.dirty = True
+        return names
+
+    def directories_created(self, path):
+        """Forgets the listings of the parents of path, which has just been
+        created as a directory along with any missing parents.  Creating a
+        directory modifies its parent, and a listing of a directory
+        modified in the last RACY_SECONDS cannot be trusted, so the parents
+        that gained a directory are listed again when next asked for.  The
+        listings of the parents that did not change are kept."""
+        with self._lock:
+            while True:
+                parent = os.path.dirname(path)
+                if parent == path:
+                    break
+                if parent in self.entries:
+                    try:
+                        st = pathutil.stat(parent)
+                    except OSError:
+                        st = None
+                    if st is None or not self._trustworthy(st):
+                        del self.entries[parent]
+                        self.dirty = True
+                path = parent
+
+class Guesses(object):
+    """A memo of the subfolders of destination directories, and of the
+    guesses made against them, kept for the length of a run, so that
+    guessing where many organizees of the same show go lists and scores
+    the show folders once.  listings, a Listings object, is used when
+    directories have to be listed.
+
+    The memo of a directory is forgotten when an Operator this object
+    listens to changes its subfolders: when it creates a directory in it,
+    moves a directory into it, or removes one of its subfolders."""
+
+    def __init__(self, listings=None):
+        self.listings = listings
+        self.directories = dict()
+        self._lock = threading.Lock()
+
+    def _memo(self, directory):
+        with self._lock:
+            memo = self.directories.get(directory)
+        if memo is None:
+            if self.listings is not None:
+                names = self.listings.subfolders(directory)
+            else:
+                names = list_subfolders(directory)
+            names = tuple(names)
+            memo = (names, index_of(names), dict())
+            with self._lock:
+                memo = self.directories.setdefault(directory, memo)
+        return memo
+
+    def subfolders(self, directory):
+        """Returns the names of the subfolders in directory."""
+        return list(self._memo(directory)[0])
+
+    def index(self, directory):
+        """Returns a HintIndex of the subfolders in directory."""
+        return self._memo(directory)[1]
+
+    def guess(self, directory, hint, threshold):
+        """Returns what the index of directory finds best for hint."""
+        _, index, guesses = self._memo(directory)
+        key = (hint, threshold)
+        with self._lock:
+            if key in guesses:
+                return guesses[key]
+        best = index.best(hint, threshold)
+        with self._lock:
+            guesses[key] = best
+        return best
+
+    def _changed(self, path, added):
+        """Forgets the memo of the parent of path if its subfolders changed,
+        because path was added to it as a subfolder if added is True, or
+        removed from it otherwise."""
+        parent = os.path.dirname(path)
+        with self._lock:
+            memo = self.directories.get(parent)
+            if memo is not None and (os.path.basename(path) in memo[0]) != added:
+                del self.directories[parent]
+
+    def directories_created(self, path):
+        while True:
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            self._changed(path, True)
+            path = parent
+
+    def moved_into(self, path):
+        with self._lock:
+            cached = os.path.dirname(path) in self.directories
+        if cached and pathutil.isdir(path):
+            self._changed(path, True)
+
+    def removed(self, path):
+        self._changed(path, False)
 
 class Destination(object):
 
     path = None
 
-    def __init__(self, path):
+    def __init__(self, path, listings=None, guesses=None):
+        """The optional listings is a Listings object used to avoid listing
+        the destination's directories when they have not changed.  The
+        optional guesses is a Guesses object, which, if passed, is used to
+        list the directories and make the guesses instead."""
         self.path = os.path.abspath(pathutil.ensure_non_unicode(path))
+        self.listings = listings
+        self.guesses = guesses
 
     def __str__(self):
         return self.path
 
+    def _directory(self, subpath):
+        if subpath:
+            return os.path.join(self.path, subpath)
+        return self.path
+
     def _get_hints(self, subpath):
         """Returns possible subfolders in destination."""
-        path = self.path
-        if subpath:
-            path = os.path.join(path, subpath)
-        contents = pathutil.glob(path, "*")
-        contents = [ os.path.basename(p) for p in contents if os.path.isdir(p) ]
-        return contents
+        path = self._directory(subpath)
+        if self.guesses is not None:
+            return self.guesses.subfolders(path)
+        if self.listings is not None:
+            return self.listings.subfolders(path)
+        return list_subfolders(path)
 
     def guess_best_hint(self, hint, subpath=None):
         """Returns best possible subfolder based on a string hint.  May return
         None for no good hint.  Note that this does not return a full path."""
-        contents = [ (x.lower(), x) for x in self._get_hints(subpath=subpath) ]
-        junk = lambda x: x in ". -_"
-        distances = [
-            (difflib.SequenceMatcher(junk, c[0], hint.lower()).ratio(), c[1])
-             for c in contents
-        ]
-        distances = list(sorted(distances))
-        if not distances:
-            return None
-        shortestdistance = distances[-1]
-        ratio, besthint = shortestdistance
-        if ratio < 0.5:
+        if self.guesses is not None:
+            best = self.guesses.guess(self._directory(subpath), hint, 0.5)
+        else:
+            best = self._get_index(subpath).best(hint, 0.5)
+        if best is None:
             return None
+        _, besthint = best
         return besthint
+
+    def guess_best_hints(self, hints, subpath=None):
+        """Returns, for each of the hints, a (ratio, subfolder) tuple with
+        the subfolder that guess_best_hint would return for it and its
+        similarity ratio, or None where it would return None.  This is
+        much faster than guessing for each hint in turn."""
+        return self._get_index(subpath).best_many(list(hints), 0.5)
+
+    def _get_index(self, subpath):
+        """Returns a HintIndex of the subfolders in destination, reusing
+        the last one built for the same subfolders."""
+        if self.guesses is not None:
+            return self.guesses.index(self._directory(subpath))
+        return index_of(tuple(self._get_hints(subpath=subpath)))
@@ -2,10 +2,22 @@
 
 '''Natures detector tests.'''
 
+import difflib
+import os
+import pickle
+import random
+import time
 import unittest
 from organizer import destinations
+from organizer import ops
+from organizer import pathutil
 from organizer.testutil import dirtree
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class TestDestinations(unittest.TestCase):
 
     def test_dests(self):
@@ -36,3 +48,181 @@ class TestDestinations(unittest.TestCase):
                 dest = destinations.Destination(d)
                 got = dest.guess_best_hint(hint)
                 assert got == guess, (got, guess)
+
+
+def legacy_guess_best_hint(names, hint):
+    contents = [ (x.lower(), x) for x in names ]
+    junk = lambda x: x in ". -_"
+    distances = [
+        (difflib.SequenceMatcher(junk, c[0], hint.lower()).ratio(), c[1])
+         for c in contents
+    ]
+    distances = list(sorted(distances))
+    if not distances:
+        return None
+    ratio, besthint = distances[-1]
+    if ratio < 0.5:
+        return None
+    return besthint
+
+class TestHintIndex(unittest.TestCase):
+
+    def test_same_as_difflib(self):
+        rnd = random.Random(4)
+        alphabet = "abcdeghilmnorst .-_"
+        def word():
+            return "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 30)))
+        names = set(word().title() for _ in range(300))
+        names.update(["Ace of Base", "ace of base", "ACE OF BASE", "Private practice"])
+        index = destinations.HintIndex(names)
+        hints = [ word() for _ in range(80) ]
+        hints += [ n.upper() for n in rnd.sample(sorted(names), 30) ]
+        hints += [ "Ace.Of.Base", "", "x", "Private.Practice" ]
+        for hint in hints:
+            best = index.best(hint, 0.5)
+            got = best[1] if best else None
+            self.assertEqual(got, legacy_guess_best_hint(names, hint), hint)
+
+    def hints_and_index(self):
+        rnd = random.Random(7)
+        alphabet = "abcdeghilmnorst .-_"
+        def word():
+            return "".join(rnd.choice(alphabet) for _ in range(rnd.randint(1, 30)))
+        names = set(word().title() for _ in range(300))
+        names.update(["Ace of Base", "ace of base", "ACE OF BASE", "Private practice"])
+        hints = [ word() for _ in range(80) ]
+        hints += [ n.upper() for n in rnd.sample(sorted(names), 30) ]
+        hints += [ "Ace.Of.Base", "", "x", "Private.Practice" ]
+        return hints, destinations.HintIndex(names)
+
+    def test_best_many(self):
+        hints, index = self.hints_and_index()
+        for threshold in (0.0, 0.5):
+            self.assertEqual(index.best_many(hints, threshold),
+                             [ index.best(h, threshold) for h in hints ])
+        self.assertEqual(destinations.HintIndex([]).best_many(["x"]), [None])
+
+    @unittest.skipUnless(numpy, "NumPy is not available")
+    def test_best_many_numpy(self):
+        hints, index = self.hints_and_index()
+        old = destinations.CELLS
+        destinations.CELLS = 1
+        try:
+            for threshold in (0.0, 0.5):
+                self.assertEqual(index._best_many_numpy(numpy, hints, threshold),
+                                 [ index.best(h, threshold) for h in hints ])
+        finally:
+            destinations.CELLS = old
+
+    def test_guess_best_hints(self):
+        with dirtree(["Ace of Base/Ravine.mp3", "DJ Bobo/Celebration.ogg"]) as d:
+            dest = destinations.Destination(d)
+            hints = ["Ace.Of.Base", "dj.bobo", "aeisrntien tsrd yukv9"]
+            got = dest.guess_best_hints(hints)
+            self.assertEqual([ g[1] if g else None for g in got ],
+                             [ dest.guess_best_hint(h) for h in hints ])
+            assert got[0][0] > 0.5, got
+
+    def test_index_kept_between_destinations(self):
+        with dirtree(["Ace of Base/Ravine.mp3", "DJ Bobo/Celebration.ogg"]) as d:
+            index = destinations.Destination(d)._get_index(None)
+            assert destinations.Destination(d)._get_index(None) is index
+            os.mkdir(os.path.join(d, "Dyango"))
+            assert destinations.Destination(d)._get_index(None) is not index
+
+
+class TestListings(unittest.TestCase):
+
+    def age(self, path, seconds=60):
+        t = time.time() - seconds
+        os.utime(path, (t, t))
+
+    def counting(self):
+        listed = []
+        old = destinations.list_subfolders
+        def list_subfolders(path):
+            listed.append(path)
+            return old(path)
+        destinations.list_subfolders = list_subfolders
+        return listed, old
+
+    def test_unchanged_directories_not_relisted(self):
+        with dirtree(["Ace of Base/Ravine.mp3", "DJ Bobo/Celebration.ogg"]) as d:
+            self.age(d)
+            listings = destinations.Listings()
+            listed, old = self.counting()
+            try:
+                self.assertEqual(sorted(listings.subfolders(d)), ["Ace of Base", "DJ Bobo"])
+                listings = destinations.Listings.deserialize(listings.serialize())
+                self.assertEqual(sorted(listings.subfolders(d)), ["Ace of Base", "DJ Bobo"])
+                self.assertEqual(listed, [d])
+                os.mkdir(os.path.join(d, "Dyango"))
+                self.age(d, 30)
+                self.assertEqual(sorted(listings.subfolders(d)), ["Ace of Base", "DJ Bobo", "Dyango"])
+                self.assertEqual(listed, [d, d])
+            finally:
+                destinations.list_subfolders = old
+
+    def test_pickled(self):
+        with dirtree(["Ace of Base/Ravine.mp3"]) as d:
+            self.age(d)
+            listings = destinations.Listings()
+            listings.subfolders(d)
+            copy = pickle.loads(pickle.dumps(listings))
+            self.assertEqual(copy.entries, listings.entries)
+            self.assertEqual(copy.subfolders(d), ["Ace of Base"])
+
+    def test_recently_modified_directories_not_kept(self):
+        with dirtree(["Ace of Base/Ravine.mp3"]) as d:
+            listings = destinations.Listings()
+            listings.subfolders(d)
+            assert d not in listings.entries, listings.entries
+
+    def test_directories_created(self):
+        with dirtree(["Ace of Base/Ravine.mp3", "Dyango/Corazon.mp3"]) as d:
+            self.age(d)
+            listings = destinations.Listings()
+            listings.subfolders(d)
+            listed, old = self.counting()
+            try:
+                # The parent already had the directory, so it did not change.
+                os.makedirs(os.path.join(d, "Dyango", "Cancion"))
+                listings.directories_created(os.path.join(d, "Dyango", "Cancion"))
+                self.assertEqual(sorted(listings.subfolders(d)), ["Ace of Base", "Dyango"])
+                self.assertEqual(listed, [])
+                # The parent gained a directory, so its listing is forgotten.
+                os.mkdir(os.path.join(d, "Raphael"))
+                listings.directories_created(os.path.join(d, "Raphael"))
+                os.mkdir(os.path.join(d, "Sabina"))
+                self.assertEqual(sorted(listings.subfolders(d)), ["Ace of Base", "Dyango", "Raphael", "Sabina"])
+                self.assertEqual(listed, [d])
+            finally:
+                destinations.list_subfolders = old
+
+class TestGuesses(unittest.TestCase):
+
+    def test_memoized_until_changed(self):
+        with dirtree(["TV/Bones/Season 1/a.avi", "TV/Castle/Season 1/b.avi", "dl/Dexter/c.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            guesses = destinations.Guesses()
+            operator = ops.NativeOperator()
+            operator.add_listener(guesses)
+            dest = destinations.Destination(j("TV"), guesses=guesses)
+            with pathutil.counting() as calls:
+                for _ in range(10):
+                    self.assertEqual(dest.guess_best_hint("Bones"), "Bones")
+                    self.assertEqual(dest.guess_best_hint("Season 1", "Bones"), "Season 1")
+                    self.assertEqual(dest.guess_best_hint("Dexter"), None)
+            self.assertEqual(calls["dirread"], 2)
+
+            # Files moved in, and folders created elsewhere, change nothing.
+            operator.create_directories(j("Movies"))
+            operator.move_file(j("dl/Dexter/c.avi"), j("TV/Bones/Season 1/c.avi"))
+            self.assertEqual(sorted(guesses.directories), [j("TV"), j("TV/Bones")])
+
+            operator.move_file(j("dl/Dexter"), j("TV/Dexter"))
+            self.assertEqual(dest.guess_best_hint("Dexter"), "Dexter")
+            operator.create_directories(j("TV/Bones/Season 2/Extras"))
+            self.assertEqual(dest.guess_best_hint("Season 2", "Bones"), "Season 2")
+            operator.remove_file(j("TV/Castle"))
+            self.assertEqual(dest.guess_best_hint("Castle"), None)
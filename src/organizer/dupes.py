@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+
+'''Duplicates.
+
+This code finds out whether an organizee is already in the directory it is
+going to, under its own name or, for files, under any other, so that it is
+not copied there for nothing.  Candidates are compared by size first, then
+by a digest of a few blocks sampled from them, and only candidates that
+pass both are compared in full.'''
+
+import hashlib
+import os
+import stat
+from organizer import pathutil
+
+SAMPLE_BYTES = 64 * 1024
+SAMPLES = 3
+CHUNK_BYTES = 8 * 1024 * 1024
+
+def _drop_cache(fd, offset, length):
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+def sample_digest(path, size):
+    """Returns a digest of SAMPLES blocks of the file at path, which is size
+    bytes long, taken at its start, its end and evenly in between."""
+    h = hashlib.blake2b(digest_size=16)
+    step = (size - SAMPLE_BYTES) // (SAMPLES - 1)
+    with open(path, "rb", buffering=0) as f:
+        for n in range(SAMPLES):
+            pathutil.count("read")
+            h.update(os.pread(f.fileno(), SAMPLE_BYTES, n * step))
+    return h.digest()
+
+def same_contents(a, b):
+    """Returns True if the files at a and b have the same contents, reading
+    them side by side and stopping at the first difference."""
+    with open(a, "rb", buffering=0) as fa, open(b, "rb", buffering=0) as fb:
+        offset = 0
+        while True:
+            pathutil.count("read", 2)
+            da = os.pread(fa.fileno(), CHUNK_BYTES, offset)
+            db = os.pread(fb.fileno(), CHUNK_BYTES, offset)
+            _drop_cache(fa.fileno(), offset, len(da))
+            _drop_cache(fb.fileno(), offset, len(db))
+            if da != db:
+                return False
+            if not da:
+                return True
+            offset += len(da)
+
+class Comparer(object):
+    """Compares a file with candidates, computing the digest of its samples
+    only once, and only if a candidate is as large as it is.  Empty files
+    are not duplicates of anything, as there is nothing to save by not
+    moving them."""
+
+    def __init__(self, path, st):
+        self.path = path
+        self.st = st
+        self._digest = None
+
+    def same_as(self, candidate, st):
+        if os.path.samestat(self.st, st):
+            return True
+        size = self.st.st_size
+        if st.st_size != size or size == 0:
+            return False
+        try:
+            if size > SAMPLE_BYTES * SAMPLES:
+                if self._digest is None:
+                    self._digest = sample_digest(self.path, size)
+                if sample_digest(candidate, size) != self._digest:
+                    return False
+            return same_contents(self.path, candidate)
+        except OSError:
+            return False
+
+def manifest(path):
+    """Returns the sorted relative paths of the regular files in the tree
+    at path, along with their stats, and None if there is anything else,
+    like symbolic links, in it."""
+    files = []
+    for root, dirs, names in pathutil.walk(path):
+        for n in names:
+            p = os.path.join(root, n)
+            st = pathutil.lstat(p)
+            if not stat.S_ISREG(st.st_mode):
+                return None
+            files.append((os.path.relpath(p, path), st))
+    return sorted(files, key=lambda f: f[0])
+
+def same_tree(a, b):
+    """Returns True if the directory trees at a and b hold the same files,
+    with the same contents, and not only empty ones."""
+    try:
+        ma, mb = manifest(a), manifest(b)
+    except OSError:
+        return False
+    if ma is None or mb is None or len(ma) != len(mb):
+        return False
+    if any(ra != rb or sa.st_size != sb.st_size for (ra, sa), (rb, sb) in zip(ma, mb)):
+        return False
+    if not any(sa.st_size for _, sa in ma):
+        return False
+    return all(sa.st_size == 0 or Comparer(os.path.join(a, r), sa).same_as(os.path.join(b, r), sb)
+               for (r, sa), (_, sb) in zip(ma, mb))
+
+def duplicate_of(path, container):
+    """Returns the path of an entry of the directory container that is a
+    duplicate of path, or None if there is none.  A file is compared with
+    every file in container, while a directory is compared only with the
+    directory of the same name in container."""
+    try:
+        st = pathutil.lstat(path)
+    except OSError:
+        return None
+    if stat.S_ISDIR(st.st_mode):
+        candidate = os.path.join(container, os.path.basename(path))
+        if pathutil.isdir(candidate) and not pathutil.islink(candidate):
+            if same_tree(path, candidate):
+                return candidate
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    comparer = Comparer(path, st)
+    try:
+        with pathutil.scandir(container) as it:
+            entries = [ e for e in it if e.is_file(follow_symlinks=False) ]
+    except OSError:
+        return None
+    # The entry of the same name is the likeliest duplicate.
+    entries.sort(key=lambda e: e.name != os.path.basename(path))
+    for e in entries:
+        if pathutil.paths_equal(e.path, path):
+            continue
+        try:
+            est = e.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        if comparer.same_as(e.path, est):
+            return e.path
+    return None
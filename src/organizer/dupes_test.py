@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+
+'''Duplicate detection tests.'''
+
+import os
+import unittest
+from organizer import dupes
+from organizer import pathutil
+from organizer.testutil import dirtree
+
+BIG = bytes(range(256)) * 4096
+
+class TestDuplicates(unittest.TestCase):
+
+    def write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def test_files(self):
+        with dirtree([]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            self.write(j("dl/a.avi"), BIG)
+            self.write(j("TV/other.avi"), BIG[:-1] + b"x")
+            self.write(j("TV/smaller.avi"), BIG[:-1])
+            self.write(j("TV/renamed.avi"), BIG)
+            self.assertEqual(dupes.duplicate_of(j("dl/a.avi"), j("TV")), j("TV/renamed.avi"))
+            os.unlink(j("TV/renamed.avi"))
+            self.assertEqual(dupes.duplicate_of(j("dl/a.avi"), j("TV")), None)
+            self.assertEqual(dupes.duplicate_of(j("dl/a.avi"), j("nonexistent")), None)
+
+    def test_sampled_before_full(self):
+        with dirtree([]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            self.write(j("dl/a.avi"), BIG)
+            # Different at the start, which is sampled, so never read in full.
+            for n in range(5):
+                self.write(j("TV/%d.avi" % n), b"x" + BIG[1:])
+            self.write(j("TV/smaller.avi"), BIG[:-1])
+            with pathutil.counting() as calls:
+                self.assertEqual(dupes.duplicate_of(j("dl/a.avi"), j("TV")), None)
+            self.assertEqual(calls["read"], dupes.SAMPLES * 6)
+            # Different only where no sample was taken.
+            middle = len(BIG) // 3
+            self.write(j("TV/0.avi"), BIG[:middle] + b"x" + BIG[middle + 1:])
+            self.assertEqual(dupes.duplicate_of(j("dl/a.avi"), j("TV")), None)
+
+    def test_empty_files_are_not_duplicates(self):
+        with dirtree(["dl/a.avi", "TV/a.avi"]) as d:
+            self.assertEqual(dupes.duplicate_of(os.path.join(d, "dl/a.avi"),
+                                                os.path.join(d, "TV")), None)
+
+    def test_trees(self):
+        with dirtree([]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            for root in ("dl", "Music"):
+                self.write(j(root, "Album/01.mp3"), BIG)
+                self.write(j(root, "Album/cd2/02.mp3"), b"song")
+            self.assertEqual(dupes.duplicate_of(j("dl/Album"), j("Music")), j("Music/Album"))
+            self.write(j("Music/Album/cd2/03.mp3"), b"song")
+            self.assertEqual(dupes.duplicate_of(j("dl/Album"), j("Music")), None)
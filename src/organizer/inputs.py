@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+
+'''Inputs.
+
+This code yields the organizees a run works on, one at a time, from the
+command line, from lists of paths, and from folders walked recursively,
+so that no list of all of them has to be built before work starts.'''
+
+import array
+import hashlib
+import os
+from organizer import pathutil
+
+READ_BYTES = 64 * 1024
+
+def read_paths(f, null=False):
+    """Yields the paths listed in the binary file f, one per line, or
+    separated by NUL characters if null is True.  Empty entries are
+    ignored."""
+    sep = b"\0" if null else b"\n"
+    rest = b""
+    while True:
+        data = f.read(READ_BYTES)
+        if not data:
+            break
+        entries = (rest + data).split(sep)
+        rest = entries.pop()
+        for e in entries:
+            if e:
+                yield os.fsdecode(e)
+    if rest:
+        yield os.fsdecode(rest)
+
+def walk(root, max_depth=1, depth=1):
+    """Yields the organizees in root, at most max_depth levels down, in the
+    order the folders list them.  Entries at the deepest level are yielded
+    whether they are files or folders, and folders above it are looked into
+    instead.  Entries whose names start with a dot are left alone.  A root
+    that is not a folder is yielded itself."""
+    try:
+        it = pathutil.scandir(root)
+    except NotADirectoryError:
+        if depth == 1:
+            yield root
+        return
+    with it:
+        for e in it:
+            if e.name.startswith("."):
+                continue
+            if depth < max_depth and e.is_dir(follow_symlinks=False):
+                for f in walk(e.path, max_depth, depth + 1):
+                    yield f
+            else:
+                yield e.path
+
+class PathSet(object):
+    """A set of paths, kept as their encoded bytes one after the other in a
+    single buffer, and found through an open addressing table of 64-bit
+    digests and offsets into the buffer, which takes much less room than a
+    set of Python strings.  Paths whose digests collide are still told
+    apart, by comparing their bytes."""
+
+    def __init__(self):
+        self.digests = array.array("Q", bytes(8 * 1024))
+        self.offsets = array.array("Q", bytes(8 * 1024))
+        self.data = bytearray()
+        self.count = 0
+
+    def _digest(self, encoded):
+        digest = hashlib.blake2b(encoded, digest_size=8).digest()
+        return int.from_bytes(digest, "little") or 1
+
+    def _path_at(self, offset):
+        return bytes(self.data[offset:self.data.index(b"\0", offset)])
+
+    def add(self, encoded):
+        """Adds the encoded path, and returns False if it was there
+        already."""
+        digest = self._digest(encoded)
+        digests = self.digests
+        mask = len(digests) - 1
+        i = digest & mask
+        while digests[i]:
+            if digests[i] == digest and self._path_at(self.offsets[i]) == encoded:
+                return False
+            i = (i + 1) & mask
+        digests[i] = digest
+        self.offsets[i] = len(self.data)
+        self.data += encoded + b"\0"
+        self.count += 1
+        if self.count * 3 > len(digests) * 2:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old = zip(self.digests, self.offsets)
+        size = 2 * len(self.digests)
+        self.digests = array.array("Q", bytes(8 * size))
+        self.offsets = array.array("Q", bytes(8 * size))
+        mask = size - 1
+        for digest, offset in old:
+            if digest:
+                i = digest & mask
+                while self.digests[i]:
+                    i = (i + 1) & mask
+                self.digests[i] = digest
+                self.offsets[i] = offset
+
+def unique(paths):
+    """Yields the paths, leaving out those that name the same file as an
+    earlier one."""
+    seen = PathSet()
+    for p in paths:
+        if seen.add(os.fsencode(os.path.abspath(p))):
+            yield p
+
+def organizees(files=(), files_from=None, null=False, roots=(), max_depth=1):
+    """Yields, once each, the organizees named in files, then those listed
+    in the binary file files_from, then those found in the folders in
+    roots."""
+    def chained():
+        for f in files:
+            yield f
+        if files_from is not None:
+            for f in read_paths(files_from, null):
+                yield f
+        for root in roots:
+            for f in walk(root, max_depth):
+                yield f
+    return unique(chained())
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+'''Input tests.'''
+
+import io
+import os
+import unittest
+from organizer import inputs
+from organizer.testutil import dirtree
+
+class TestInputs(unittest.TestCase):
+
+    def test_read_paths(self):
+        inputs_ = lambda data, null=False: list(inputs.read_paths(io.BytesIO(data), null))
+        self.assertEqual(inputs_(b"a.avi\nb c.avi\n\nd.avi"), ["a.avi", "b c.avi", "d.avi"])
+        self.assertEqual(inputs_(b"a\nb.avi\0c.avi\0", True), ["a\nb.avi", "c.avi"])
+        self.assertEqual(inputs_(b"caf\xe9.avi\n"), [os.fsdecode(b"caf\xe9.avi")])
+        old = inputs.READ_BYTES
+        inputs.READ_BYTES = 3
+        try:
+            self.assertEqual(inputs_(b"abcdef\nghi\njk"), ["abcdef", "ghi", "jk"])
+        finally:
+            inputs.READ_BYTES = old
+
+    def test_walk(self):
+        with dirtree(["r/a.avi", "r/.hidden", "r/Show/b.avi", "r/Show/Sub/c.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            self.assertEqual(sorted(inputs.walk(j("r"))), [j("r/Show"), j("r/a.avi")])
+            self.assertEqual(sorted(inputs.walk(j("r"), 2)),
+                             [j("r/Show/Sub"), j("r/Show/b.avi"), j("r/a.avi")])
+            self.assertEqual(sorted(inputs.walk(j("r"), 5)),
+                             [j("r/Show/Sub/c.avi"), j("r/Show/b.avi"), j("r/a.avi")])
+            self.assertEqual(list(inputs.walk(j("r/a.avi"))), [j("r/a.avi")])
+
+    def test_organizees(self):
+        with dirtree(["r/a.avi", "r/b.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            listed = io.BytesIO(os.fsencode("%s\n%s/../r/b.avi\n" % (j("r/a.avi"), j("r"))))
+            found = list(inputs.organizees([j("x.avi"), j("r/a.avi")], listed, False, [j("r")]))
+            self.assertEqual(found, [j("x.avi"), j("r/a.avi"), j("r/../r/b.avi")])
+
+    def test_digest_collisions(self):
+        seen = inputs.PathSet()
+        seen._digest = lambda encoded: 7
+        for n in range(2000):
+            assert seen.add(b"/%d.avi" % n)
+        assert not seen.add(b"/1999.avi")
+        assert seen.add(b"/2000.avi")
+
+    def test_streams(self):
+        consumed = []
+        def paths():
+            for n in range(10):
+                consumed.append(n)
+                yield "/%d.avi" % n
+        it = inputs.organizees(paths())
+        self.assertEqual(next(it), "/0.avi")
+        self.assertEqual(consumed, [0])
@@ -2,8 +2,13 @@
 
 '''Variants of memories.'''
 
+import contextlib
+import mmap
 import pickle
 import os
+import struct
+import threading
+import zlib
 
 class NoMemory(object):
     """Memory that recalls nothing."""
@@ -21,6 +26,11 @@ class NoMemory(object):
     def remember_associated_hint(self, hint, substitution):
         pass
 
+    def transaction(self):
+        """Returns a context manager within which several remember_*
+        calls are made to stick all together or not at all."""
+        return contextlib.nullcontext()
+
 class SerializableMemory(object):
     """Memory that can be reconstituted from a serialization format."""
 
@@ -61,3 +71,320 @@ class SerializableMemory(object):
             del self.associated_hints[hint]
         if substitution is not None:
             self.associated_hints[hint] = substitution
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+class SQLiteMemory(object):
+    """Memory kept in an SQLite database, in write-ahead logging mode.
+
+    Every remember_* call is committed as soon as it is made, unless it is
+    made within transaction(), in which case it is committed when the
+    outermost transaction ends.  A SQLiteMemory can be used from several
+    threads, and pickled into worker processes, which open the database
+    anew."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS destinations_for_nature (
+        nature TEXT PRIMARY KEY,
+        destination TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS associated_hints (
+        hint TEXT PRIMARY KEY,
+        substitution TEXT NOT NULL
+    );
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        import sqlite3
+        self._db = sqlite3.connect(path, timeout=30,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(self.SCHEMA)
+
+    @classmethod
+    def open(klass, path, pickled_path=None):
+        """Opens the database at path, creating it if need be.  When the
+        database is created and pickled_path names the file a
+        SerializableMemory was saved to, what that memory knew is copied
+        into the database."""
+        created = not os.path.exists(path)
+        m = klass(path)
+        if created and pickled_path:
+            try:
+                with open(pickled_path, "rb") as f:
+                    old = SerializableMemory.deserialize(f.read())
+            except FileNotFoundError:
+                old = None
+            if old is not None:
+                m.migrate(old)
+        return m
+
+    def migrate(self, other):
+        """Copies everything a SerializableMemory knows into this one."""
+        with self.transaction():
+            for klass, dest in other.destinations_for_nature.items():
+                self.remember_destination_for_nature(klass, dest)
+            for hint, substitution in other.associated_hints.items():
+                self.remember_associated_hint(hint, substitution)
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self._lock:
+            if self._depth == 0:
+                self._db.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._db.execute("ROLLBACK")
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._db.execute("COMMIT")
+
+    def _query(self, sql, args):
+        with self._lock:
+            row = self._db.execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    def _nature_key(self, klass):
+        return klass.__name__
+
+    @property
+    def destinations_for_nature(self):
+        """The destinations remembered, by nature name."""
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT nature, destination FROM destinations_for_nature"))
+
+    @property
+    def associated_hints(self):
+        with self._lock:
+            return dict(self._db.execute(
+                "SELECT hint, substitution FROM associated_hints"))
+
+    def recall_destination_for_nature(self, klass):
+        return self._query("SELECT destination FROM destinations_for_nature"
+                           " WHERE nature = ?", (self._nature_key(klass),))
+
+    def recall_associated_hint(self, hint):
+        return self._query("SELECT substitution FROM associated_hints"
+                           " WHERE hint = ?", (hint,))
+
+    def remember_destination_for_nature(self, klass, dest):
+        """dest must be an absolute path, or None."""
+        if dest is not None and dest != os.path.abspath(dest):
+            raise ValueError("%r is not an absolute path" % dest)
+        with self.transaction():
+            if dest is None:
+                self._db.execute("DELETE FROM destinations_for_nature"
+                                 " WHERE nature = ?", (self._nature_key(klass),))
+            else:
+                self._db.execute("INSERT OR REPLACE INTO destinations_for_nature"
+                                 " VALUES (?, ?)", (self._nature_key(klass), dest))
+
+    def remember_associated_hint(self, hint, substitution):
+        with self.transaction():
+            if substitution is None:
+                self._db.execute("DELETE FROM associated_hints"
+                                 " WHERE hint = ?", (hint,))
+            else:
+                self._db.execute("INSERT OR REPLACE INTO associated_hints"
+                                 " VALUES (?, ?)", (hint, substitution))
+
+class MappedMemory(object):
+    """Memory kept in a memory-mapped hash table on disk, so that opening
+    it costs the same no matter how much it knows, and recalling something
+    decodes only the entries looked at.
+
+    The file has a header, a table of bucket offsets probed linearly, and
+    the entries, each a key and a value in UTF-8 preceded by their lengths.
+    What is remembered is kept aside until save() writes a new file."""
+
+    MAGIC = b"ORGMMAP\0"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIII")
+    BUCKET = struct.Struct("<Q")
+    ENTRY = struct.Struct("<II")
+
+    def __init__(self, path=None):
+        self.path = path
+        self._map = None
+        self._changes = dict()
+        if path is not None and os.path.exists(path):
+            self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self._buckets, self._count = self.HEADER.unpack_from(m)
+        if magic != self.MAGIC or version != self.VERSION:
+            m.close()
+            raise ValueError("%s is not a memory file of version %s" % (self.path, self.VERSION))
+        self._map = m
+
+    @classmethod
+    def open(klass, path, pickled_path=None):
+        """Opens the memory file at path.  When there is none yet and
+        pickled_path names the file a SerializableMemory was saved to,
+        what that memory knew is copied into a new memory file."""
+        m = klass(path)
+        if m._map is None and pickled_path:
+            try:
+                with open(pickled_path, "rb") as f:
+                    old = SerializableMemory.deserialize(f.read())
+            except FileNotFoundError:
+                return m
+            for klass_, dest in old.destinations_for_nature.items():
+                m.remember_destination_for_nature(klass_, dest)
+            for hint, substitution in old.associated_hints.items():
+                m.remember_associated_hint(hint, substitution)
+            m.save()
+        return m
+
+    def __getstate__(self):
+        return {"path": self.path, "changes": self._changes}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+        self._changes = state["changes"]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def transaction(self):
+        return contextlib.nullcontext()
+
+    @property
+    def dirty(self):
+        """True if something was remembered since the file was saved."""
+        return bool(self._changes)
+
+    def _lookup(self, key):
+        m = self._map
+        if m is None:
+            return None
+        mask = self._buckets - 1
+        i = zlib.crc32(key) & mask
+        while True:
+            offset, = self.BUCKET.unpack_from(m, self.HEADER.size + i * self.BUCKET.size)
+            if offset == 0:
+                return None
+            klen, vlen = self.ENTRY.unpack_from(m, offset)
+            start = offset + self.ENTRY.size
+            if m[start:start + klen] == key:
+                return m[start + klen:start + klen + vlen].decode("utf-8")
+            i = (i + 1) & mask
+
+    def _entries(self):
+        m = self._map
+        if m is None:
+            return
+        offset = self.HEADER.size + self._buckets * self.BUCKET.size
+        for _ in range(self._count):
+            klen, vlen = self.ENTRY.unpack_from(m, offset)
+            start = offset + self.ENTRY.size
+            yield m[start:start + klen], m[start + klen:start + klen + vlen].decode("utf-8")
+            offset = start + klen + vlen
+
+    def _items(self):
+        for key, value in self._entries():
+            if key not in self._changes:
+                yield key, value
+        for key, value in self._changes.items():
+            if value is not None:
+                yield key, value
+
+    def _recall(self, key):
+        if key in self._changes:
+            return self._changes[key]
+        return self._lookup(key)
+
+    def _nature_key(self, klass):
+        return b"N" + klass.__name__.encode("utf-8")
+
+    def _hint_key(self, hint):
+        return b"H" + hint.encode("utf-8")
+
+    @property
+    def destinations_for_nature(self):
+        """The destinations remembered, by nature name."""
+        return dict((k[1:].decode("utf-8"), v) for k, v in self._items() if k[:1] == b"N")
+
+    @property
+    def associated_hints(self):
+        return dict((k[1:].decode("utf-8"), v) for k, v in self._items() if k[:1] == b"H")
+
+    def recall_destination_for_nature(self, klass):
+        return self._recall(self._nature_key(klass))
+
+    def recall_associated_hint(self, hint):
+        return self._recall(self._hint_key(hint))
+
+    def remember_destination_for_nature(self, klass, dest):
+        """dest must be an absolute path, or None."""
+        if dest is not None and dest != os.path.abspath(dest):
+            raise ValueError("%r is not an absolute path" % dest)
+        self._changes[self._nature_key(klass)] = dest
+
+    def remember_associated_hint(self, hint, substitution):
+        self._changes[self._hint_key(hint)] = substitution
+
+    def save(self):
+        """Writes everything known to a new file that replaces the old one
+        at once."""
+        items = list(self._items())
+        buckets = 8
+        while buckets < len(items) * 2:
+            buckets *= 2
+        mask = buckets - 1
+        table = [0] * buckets
+        offset = self.HEADER.size + buckets * self.BUCKET.size
+        chunks = []
+        for key, value in items:
+            value = value.encode("utf-8")
+            i = zlib.crc32(key) & mask
+            while table[i]:
+                i = (i + 1) & mask
+            table[i] = offset
+            chunks.append(self.ENTRY.pack(len(key), len(value)))
+            chunks.append(key)
+            chunks.append(value)
+            offset += self.ENTRY.size + len(key) + len(value)
+        import tempfile
+        fd, tmp = tempfile.mkstemp(prefix=".%s." % os.path.basename(self.path),
+                                   dir=os.path.dirname(self.path))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, buckets, len(items)))
+                f.write(struct.pack("<%dQ" % buckets, *table))
+                f.write(b"".join(chunks))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.close()
+        self._changes = dict()
+        self._open()
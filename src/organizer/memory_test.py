@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+'''Memory tests.'''
+
+import os
+import pickle
+import unittest
+from organizer import memory
+from organizer import natures
+from organizer.testutil import dirtest
+
+class TestSQLiteMemory(unittest.TestCase):
+
+    def test_remember_and_recall(self):
+        with dirtest() as d:
+            m = memory.SQLiteMemory(os.path.join(d, "mem.sqlite"))
+            m.remember_destination_for_nature(natures.TVShow, "/tv")
+            m.remember_associated_hint("Bonez", "Bones")
+            self.assertEqual(m.recall_destination_for_nature(natures.TVShow), "/tv")
+            self.assertEqual(m.recall_destination_for_nature(natures.Movie), None)
+            self.assertEqual(m.recall_associated_hint("Bonez"), "Bones")
+            self.assertRaises(ValueError, m.remember_destination_for_nature, natures.Movie, "movies")
+            m.remember_associated_hint("Bonez", None)
+            m.remember_destination_for_nature(natures.TVShow, None)
+            self.assertEqual(m.recall_associated_hint("Bonez"), None)
+            self.assertEqual(m.recall_destination_for_nature(natures.TVShow), None)
+            m.close()
+
+    def test_commits_as_it_goes(self):
+        with dirtest() as d:
+            path = os.path.join(d, "mem.sqlite")
+            m = memory.SQLiteMemory(path)
+            m.remember_associated_hint("Bonez", "Bones")
+            other = memory.SQLiteMemory(path)
+            self.assertEqual(other.recall_associated_hint("Bonez"), "Bones")
+            try:
+                with m.transaction():
+                    m.remember_associated_hint("Castel", "Castle")
+                    m.remember_associated_hint("Bonez", None)
+                    raise KeyError()
+            except KeyError:
+                pass
+            self.assertEqual(other.associated_hints, {"Bonez": "Bones"})
+            unpickled = pickle.loads(pickle.dumps(m))
+            self.assertEqual(unpickled.recall_associated_hint("Bonez"), "Bones")
+            for x in (m, other, unpickled):
+                x.close()
+
+    def test_migration(self):
+        with dirtest() as d:
+            old = memory.SerializableMemory()
+            old.remember_destination_for_nature(natures.TVShow, "/tv")
+            old.remember_associated_hint("Bonez", "Bones")
+            with open(os.path.join(d, "organizer"), "wb") as f:
+                f.write(old.serialize())
+            path = os.path.join(d, "mem.sqlite")
+            m = memory.SQLiteMemory.open(path, os.path.join(d, "organizer"))
+            self.assertEqual(m.recall_destination_for_nature(natures.TVShow), "/tv")
+            self.assertEqual(m.recall_associated_hint("Bonez"), "Bones")
+            m.remember_associated_hint("Bonez", None)
+            m.close()
+            m = memory.SQLiteMemory.open(path, os.path.join(d, "organizer"))
+            self.assertEqual(m.recall_associated_hint("Bonez"), None)
+            m.close()
+
+class TestMappedMemory(unittest.TestCase):
+
+    def test_save_and_reopen(self):
+        with dirtest() as d:
+            path = os.path.join(d, "mem.mmap")
+            m = memory.MappedMemory(path)
+            self.assertEqual(m.recall_associated_hint("Bonez"), None)
+            m.remember_destination_for_nature(natures.TVShow, "/tv")
+            for n in range(100):
+                m.remember_associated_hint("hint %d" % n, "Hint é %d" % n)
+            self.assertEqual(m.recall_associated_hint("hint 5"), "Hint é 5")
+            m.save()
+            m.close()
+            m = memory.MappedMemory(path)
+            assert not m.dirty
+            self.assertEqual(m.recall_destination_for_nature(natures.TVShow), "/tv")
+            self.assertEqual(m.recall_destination_for_nature(natures.Movie), None)
+            for n in range(100):
+                self.assertEqual(m.recall_associated_hint("hint %d" % n), "Hint é %d" % n)
+            self.assertEqual(m.recall_associated_hint("hint 100"), None)
+            m.remember_associated_hint("hint 5", None)
+            self.assertEqual(m.recall_associated_hint("hint 5"), None)
+            unpickled = pickle.loads(pickle.dumps(m))
+            self.assertEqual(unpickled.recall_associated_hint("hint 5"), None)
+            self.assertEqual(unpickled.recall_associated_hint("hint 6"), "Hint é 6")
+            unpickled.close()
+            m.save()
+            self.assertEqual(len(m.associated_hints), 99)
+            self.assertEqual(m.destinations_for_nature, {"TVShow": "/tv"})
+            m.close()
+
+    def test_not_a_memory_file(self):
+        with dirtest() as d:
+            path = os.path.join(d, "mem.mmap")
+            with open(path, "wb") as f:
+                f.write(b"\0" * 64)
+            self.assertRaises(ValueError, memory.MappedMemory, path)
+
+    def test_migration(self):
+        with dirtest() as d:
+            old = memory.SerializableMemory()
+            old.remember_destination_for_nature(natures.TVShow, "/tv")
+            old.remember_associated_hint("Bonez", "Bones")
+            with open(os.path.join(d, "organizer"), "wb") as f:
+                f.write(old.serialize())
+            m = memory.MappedMemory.open(os.path.join(d, "mem.mmap"), os.path.join(d, "organizer"))
+            assert not m.dirty
+            self.assertEqual(m.recall_destination_for_nature(natures.TVShow), "/tv")
+            self.assertEqual(m.recall_associated_hint("Bonez"), "Bones")
+            m.close()
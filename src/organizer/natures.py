@@ -4,16 +4,34 @@
 
 This code detects the nature of a file path.'''
 
-import itertools
-import jinja2
+import collections
+import configparser
+import functools
 import re
 import os.path
 from . import pathutil
+from . import tags
 
 SEP = "/"
 MOVIE_EXTS = [".avi", ".mkv", ".mov", ".mp4"]
 MUSIC_EXTS = [".ogg", ".flac", ".mp3", ".aac", ".m4a"]
 
+_templates = dict()
+
+def compile_template(jinjatemplatetext):
+    """Returns the compiled jinja2 template for the text passed to this
+    function.  Templates are compiled once per process, and shared by every
+    scheme that uses the same text."""
+    try:
+        return _templates[jinjatemplatetext]
+    except KeyError:
+        pass
+    # jinja2 takes long to import, and is only needed once a scheme is
+    # rendered, which many runs never get to do.
+    import jinja2
+    template = jinja2.Template(jinjatemplatetext)
+    return _templates.setdefault(jinjatemplatetext, template)
+
 class Scheme(object):
     """A scheme indicates to the organizer how to generate a fragment
     of the path for the final destination of an organizee."""
@@ -21,6 +39,13 @@ class Scheme(object):
     def __init__(self, jinjatemplatetext):
         self.t = jinjatemplatetext
 
+    @property
+    def template(self):
+        return compile_template(self.t)
+
+    def render(self, props):
+        return self.template.render(props)
+
 class ExactScheme(Scheme):
     """The ExactScheme indicates to the organizer algorithm that it must
     not attempt to second-guess the component of the path, by looking
@@ -37,45 +62,192 @@ class BestGuessScheme(Scheme):
     def allow_speculation(self):
         return True
 
-def _all_natures():
-    for klass in list(globals().values()):
-        if klass == Nature:
-            continue
+NATURES = []
+
+def register(klass):
+    """Class decorator that adds a Nature to the registry consulted by
+    detect_nature.  Natures are examined in the order they were registered,
+    and the one registered last wins when confidences are tied."""
+    NATURES.append(klass)
+    return klass
+
+def nature_by_name(name):
+    """Returns the registered nature class with the name passed to this
+    function, or raises KeyError if there is none."""
+    for klass in NATURES:
+        if klass.__name__ == name:
+            return klass
+    raise KeyError(name)
+
+ParsedName = collections.namedtuple(
+    "ParsedName",
+    ["showname", "season", "episode", "ext", "various_artists"],
+)
+
+_S_CANDIDATE = re.compile(r"s", re.I)
+_X_CANDIDATE = re.compile(r"[0-9]x", re.I)
+_SEASON_EPISODE = re.compile(r"S(eason)?[. ]*([0-9]+)\s*E(p(isode)?)?[. ]*([0-9]+)", re.I)
+_SEASON_X_EPISODE = re.compile(r"([0-9])x([0-9][0-9]+)", re.I)
+_VARIOUS_ARTISTS = re.compile(r"(VA[._-]|Various[._-]Artists)", re.I)
+
+def _rightmost_match(pattern, candidate, name):
+    """Returns the rightmost match of pattern in name that is preceded by
+    at least one character on the first line of name, which is what the
+    greedy ^(.*). prefix the patterns used to have selected.  Once the
+    leftmost match is found, only the positions to its right where
+    candidate matches are tried, so the scan stays linear."""
+    limit = name.find("\n")
+    if limit == -1:
+        limit = len(name)
+    found = pattern.search(name, 1)
+    if not found or found.start() > limit:
+        return None
+    starts = [ m.start() for m in candidate.finditer(name, found.start() + 1, limit + 1) ]
+    for start in reversed(starts):
+        m = pattern.match(name, start)
+        if m:
+            return m
+    return found
+
+@functools.lru_cache(maxsize=4096)
+def parse_filename(basename):
+    """Parses a file name once into a ParsedName record, which carries the
+    show name, season and episode (None when the name does not look like
+    an episode), the lowercased extension, and whether the name is marked
+    as a various artists compilation."""
+    _, ext = os.path.splitext(basename)
+    showname, season, episode = None, None, None
+    m = _rightmost_match(_SEASON_EPISODE, _S_CANDIDATE, basename)
+    if m:
+        season, episode = m.group(2), m.group(5)
+    else:
+        m = _rightmost_match(_SEASON_X_EPISODE, _X_CANDIDATE, basename)
+        if m:
+            season, episode = m.group(1), m.group(2)
+    if m:
+        showname = basename[:m.start() - 1]
+    various_artists = _VARIOUS_ARTISTS.match(basename) is not None
+    return ParsedName(showname, season, episode, ext.lower(), various_artists)
+
+class ScanContext(object):
+    """A ScanContext caches the listings of the directory levels below a
+    path, so that every nature examining the path shares them instead of
+    listing the same folders over and over again.
+
+    Level 0 is the contents of the path itself, level 1 the contents of
+    its subfolders, and so on.  Each level is listed at most once."""
+
+    path = None
+
+    def __init__(self, path):
+        self.path = path
+        self._levels = dict()
+
+    def listing(self, depth=0):
+        """Returns the paths contained depth levels below the path."""
+        try:
+            return self._levels[depth]
+        except KeyError:
+            pass
+        expression = os.path.join(*(["*"] * (depth + 1)))
+        contained = pathutil.glob(self.path, expression)
+        self._levels[depth] = contained
+        return contained
+
+configured_schemes = dict()
+
+def configure_schemes(klass, schemes):
+    """Makes the nature class use the schemes passed to this function instead
+    of its default schemes.  The templates of the schemes are compiled right
+    away.  Passing None restores the default schemes.  Subclasses of klass
+    are not affected."""
+    if schemes is None:
+        configured_schemes.pop(klass, None)
+        return
+    schemes = tuple(schemes)
+    for scheme in schemes:
+        scheme.template
+    configured_schemes[klass] = schemes
+
+def reset_schemes():
+    """Restores the default schemes of every nature class."""
+    configured_schemes.clear()
+
+SCHEME_KINDS = {"exact": ExactScheme, "guess": BestGuessScheme}
+
+def load_schemes(f):
+    """Reads user-configured schemes from the file f, and configures the
+    natures named in it to use them.  The file has one section per nature
+    class, with a schemes option listing one scheme per line, each line
+    starting with the kind of scheme (exact or guess):
+
+        [TVShow]
+        schemes =
+            guess {{ showname }}
+            exact Season {{ season }}
+            exact {{ filename }}
+    """
+    parser = configparser.ConfigParser(interpolation=None)
+    parser.read_file(f)
+    configured = []
+    for section in parser.sections():
         try:
-            isnature = issubclass(klass, Nature)
-            if not isnature:
+            klass = nature_by_name(section)
+        except KeyError:
+            raise ValueError("unknown nature %r" % section)
+        schemes = []
+        for line in parser.get(section, "schemes").splitlines():
+            line = line.strip()
+            if not line:
                 continue
-        except TypeError:
-            continue
-        yield klass
+            kind, _, text = line.partition(" ")
+            if kind not in SCHEME_KINDS:
+                raise ValueError("unknown kind of scheme %r for nature %s" % (kind, section))
+            schemes.append(SCHEME_KINDS[kind](text.strip()))
+        configured.append((klass, schemes))
+    for klass, schemes in configured:
+        configure_schemes(klass, schemes)
 
 def detect_nature(path):
     """Returns a class instance of the nature of the path passed to this
     function."""
+    scan = ScanContext(path)
     couldbe = []
-    for klass in _all_natures():
-        confidence = klass.examine(path)
+    for klass in NATURES:
+        confidence = klass.examine(path, scan)
         couldbe.append((confidence, klass))
     itis = list(sorted(couldbe, key=lambda m: m[0]))[-1]
-    return itis[1](path)
+    return itis[1].refine(path, scan)(path, scan)
 
 class Nature(object):
 
     path = None
+    _properties = None
 
-    def __init__(self, path):
+    def __init__(self, path, scan=None):
         """Instantiates a Nature object that is bound to the path passed to
         it.  This path must exist, otherwise errors may take place during
-        organization."""
+        organization.  The optional scan is the ScanContext that was
+        used to examine the path."""
         self.path = path
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         """Takes a path, and returns a value representing how confident this
         class is that it can represent the path during the organization
-        process, between 0.0 and 1.0."""
+        process, between 0.0 and 1.0.  The optional scan is a ScanContext
+        for the path, shared among all natures examining it."""
         raise NotImplementedError
 
+    @classmethod
+    def refine(klass, path, scan=None):
+        """Returns the nature class to use for the path, which examine()
+        found this class to be the likeliest for.  Natures that have to
+        look closer at the path than examine() does to tell it apart from
+        a similar nature, like by reading files, do so here, where it is
+        only paid for the paths they are picked for."""
+        return klass
+
     def name(self):
         return self.__class__.__name__
 
@@ -97,66 +269,85 @@ class Nature(object):
         the user has selected for this nature."""
         return ExactScheme("{{ filename }}"),
 
+    @property
+    def schemes(self):
+        """Returns the schemes configured for this nature through
+        configure_schemes, or the default schemes if none were."""
+        schemes = configured_schemes.get(self.__class__)
+        if schemes is not None:
+            return schemes
+        return self.default_schemes
+
     def properties(self):
         return {"filename": os.path.basename(self.path_to_organize)}
 
+    def cached_properties(self):
+        """Returns the properties of this nature, with any bytes values
+        decoded.  They are computed only the first time this is called."""
+        if self._properties is None:
+            props = dict()
+            for k, v in list(self.properties().items()):
+                if type(v) != str:
+                    v = v.decode("utf-8")
+                props[k] = v
+            self._properties = props
+        return self._properties
+
     def resolve(self, schemes=None):
         """This function takes a Nature instance, then uses the instance's
         properties() method to resolve any template variables in each
-        one of the Schemes returned by the default scheme, or whatever
-        scheme is specified.  The return is an iterable of (exact, resolved)
+        one of the Schemes configured for the nature (or the default
+        schemes), or whatever scheme is specified.  The return is an iterable of (exact, resolved)
         tuples, where exact is a boolean indicating (if True) whether the
         resolved value is not to be second-guessed, and resolved is a value
         that may or may not be second-guessed."""
         if schemes is None:
-            schemes = self.default_schemes
+            schemes = self.schemes
+        props = self.cached_properties()
         resolveds = []
         for scheme in schemes:
             mandatory = scheme.__class__ == ExactScheme
-            props = dict()
-            for k, v in list(self.properties().items()):
-                if type(v) != str:
-                    v = v.decode("utf-8")
-                props[k] = v
-            resolved = jinja2.Template(scheme.t).render(props)
+            resolved = scheme.render(props)
             resolveds.append((mandatory, resolved))
         return tuple(resolveds)
 
-def find_videos_within_folder(folder):
+def find_videos_within_folder(folder, scan=None):
+    if scan is None:
+        scan = ScanContext(folder)
     videos = []
-    contained = pathutil.glob(folder, "*")
+    contained = scan.listing(0)
     for c in contained:
         _, ext = os.path.splitext(c)
         if ext.lower() in MOVIE_EXTS:
             videos.append(c)
     return videos
 
-def find_subtitles_within_folder(folder):
-    contained = pathutil.glob(folder, "*.[sS][rR][tT]")
-    contained2 = pathutil.glob(folder, os.path.join("*", "*.[sS][rR][tT]"))
-    return contained + contained2
+def find_subtitles_within_folder(folder, scan=None):
+    if scan is None:
+        scan = ScanContext(folder)
+    contained = scan.listing(0) + scan.listing(1)
+    return [ c for c in contained if c.lower().endswith(".srt") ]
 
-class TVShow(Nature):
+def find_music_within_folder(folder, scan=None):
+    if scan is None:
+        scan = ScanContext(folder)
+    contained = scan.listing(0) + scan.listing(1)
+    return [ c for c in contained if os.path.splitext(c)[1].lower() in MUSIC_EXTS ]
 
-    seasonres = [
-                 r"^(.*).S(eason)?[. ]*([0-9]+)\s*E(p(isode)?)?[. ]*([0-9]+)",
-                 r"^(.*)(.)([0-9]+)x([0-9][0-9]+)",
-    ]
+@register
+class TVShow(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         confidence = 0.0
-        _, ext = os.path.splitext(path)
-        if ext.lower() not in MOVIE_EXTS:
+        parsed = parse_filename(os.path.basename(path))
+        if parsed.ext not in MOVIE_EXTS:
             return confidence
         confidence += 0.2
-        for seasonre in klass.seasonres:
-            season = re.findall(seasonre, os.path.basename(path), re.I)
-            if season: break
-        if season:
+        if parsed.season is not None:
             confidence += 0.6
         return confidence
 
@@ -170,52 +361,44 @@ class TVShow(Nature):
 
     def properties(self):
         baseprops = Nature.properties(self)
-        base = os.path.basename(self.path)
-        for seasonre in self.seasonres:
-            partitioned = re.findall(seasonre, base, re.I)
-            if partitioned: break
-        if partitioned:
-            baseprops["showname"] = partitioned[0][0]
-            baseprops ["season"] = "%d" % int(partitioned[0][2])
+        parsed = parse_filename(os.path.basename(self.path))
+        if parsed.season is not None:
+            baseprops["showname"] = parsed.showname
+            baseprops["season"] = "%d" % int(parsed.season)
         return baseprops
 
     def name(self):
         return "TV show"
 
+@register
 class TVShowContainer(TVShow):
 
-    def __init__(self, path):
-        TVShow.__init__(self, path)
+    def __init__(self, path, scan=None):
+        TVShow.__init__(self, path, scan)
         # Must save this datum now, else path_to_organize() will bomb
         # once video is deleted.
         # This cannot fail because of the invariant that examine() is always
         # called once with the same argument before __init__() is.
-        videos = find_videos_within_folder(self.path)
+        videos = find_videos_within_folder(self.path, scan)
         self._path_to_organize = videos[0]
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         confidence = 0.0
-        videos = find_videos_within_folder(path)
+        videos = find_videos_within_folder(path, scan)
         if len(videos) != 1:
             return confidence
         confidence += 0.2
-        for seasonre in klass.seasonres:
-            season = re.findall(seasonre, os.path.basename(videos[0]), re.I)
-            if season: break
-        if season:
+        if parse_filename(os.path.basename(videos[0])).season is not None:
             confidence += 0.4
         return confidence
 
     def properties(self):
         baseprops = Nature.properties(self)
-        base = os.path.basename(self._path_to_organize)
-        for seasonre in self.seasonres:
-            partitioned = re.findall(seasonre, base, re.I)
-            if partitioned: break
-        if partitioned:
-            baseprops["showname"] = partitioned[0][0]
-            baseprops ["season"] = "%d" % int(partitioned[0][2])
+        parsed = parse_filename(os.path.basename(self._path_to_organize))
+        if parsed.season is not None:
+            baseprops["showname"] = parsed.showname
+            baseprops["season"] = "%d" % int(parsed.season)
         return baseprops
 
     def name(self):
@@ -225,12 +408,13 @@ class TVShowContainer(TVShow):
     def path_to_organize(self):
         return self._path_to_organize
 
+@register
 class TVShowFolder(TVShowContainer):
 
     @classmethod
-    def examine(klass, path):
-        confidence = TVShowContainer.examine(path)
-        if find_subtitles_within_folder(path):
+    def examine(klass, path, scan=None):
+        confidence = TVShowContainer.examine(path, scan)
+        if find_subtitles_within_folder(path, scan):
             confidence += 0.2
         return confidence - 0.1
 
@@ -241,13 +425,14 @@ class TVShowFolder(TVShowContainer):
     def path_to_organize(self):
         return self.path
 
+@register
 class Movie(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         confidence = 0.0
         _, ext = os.path.splitext(path)
         if ext.lower() not in MOVIE_EXTS:
@@ -258,69 +443,86 @@ class Movie(Nature):
     def name(self):
         return "Movie file"
 
+@register
 class MovieFolder(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         confidence = 0.0
-        videos = find_videos_within_folder(path)
+        videos = find_videos_within_folder(path, scan)
         if len(videos) not in [1, 2]:
             return confidence
         confidence = 0.4
-        if find_subtitles_within_folder(path):
+        if find_subtitles_within_folder(path, scan):
             confidence = confidence + 0.3
         return confidence
 
     def name(self):
         return "Movie folder"
 
+@register
 class Album(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
+        self._tracks = find_music_within_folder(path, scan)
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         confidence = 0.0
-        contained = itertools.chain(
-            pathutil.glob(path, "*"),
-            pathutil.glob(path, os.path.join("*", "*")),
-        )
-        for c in contained:
-            _, ext = os.path.splitext(c)
-            if ext.lower() in MUSIC_EXTS and confidence < 0.7:
+        for c in find_music_within_folder(path, scan):
+            if confidence < 0.7:
                 confidence = confidence + 0.2
         return confidence
 
+    @classmethod
+    def refine(klass, path, scan=None):
+        """Albums whose tags say they are a compilation are compilations."""
+        if tags.album_tags(find_music_within_folder(path, scan))[1]:
+            return Compilation
+        return klass
+
+    def properties(self):
+        """Besides the file name, returns the artist, album and year that
+        the tags of most tracks agree on, those that are there."""
+        baseprops = Nature.properties(self)
+        baseprops.update(tags.album_tags(self._tracks)[0])
+        return baseprops
+
     def name(self):
         return "Music album"
 
+@register
 class Compilation(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
+        self._tracks = find_music_within_folder(path, scan)
 
     @classmethod
-    def examine(klass, path):
-        confidence = Album.examine(path)
+    def examine(klass, path, scan=None):
+        confidence = Album.examine(path, scan)
         if confidence >= 0.05:
             confidence = confidence - 0.05
-            va = re.findall(r"^(VA[._-]|Various[._-]Artists)", os.path.basename(path), re.I)
-            if va:
+            if parse_filename(os.path.basename(path)).various_artists:
                 confidence = confidence + 0.1
         return confidence
 
+    def properties(self):
+        return Album.properties(self)
+
     def name(self):
         return "Music compilation"
 
+@register
 class Unknown(Nature):
 
-    def __init__(self, path):
-        Nature.__init__(self, path)
+    def __init__(self, path, scan=None):
+        Nature.__init__(self, path, scan)
 
     @classmethod
-    def examine(klass, path):
+    def examine(klass, path, scan=None):
         return 0.01
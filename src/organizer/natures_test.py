@@ -2,9 +2,13 @@
 
 '''Natures detector tests.'''
 
+import io
 import os
+import re
 import unittest
 from organizer import natures
+from organizer import pathutil
+from organizer import tags_test
 from organizer.testutil import dirtree
 
 class TestDetectNature(unittest.TestCase):
@@ -122,3 +126,160 @@ class TestDetectNature(unittest.TestCase):
                 x = os.path.join(d, os.path.dirname(p[0]))
                 nature = natures.detect_nature(x)
                 assert isinstance(nature, natures.Compilation) == val, (nature, p)
+
+    def test_album_tags(self):
+        with dirtree(["Downloads/.keep"]) as d:
+            album = os.path.join(d, "Downloads", "boleros")
+            os.mkdir(album)
+            for n, artist in enumerate(["Dyango", "Dyango", "Dyango"]):
+                with open(os.path.join(album, "%02d.mp3" % n), "wb") as f:
+                    f.write(tags_test.id3([(b"TPE1", artist), (b"TALB", "Boleros"),
+                                           (b"TYER", "1999")]))
+            nature = natures.detect_nature(album)
+            assert nature.__class__ == natures.Album, nature
+            props = nature.cached_properties()
+            self.assertEqual((props["artist"], props["album"], props["year"]),
+                             ("Dyango", "Boleros", "1999"))
+
+            various = os.path.join(d, "Downloads", "hits")
+            os.mkdir(various)
+            for n, artist in enumerate(["Dyango", "Raphael", "Camilo Sesto"]):
+                with open(os.path.join(various, "%02d.mp3" % n), "wb") as f:
+                    f.write(tags_test.id3([(b"TPE1", artist), (b"TPE2", "Various Artists"),
+                                           (b"TALB", "Hits")]))
+            nature = natures.detect_nature(various)
+            assert nature.__class__ == natures.Compilation, nature
+            self.assertEqual(nature.cached_properties()["album"], "Hits")
+            self.assertEqual(nature.cached_properties()["artist"], "Various Artists")
+
+    def test_tags_read_only_for_music_folders(self):
+        with dirtree(["Bones X/Bones S08E02.avi", "Bones X/theme.mp3"]) as d:
+            read = []
+            old_album_tags = natures.tags.album_tags
+            natures.tags.album_tags = lambda tracks: read.append(tracks) or (dict(), False)
+            try:
+                nature = natures.detect_nature(os.path.join(d, "Bones X"))
+            finally:
+                natures.tags.album_tags = old_album_tags
+            assert nature.__class__ != natures.Album, nature
+            self.assertEqual(read, [])
+
+    def test_one_listing_per_level(self):
+        globbed = []
+        old_glob = natures.pathutil.glob
+        def counting_glob(basepath, expression):
+            globbed.append(expression)
+            return old_glob(basepath, expression)
+        with dirtree(["Bones X/Bones S08E02.avi",
+                      "Bones X/Subs/Bones S08E02.en.srt"]) as d:
+            x = os.path.join(d, "Bones X")
+            natures.pathutil.glob = counting_glob
+            try:
+                nature = natures.detect_nature(x)
+            finally:
+                natures.pathutil.glob = old_glob
+            assert nature.__class__ == natures.TVShowFolder, nature
+            assert sorted(globbed) == ["*", os.path.join("*", "*")], globbed
+
+    def test_filesystem_calls_bounded(self):
+        tree = [ "Bones X/Bones S08E%02d.avi" % n for n in range(1, 21) ]
+        tree += [ "Bones X/Subs/Bones S08E%02d.en.srt" % n for n in range(1, 21) ]
+        with dirtree(tree) as d:
+            for path in ("Bones X", "Bones X/Bones S08E01.avi"):
+                with pathutil.counting() as calls:
+                    natures.detect_nature(os.path.join(d, path))
+                assert calls["dirread"] <= 2, (path, calls)
+                assert calls["stat"] == 0, (path, calls)
+
+
+class TestParseFilename(unittest.TestCase):
+
+    legacy_seasonres = [
+        r"^(.*).S(eason)?[. ]*([0-9]+)\s*E(p(isode)?)?[. ]*([0-9]+)",
+        r"^(.*)(.)([0-9]+)x([0-9][0-9]+)",
+    ]
+
+    def legacy_parse(self, base):
+        for seasonre in self.legacy_seasonres:
+            partitioned = re.findall(seasonre, base, re.I)
+            if partitioned: break
+        if partitioned:
+            return partitioned[0][0], "%d" % int(partitioned[0][2])
+        return None, None
+
+    def test_same_as_legacy_patterns(self):
+        names = [
+            "Greys.Anatomy.S08E14.HDTV.XviD-ENCODED.avi",
+            "Greys.Anatomy.Season 09 Episode 19.HDTV.XviD-ENCODED.avi",
+            "Greys.Anatomy.season 7 Ep 15.HDTV.XviD-ENCODED.avi",
+            "Doctor.Who.2005.8x03.Robot.Of.Sherwood.720p.HDTV.x264.avi",
+            "Show.12x03.avi",
+            "Show.S01E02.Recap.S03E04.mkv",
+            "S01E01.avi",
+            "xS01E01.avi",
+            "Greys.Anatomy.XviD-ENCODED.avi",
+            "Some\nShow.S01E01.avi",
+            "Show.S01E01\nS02E02.avi",
+            "a.S" * 83,
+            "1" * 249 + "x",
+            "1" * 200 + "x" + "2" * 49,
+            "S. . . . 1 " * 22 + "E",
+            "Season" * 41 + "x",
+        ]
+        for name in names:
+            parsed = natures.parse_filename(name)
+            got = (parsed.showname, "%d" % int(parsed.season)) if parsed.season else (None, None)
+            self.assertEqual(got, self.legacy_parse(name), name)
+
+    def test_record(self):
+        parsed = natures.parse_filename("VA-Greys.Anatomy.S08E14.HDTV.AVI")
+        self.assertEqual(parsed, natures.ParsedName("VA-Greys.Anatomy", "08", "14", ".avi", True))
+
+
+class TestSchemes(unittest.TestCase):
+
+    def test_templates_compiled_once(self):
+        a = natures.ExactScheme("Season {{ season }}")
+        b = natures.ExactScheme("Season {{ season }}")
+        assert a.template is b.template
+
+    def test_properties_computed_once(self):
+        calls = []
+        class CountingTVShow(natures.TVShow):
+            def properties(self):
+                calls.append(1)
+                return natures.TVShow.properties(self)
+        nature = CountingTVShow("Bones.S08E02.avi")
+        nature.resolve()
+        nature.resolve()
+        assert len(calls) == 1, calls
+
+    def test_load_schemes(self):
+        f = io.StringIO(
+            "[TVShow]\n"
+            "schemes =\n"
+            "    guess {{ showname }}\n"
+            "    exact {{ filename }}\n"
+        )
+        natures.load_schemes(f)
+        try:
+            nature = natures.detect_nature("Bones.S08E02.avi")
+            self.assertEqual(nature.resolve(), ((False, "Bones"), (True, "Bones.S08E02.avi")))
+        finally:
+            natures.configure_schemes(natures.TVShow, None)
+        self.assertEqual(len(nature.resolve()), 3)
+
+    def test_configure_schemes_leaves_subclasses_alone(self):
+        natures.configure_schemes(natures.TVShow, [natures.ExactScheme("{{ filename }}")])
+        try:
+            self.assertEqual(len(natures.TVShow("Bones.S08E02.avi").schemes), 1)
+            with dirtree(["Bones.S08E02/Bones.S08E02.avi"]) as d:
+                container = natures.TVShowContainer(os.path.join(d, "Bones.S08E02"))
+                self.assertEqual(len(container.schemes), 3)
+        finally:
+            natures.reset_schemes()
+        self.assertEqual(len(natures.TVShow("Bones.S08E02.avi").schemes), 3)
+
+    def test_load_schemes_unknown_nature(self):
+        f = io.StringIO("[Podcast]\nschemes = exact {{ filename }}\n")
+        self.assertRaises(ValueError, natures.load_schemes, f)
@@ -3,11 +3,70 @@
 """Operators.  There are operators suitable for command lines and operators
 suitable for GUI usage."""
 
+import ctypes
+import errno
 import os
+import shutil
+import stat
 import subprocess
+import sys
+from organizer import pathutil
+from organizer import transfer
 
-check_call = subprocess.check_call
-call = subprocess.call
+check_call = pathutil.check_call
+call = pathutil.call
+
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+def _load_renameat2():
+    try:
+        f = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return None
+    f.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+    f.restype = ctypes.c_int
+    return f
+
+_renameat2 = _load_renameat2()
+
+def rename_noreplace(src, dst):
+    """Renames src to dst, raising FileExistsError if dst exists.  This is
+    atomic through renameat2(RENAME_NOREPLACE) where the C library, kernel
+    and file system support it, and a check followed by a rename otherwise."""
+    if _renameat2 is not None:
+        if _renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dst), RENAME_NOREPLACE) == 0:
+            return
+        e = ctypes.get_errno()
+        if e not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+            raise OSError(e, os.strerror(e), src, None, dst)
+    if pathutil.lexists(dst):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), src, None, dst)
+    os.rename(src, dst)
+
+def confirm(prompt):
+    """Asks the user a yes or no question on standard error, the way mv -i
+    does.  Anything but yes, including a closed standard input, means no."""
+    sys.stderr.write(prompt)
+    sys.stderr.flush()
+    try:
+        answer = sys.stdin.readline()
+    except (OSError, ValueError, AttributeError):
+        answer = ""
+    if not answer.endswith("\n"):
+        sys.stderr.write("\n")
+    return answer.strip().lower().startswith("y")
+
+def decline(prompt):
+    """Answers no to a yes or no question, showing it on standard error
+    like confirm does.  Used when standard input holds no answers."""
+    sys.stderr.write(prompt + "\n")
+    sys.stderr.flush()
+    return False
+
+class OperationFailed(subprocess.CalledProcessError):
+    """Raised by the NativeOperator when an operation fails.  It reads like
+    the error CLIOperator raises when the equivalent command fails."""
 
 def takeown(path):
     try:
@@ -18,6 +77,38 @@ def takeown(path):
 class Operator(object):
     """An Operator is a class that performs certain operations."""
 
+    listeners = ()
+
+    def add_listener(self, listener):
+        """Registers an object to be told about the changes this operator
+        makes, through whichever of these methods it has:
+        directories_created(path) when it creates path as a directory
+        along with any missing parents, moved_into(path) when it moves
+        something to path, and removed(path) when it moves or removes
+        what was at path."""
+        self.listeners = self.listeners + (listener,)
+
+    def remove_listener(self, listener):
+        self.listeners = tuple(l for l in self.listeners if l is not listener)
+
+    def notify(self, event, path):
+        for listener in self.listeners:
+            method = getattr(listener, event, None)
+            if method is not None:
+                method(path)
+
+    def moved(self, original, new):
+        self.notify("removed", original)
+        self.notify("moved_into", new)
+
+    def report_error(self, message):
+        """Tells the user that an operation failed."""
+        print(message, file=sys.stderr)
+
+    def ask(self, prompt):
+        """Asks the user a yes or no question, and returns the answer."""
+        return confirm(prompt)
+
     def move_file(self, original_path, new_path):
         """Moves a source file or directory into a
         destination.  Full path names are required."""
@@ -34,42 +125,54 @@ class CLIOperator(Operator):
     def __init__(self):
         self.ops_already_performed = []
 
+    @pathutil.counted("operation")
     def take_ownership(self, f):
         takeown(f)
 
+    @pathutil.counted("operation")
     def move_file(self, original, new):
         cmd = ["mv", "-iT", "--", original, new]
         check_call(cmd)
+        self.moved(original, new)
 
+    @pathutil.counted("operation")
     def create_directories(self, container):
         cmd = ["mkdir", "-p", "--", container]
         check_call(cmd)
+        self.notify("directories_created", container)
 
+    @pathutil.counted("operation")
     def remove_file(self, f):
         cmd = ["rm", "-rf", "--", f]
         check_call(cmd)
+        self.notify("removed", f)
 
 class CLIReportOperator(Operator):
 
+    @pathutil.counted("operation")
     def take_ownership(self, f):
         print("Would  chown", f)
 
+    @pathutil.counted("operation")
     def move_file(self, original, new):
         print("        move", original)
         print("          to", new)
-        if os.path.exists(new):
+        if pathutil.exists(new):
             print("   replacing", new)
 
+    @pathutil.counted("operation")
     def create_directories(self, container):
         print("      create", container)
 
+    @pathutil.counted("operation")
     def remove_file(self, f):
         print("      remove", f)
 
 class KIOOperator(CLIOperator):
 
+    @pathutil.counted("operation")
     def move_file(self, original, new):
-        if os.path.isdir(new):
+        if pathutil.isdir(new):
             cmd = ["kdialog", "--warningyesno",
                    "File %s will replace %s.  Are you sure?" % (original, new)]
             ret = call(cmd)
@@ -83,3 +186,145 @@ class KIOOperator(CLIOperator):
                new,
         ]
         check_call(cmd)
+        self.moved(original, new)
+
+class NativeOperator(CLIOperator):
+    """An Operator that does its work in-process, without running commands,
+    except takeown when something actually needs to change owners.  Moves
+    follow the semantics of mv -iT: the user is asked before anything is
+    replaced, and files are copied only across file systems.  Errors are
+    reported with the messages of the commands CLIOperator runs.
+
+    Copies are made by the transfer module, which can resume them if they
+    are interrupted.  If verify_checksum is True, copies are checksummed
+    against their originals before the originals are removed."""
+
+    verify_checksum = False
+
+    def __init__(self, verify_checksum=False):
+        CLIOperator.__init__(self)
+        self.verify_checksum = verify_checksum
+
+    def _fail(self, cmd, message):
+        self.report_error("%s: %s" % (cmd[0], message))
+        raise OperationFailed(1, cmd)
+
+    @pathutil.counted("operation")
+    def take_ownership(self, f):
+        uid = os.geteuid()
+        try:
+            owned = pathutil.lstat(f).st_uid == uid
+            if owned and pathutil.isdir(f) and not pathutil.islink(f):
+                for root, dirs, files in pathutil.walk(f):
+                    for n in dirs + files:
+                        if pathutil.lstat(os.path.join(root, n)).st_uid != uid:
+                            owned = False
+                            break
+                    if not owned:
+                        break
+        except OSError:
+            return
+        if not owned:
+            takeown(f)
+
+    @pathutil.counted("operation")
+    def move_file(self, original, new):
+        if self._move(original, new):
+            self.moved(original, new)
+
+    def _move(self, original, new):
+        """Moves original to new, and returns whether it did."""
+        cmd = ["mv", "-iT", "--", original, new]
+        try:
+            st = pathutil.lstat(original)
+        except OSError as e:
+            self._fail(cmd, "cannot stat '%s': %s" % (original, e.strerror))
+        try:
+            rename_noreplace(original, new)
+            return True
+        except FileExistsError:
+            if not self.ask("mv: overwrite '%s'? " % new):
+                return False
+            replace = True
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                self._fail(cmd, "cannot move '%s' to '%s': %s" % (original, new, e.strerror))
+            # Across file systems, the rename fails before it would find
+            # that new exists, so the user is asked here, before copying.
+            replace = pathutil.lexists(new)
+            if replace and not self.ask("mv: overwrite '%s'? " % new):
+                return False
+        isdir = stat.S_ISDIR(st.st_mode)
+        try:
+            newisdir = stat.S_ISDIR(pathutil.lstat(new).st_mode)
+        except FileNotFoundError:
+            newisdir = None
+        if newisdir and not isdir:
+            self._fail(cmd, "cannot overwrite directory '%s' with non-directory" % new)
+        if newisdir is False and isdir:
+            self._fail(cmd, "cannot overwrite non-directory '%s' with directory '%s'" % (new, original))
+        if replace:
+            try:
+                os.rename(original, new)
+                return True
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    self._fail(cmd, "cannot move '%s' to '%s': %s" % (original, new, e.strerror))
+        self._copy_across(cmd, original, new, isdir, replace)
+        return True
+
+    def _copy_across(self, cmd, original, new, isdir, replace):
+        """Moves original to new, which is on another file system, through
+        the transfer engine: a resumable partial copy next to new is
+        renamed into place once complete, then original is removed.  A
+        complete copy that cannot be renamed into place is removed."""
+        try:
+            partial = transfer.copy_to_partial(original, new, self.verify_checksum)
+        except OSError as e:
+            # What was copied is kept, for the next attempt to resume.
+            self._fail(cmd, "cannot move '%s' to '%s': %s" % (original, new, e.strerror))
+        try:
+            if replace:
+                if pathutil.isdir(new) and not pathutil.islink(new):
+                    os.rmdir(new)
+                os.rename(partial, new)
+            else:
+                rename_noreplace(partial, new)
+        except OSError as e:
+            # The copy is complete, but cannot be put in place, so it is
+            # not left behind in the destination.
+            try:
+                self._remove(partial)
+            except OSError:
+                pass
+            self._fail(cmd, "cannot move '%s' to '%s': %s" % (original, new, e.strerror))
+        try:
+            self._remove(original)
+        except OSError as e:
+            self._fail(cmd, "cannot remove '%s': %s" % (original, e.strerror))
+
+    def _remove(self, f):
+        if pathutil.isdir(f) and not pathutil.islink(f):
+            shutil.rmtree(f)
+        else:
+            os.unlink(f)
+
+    @pathutil.counted("operation")
+    def create_directories(self, container):
+        cmd = ["mkdir", "-p", "--", container]
+        try:
+            os.makedirs(container, exist_ok=True)
+        except OSError as e:
+            self._fail(cmd, "cannot create directory '%s': %s" % (e.filename or container, e.strerror))
+        self.notify("directories_created", container)
+
+    @pathutil.counted("operation")
+    def remove_file(self, f):
+        cmd = ["rm", "-rf", "--", f]
+        try:
+            self._remove(f)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self._fail(cmd, "cannot remove '%s': %s" % (e.filename or f, e.strerror))
+        self.notify("removed", f)
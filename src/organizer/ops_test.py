@@ -3,6 +3,9 @@
 """Operators tests."""
 
 import contextlib
+import errno
+import os
+import subprocess
 from organizer import ops
 from . import testutil
 import unittest
@@ -68,3 +71,119 @@ class KIOOperatorTest(CapturedCommandTest):
                 ("rm -rf -- %s" % d).split(),
                 ("kde-mv -- /b/c/d %s" % d).split(),
             ])
+
+class ListenerTest(CapturedCommandTest):
+
+    def test_directories_created(self):
+        created = []
+        class Listener(object):
+            def directories_created(self, path):
+                created.append(path)
+        with self.patch_calls():
+            o = ops.CLIOperator()
+            o.add_listener(Listener())
+            o.create_directories("/a")
+        self.assertListEqual(created, ["/a"])
+
+class NativeOperatorTest(unittest.TestCase):
+
+    def test_simple_ops(self):
+        with testutil.dirtree(["src/a/b.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            o = ops.NativeOperator()
+            o.take_ownership(j("src/a"))
+            o.create_directories(j("dst/x/y"))
+            o.move_file(j("src/a"), j("dst/x/y/a"))
+            o.remove_file(j("src"))
+            self.assertTrue(os.path.isfile(j("dst/x/y/a/b.avi")))
+            self.assertFalse(os.path.exists(j("src")))
+
+    def test_no_clobber(self):
+        with testutil.dirtree(["a.avi", "b.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            with open(j("a.avi"), "w") as f:
+                f.write("a")
+            old_confirm = ops.confirm
+            asked = []
+            ops.confirm = lambda prompt: asked.append(prompt)
+            try:
+                ops.NativeOperator().move_file(j("a.avi"), j("b.avi"))
+            finally:
+                ops.confirm = old_confirm
+            self.assertEqual(asked, ["mv: overwrite '%s'? " % j("b.avi")])
+            self.assertTrue(os.path.exists(j("a.avi")))
+            self.assertEqual(os.path.getsize(j("b.avi")), 0)
+
+    def test_copy_across_file_systems(self):
+        with testutil.dirtree(["src/a/b.avi", "src/a/c/d.srt"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            old_rename_noreplace = ops.rename_noreplace
+            def rename_noreplace(src, dst):
+                if not os.path.basename(src).endswith(".organizer-partial"):
+                    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+                old_rename_noreplace(src, dst)
+            ops.rename_noreplace = rename_noreplace
+            try:
+                ops.NativeOperator().move_file(j("src/a"), j("a"))
+            finally:
+                ops.rename_noreplace = old_rename_noreplace
+            self.assertEqual(sorted(os.listdir(d)), ["a", "src"])
+            self.assertTrue(os.path.isfile(j("a/c/d.srt")))
+            self.assertFalse(os.path.exists(j("src/a")))
+
+    def test_no_clobber_across_file_systems(self):
+        with testutil.dirtree(["a.avi", "dst/a.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            with open(j("a.avi"), "w") as f:
+                f.write("a")
+            old_rename_noreplace, old_confirm = ops.rename_noreplace, ops.confirm
+            def rename_noreplace(src, dst):
+                if not os.path.basename(src).endswith(".organizer-partial"):
+                    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+                old_rename_noreplace(src, dst)
+            asked = []
+            ops.rename_noreplace = rename_noreplace
+            ops.confirm = lambda prompt: asked.append(prompt)
+            try:
+                ops.NativeOperator().move_file(j("a.avi"), j("dst/a.avi"))
+                self.assertEqual(asked, ["mv: overwrite '%s'? " % j("dst/a.avi")])
+                self.assertEqual(sorted(os.listdir(j("dst"))), ["a.avi"])
+                self.assertEqual(os.path.getsize(j("dst/a.avi")), 0)
+                self.assertTrue(os.path.exists(j("a.avi")))
+                ops.confirm = lambda prompt: True
+                ops.NativeOperator().move_file(j("a.avi"), j("dst/a.avi"))
+            finally:
+                ops.rename_noreplace, ops.confirm = old_rename_noreplace, old_confirm
+            self.assertEqual(sorted(os.listdir(j("dst"))), ["a.avi"])
+            self.assertEqual(os.path.getsize(j("dst/a.avi")), 1)
+            self.assertFalse(os.path.exists(j("a.avi")))
+
+    def test_partial_removed_when_it_cannot_be_put_in_place(self):
+        with testutil.dirtree(["a.avi", "dst/.keep"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            old_rename_noreplace = ops.rename_noreplace
+            def rename_noreplace(src, dst):
+                if not os.path.basename(src).endswith(".organizer-partial"):
+                    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+                # Something else got there while the copy was made.
+                raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST))
+            ops.rename_noreplace = rename_noreplace
+            try:
+                self.assertRaises(ops.OperationFailed, ops.NativeOperator().move_file,
+                                  j("a.avi"), j("dst/a.avi"))
+            finally:
+                ops.rename_noreplace = old_rename_noreplace
+            self.assertEqual(os.listdir(j("dst")), [".keep"])
+            self.assertTrue(os.path.exists(j("a.avi")))
+
+    def test_same_errors_as_cli_operator(self):
+        with testutil.dirtest() as d:
+            missing = os.path.join(d, "missing")
+            errors = []
+            for o in (ops.CLIOperator(), ops.NativeOperator()):
+                try:
+                    o.move_file(missing, os.path.join(d, "new"))
+                except subprocess.CalledProcessError as e:
+                    errors.append(str(e))
+            self.assertEqual(len(errors), 2)
+            self.assertEqual(errors[0], errors[1])
@@ -1,10 +1,55 @@
 #!/usr/bin/python3
 
-"""Path utilities."""
+"""Path utilities.
 
+Every access the organizer makes to the file system goes through the
+functions here, which count them by kind: "stat" for each file examined,
+"dirread" for each directory listed or globbed, "subprocess" for each
+command run, and "operation" for each operation an Operator carries out.
+calls holds the counts for the whole run, and counting() gives the counts
+of a stretch of work, such as that done for one organizee."""
+
+import collections
+import contextlib
+import functools
 from glob import glob as g
 import os
-import sys
+import subprocess
+import threading
+
+calls = collections.Counter()
+_lock = threading.Lock()
+_local = threading.local()
+
+def count(kind, n=1):
+    """Counts n accesses of kind, in the run and in every counting()
+    active in this thread."""
+    with _lock:
+        calls[kind] += n
+    for c in getattr(_local, "active", ()):
+        c[kind] += n
+
+@contextlib.contextmanager
+def counting():
+    """Yields a Counter of the accesses this thread makes until the block
+    ends.  Blocks may be nested, and every one counts what is in it."""
+    c = collections.Counter()
+    active = getattr(_local, "active", ())
+    _local.active = active + (c,)
+    try:
+        yield c
+    finally:
+        _local.active = active
+
+def counted(kind):
+    """Decorates a function so that each call to it is counted as kind."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            count(kind)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorate
 
 def glob(basepath, expression):
     """Properly globs even when the base path has globbing metacharacters."""
@@ -19,9 +64,41 @@ def glob(basepath, expression):
       except TypeError:
           assert 0, basepath
     newbasepath = "".join(newbasepath)
+    count("dirread")
     return g(os.path.join(newbasepath, expression))
 
+isdir = counted("stat")(os.path.isdir)
+isfile = counted("stat")(os.path.isfile)
+islink = counted("stat")(os.path.islink)
+exists = counted("stat")(os.path.exists)
+lexists = counted("stat")(os.path.lexists)
+stat = counted("stat")(os.stat)
+lstat = counted("stat")(os.lstat)
+readlink = counted("stat")(os.readlink)
+listdir = counted("dirread")(os.listdir)
+scandir = counted("dirread")(os.scandir)
+check_call = counted("subprocess")(subprocess.check_call)
+call = counted("subprocess")(subprocess.call)
+
+def walk(top):
+    """Like os.walk, counting each directory listed."""
+    for entry in os.walk(top):
+        count("dirread")
+        yield entry
+
 def ensure_non_unicode(prospectively_unicode_path):
     if isinstance(prospectively_unicode_path, bytes):
         assert 0, prospectively_unicode_path
     return prospectively_unicode_path
+
+def paths_equal(p1, p2):
+    return os.path.abspath(p1) == os.path.abspath(p2)
+
+def ancestors(path):
+    """Yields the parents of path, nearest first."""
+    while True:
+        parent = os.path.dirname(path)
+        if parent == path:
+            return
+        yield parent
+        path = parent
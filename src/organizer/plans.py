@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+'''Plans.
+
+This code records the decisions made for organizees, so that they can be
+carried out separately from the making of them.'''
+
+import json
+import os.path
+from organizer import natures
+from organizer.pathutil import ancestors, paths_equal
+
+FORMAT = "organizer-plan"
+VERSION = 1
+
+class Plan(object):
+    """A Plan records what the organizer decided to do with one organizee:
+    where it goes, or why it is skipped.  It carries plain data only, so
+    it can be handed across threads and processes.  fs_calls, if not
+    None, is a Counter of the file system accesses made for the organizee,
+    by kind."""
+
+    source = None
+    nature_class = None
+    path = None
+    path_to_organize = None
+    destination = None
+    final_path = None
+    container_of_final_path = None
+    skip = None
+    speculated = ()
+    fs_calls = None
+
+    @classmethod
+    def from_assistant(klass, source, assistant):
+        """Makes a plan out of an Assistant whose guesses have been made.
+        source is the path to the organizee, as supplied by the user."""
+        p = klass()
+        p.source = source
+        p.nature_class = assistant.nature.__class__
+        p.path = assistant.nature.path
+        p.path_to_organize = assistant.nature.path_to_organize
+        p.final_path = assistant.final_path
+        p.container_of_final_path = assistant.container_of_final_path
+        p.speculated = tuple(assistant.speculated)
+        if not assistant.container_of_final_path_exists:
+            p.skip = "Skipping %s: its destination directory is nonexistent or not known" % source
+            return p
+        p.destination = os.path.abspath(assistant.destination.path)
+        if paths_equal(p.path_to_organize, p.final_path):
+            p.skip = "Skipping %s: it appears to be already organized" % p.path_to_organize
+        return p
+
+    @property
+    def removal(self):
+        """The path to remove once the organizee has been moved, or None."""
+        if paths_equal(self.path_to_organize, self.path):
+            return None
+        return self.path
+
+    @property
+    def touches(self):
+        """The paths that carrying out this plan changes on disk."""
+        if self.skip:
+            return ()
+        return (self.container_of_final_path, self.final_path,
+                self.path_to_organize, self.path)
+
+    def dependencies(self):
+        """The paths whose state on disk this plan was made against: the
+        directories whose contents guided guesses, the container of the
+        final path, and the path to organize along with its parents."""
+        deps = list(self.speculated)
+        deps.append(self.container_of_final_path)
+        path = os.path.abspath(self.path)
+        while True:
+            deps.append(path)
+            parent = os.path.dirname(path)
+            if parent == path:
+                return deps
+            path = parent
+
+    def persist_in_memory(self, memory):
+        """Makes the memory remember the destination chosen for the nature
+        of the organizee, if there was one."""
+        if self.destination:
+            memory.remember_destination_for_nature(self.nature_class,
+                                                   self.destination)
+
+    def to_record(self):
+        """Returns the plan as a dictionary of plain values.  The operations
+        it entails follow from the paths, and are worked out from them again
+        when the plan is carried out, so they are not recorded."""
+        record = {
+            "source": self.source,
+            "nature": self.nature_class.__name__,
+            "path": self.path,
+            "organize": self.path_to_organize,
+            "final": self.final_path,
+            "container": self.container_of_final_path,
+        }
+        if self.destination:
+            record["remember"] = self.destination
+        if self.skip:
+            record["skip"] = self.skip
+        return record
+
+    @classmethod
+    def from_record(klass, record):
+        """Makes a plan out of a dictionary returned by to_record."""
+        p = klass()
+        p.source = record["source"]
+        p.nature_class = natures.nature_by_name(record["nature"])
+        p.path = record["path"]
+        p.path_to_organize = record["organize"]
+        p.final_path = record["final"]
+        p.container_of_final_path = record["container"]
+        p.destination = record.get("remember")
+        p.skip = record.get("skip")
+        return p
+
+class Window(object):
+    """A Window collects consecutive plans that can be carried out in any
+    order with the same results: none of them changes what another one was
+    planned against.  Plans overlap when the trees they move from or to
+    contain one another, when one adds something to a directory whose
+    subfolders guided the guesses of another, or when one moves something
+    out of a directory another examined.
+
+    Plans going to the same directory do not overlap, even though each
+    adds to the directory the others were checked for duplicates against.
+    Whoever carries the window out must check them against one another."""
+
+    def __init__(self):
+        self.plans = []
+        self.paths = set()
+        self.contain = set()
+        self.added = set()
+        self.removed = set()
+        self.speculated = set()
+        self.examined = set()
+
+    def __len__(self):
+        return len(self.plans)
+
+    def _trees(self, p):
+        if p.skip:
+            return (p.path,)
+        return (p.path, p.path_to_organize, p.final_path)
+
+    def _added(self, p):
+        return () if p.skip else (os.path.dirname(p.final_path),)
+
+    def _removed(self, p):
+        if p.skip:
+            return ()
+        return (os.path.dirname(p.path), os.path.dirname(p.path_to_organize))
+
+    def _examined(self, p):
+        return tuple(p.speculated) + (p.container_of_final_path,)
+
+    def admits(self, p):
+        """Returns True if p does not overlap any plan in the window."""
+        for t in self._trees(p):
+            if t in self.paths or t in self.contain:
+                return False
+            if any(a in self.paths for a in ancestors(t)):
+                return False
+        if any(a in self.speculated for a in self._added(p)):
+            return False
+        if any(r in self.examined for r in self._removed(p)):
+            return False
+        if any(s in self.added for s in p.speculated):
+            return False
+        if any(e in self.removed for e in self._examined(p)):
+            return False
+        return True
+
+    def add(self, p):
+        self.plans.append(p)
+        for t in self._trees(p):
+            self.paths.add(t)
+            self.contain.update(ancestors(t))
+        self.added.update(self._added(p))
+        self.removed.update(self._removed(p))
+        self.speculated.update(p.speculated)
+        self.examined.update(self._examined(p))
+
+class PlanWriter(object):
+    """Writes plans to a file as they are made, one JSON document per line,
+    after a line that identifies the format of the file."""
+
+    def __init__(self, f):
+        self.f = f
+        self._write({"format": FORMAT, "version": VERSION})
+
+    def _write(self, document):
+        self.f.write(json.dumps(document, separators=(",", ":")) + "\n")
+
+    def write(self, plan):
+        self._write(plan.to_record())
+
+def read_plans(f):
+    """Yields the plans in a file written by a PlanWriter, one at a time."""
+    header = f.readline()
+    try:
+        header = json.loads(header)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ValueError("not a plan file")
+    if header.get("version") != VERSION:
+        raise ValueError("unsupported plan file version %r" % header.get("version"))
+    for line in f:
+        if line.strip():
+            yield Plan.from_record(json.loads(line))
+
+def report(plan, display):
+    """Describes the operations a plan entails through the display
+    function, without touching the disk."""
+    if plan.skip:
+        display(plan.skip)
+        return
+    display("Would  chown %s" % plan.path)
+    display("      create %s" % plan.container_of_final_path)
+    display("        move %s" % plan.path_to_organize)
+    display("          to %s" % plan.final_path)
+    if plan.removal:
+        display("      remove %s" % plan.removal)
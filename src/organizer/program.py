@@ -6,14 +6,25 @@ Organizer program.
 '''
 
 import argparse
+import collections
+import contextlib
 from organizer import assistant
+from organizer import destinations
+from organizer import inputs
 from organizer import memory
-from organizer import ops
+from organizer import natures
+from organizer import pathutil
+from organizer.pathutil import paths_equal
 import os
+import stat
 import sys
-import traceback
+
+# The modules that carry plans out (ops, transfer, dupes, plans and
+# scheduler) are imported where they are used, so that runs which carry
+# nothing out start faster.
 
 QUIT = "user requested quit"
+WINDOW = 256
 
 def get_parser():
     '''returns argument parser for program'''
@@ -22,42 +33,298 @@ def get_parser():
                         help='execute entirely non-interactively -- existing files will not be replaced, while files whose destination directories do not exist or cannot be deduced wiil not be organized')
     parser.add_argument('-n', '--do-nothing', action="store_true", default=False,
                         help='do not touch files on disk -- only report putative modifications to standard output')
-    parser.add_argument('files', metavar='FILES', nargs='+',
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='in batch mode, plan where files go using this many workers in parallel, while still moving them one at a time in the order given (default 1)')
+    parser.add_argument('--process-pool', action="store_true", default=False,
+                        help='in batch mode, use worker processes rather than threads to plan where files go')
+    parser.add_argument('--device-jobs', type=int, default=1,
+                        help='in batch mode, move files between this many independent sets of disks at the same time, and report the throughput of each disk at the end; files are then moved one at a time in the order given, and duplicates among the files given are not looked for when applying a plan file (default 1)')
+    parser.add_argument('--memory-format', choices=("sqlite", "mapped", "pickle"), default="sqlite",
+                        help='keep what the organizer learns in an SQLite database committed as it learns (the default), in a memory-mapped file that loads at once, or in the old pickle')
+    parser.add_argument('--external-tools', action="store_true", default=False,
+                        help='move, create and remove files by running mv, mkdir and rm rather than in-process')
+    parser.add_argument('--verify-checksum', action="store_true", default=False,
+                        help='when files are copied across file systems, compare the checksums of copies and originals before removing the originals')
+    parser.add_argument('--plan', metavar='PLANFILE', default=None,
+                        help='do not touch files on disk -- write the decisions that batch mode would make to PLANFILE (- for standard output) so they can be carried out later with --apply')
+    parser.add_argument('--apply', metavar='PLANFILE', default=None,
+                        help='carry out the decisions written to PLANFILE by --plan, instead of organizing FILES')
+    parser.add_argument('--files-from', metavar='LISTFILE', default=None,
+                        help='also organize the files listed in LISTFILE, one per line (- for standard input, which requires batch mode)')
+    parser.add_argument('-0', '--null', action="store_true", default=False,
+                        help='with --files-from, the files are separated by NUL characters rather than newlines')
+    parser.add_argument('--recurse', metavar='ROOT', action="append", default=[],
+                        help='also organize what is in the folder ROOT, looking --max-depth levels down; may be given more than once')
+    parser.add_argument('--max-depth', metavar='N', type=int, default=1,
+                        help='with --recurse, organize the files N levels down, and the folders at the deepest level, rather than just what is in ROOT (default 1)')
+    parser.add_argument('--watch', metavar='DIR', default=None,
+                        help='instead of organizing FILES, keep watching DIR, and organize in batch mode what appears in it once it has stopped changing; what is skipped is not looked at again until it changes')
+    parser.add_argument('--settle', metavar='SECONDS', type=float, default=30,
+                        help='with --watch, how long an item must be left unchanged before it is organized (default 30)')
+    parser.add_argument('--stats', action="store_true", default=False,
+                        help='at the end, print to standard error how long detecting natures, resolving schemes, guessing destinations, loading and saving memory and each operation on disk took, and how many file system accesses the run and each organizee made (stages run in --process-pool workers are not counted)')
+    parser.add_argument('--profile', metavar='PROFILEFILE', default=None,
+                        help='write a cProfile dump of the stages --stats measures to PROFILEFILE; planning and moving then run one at a time')
+    parser.add_argument('--daemon', action="store_true", default=False,
+                        help='stay running, keeping memory, schemes and destination listings at hand, and organize the files that batch runs of the organizer send through a socket')
+    parser.add_argument('--no-daemon', action="store_true", default=False,
+                        help='in batch mode, organize the files in this process, rather than handing them to the organizer daemon')
+    parser.add_argument('files', metavar='FILES', nargs='*',
                         help='files to organize')
     return parser
 
-def paths_equal(p1, p2):
-    return os.path.abspath(p1) == os.path.abspath(p2)
-
 def detect_gui():
     return False  # FIXME
 
+def plan(mem, listings, f, guesses=None):
+    """Plans where the organizee f goes, without touching the disk.  The
+    organizee is skipped if it is a duplicate of something already where
+    it goes.  The file system accesses made are counted in the fs_calls
+    of the plan."""
+    from organizer import plans
+    with pathutil.counting() as fs_calls:
+        a = assistant.Assistant(mem, f, listings, guesses)
+        a.begin()
+        p = plans.Plan.from_assistant(f, a)
+        if not p.skip:
+            from organizer import dupes
+            duplicate = dupes.duplicate_of(p.path_to_organize, p.container_of_final_path)
+            if duplicate is not None:
+                p.skip = duplicate_message(p.path_to_organize, duplicate)
+    p.fs_calls = fs_calls
+    return p
+
+def duplicate_message(path, duplicate):
+    return "Skipping %s: it is a duplicate of %s" % (path, duplicate)
+
+_worker_state = None
+
+def _init_worker(mem, listings):
+    global _worker_state
+    _worker_state = (mem, listings)
+
+def _plan_in_worker(f):
+    mem, listings = _worker_state
+    return plan(mem, listings, f)
+
+def ordered_map(executor, func, iterable, window):
+    """Like executor.map, but never has more than window calls in flight,
+    so that the iterable is consumed as results are consumed."""
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
 class BatchProgram(object):
 
-    def __init__(self, operator, mem, files):
+    jobs = 1
+    process_pool = False
+    device_jobs = 1
+
+    def __init__(self, operator, mem, files, listings=None, jobs=1, process_pool=False, device_jobs=1):
+        """jobs is the number of workers used to plan where organizees go,
+        in threads, or in processes if process_pool is True.  If device_jobs
+        is more than one, plans are carried out by that many threads, each
+        working on a separate set of devices.  files may be any iterable,
+        which is consumed as the organizees are worked on.  The guesses
+        made for the organizees are memoized for the length of the run."""
         self.operator = operator
         self.memory = mem
-        self.files = list(dict(
-            (x, y)
-            for x, y in ((os.path.abspath(f), f)
-            for f in files)
-        ).values())
+        self.listings = listings
+        self.guesses = destinations.Guesses(listings)
+        self.jobs = jobs
+        self.process_pool = process_pool
+        self.device_jobs = device_jobs
+        self.files = inputs.unique(files)
+
+    def plans(self):
+        """Yields the plans for the organizees, in the order they were given.
+        With more than one job, plans are made ahead of time by a pool of
+        workers, against memory that stays unchanged until the plans are
+        executed."""
+        if self.jobs <= 1:
+            for f in self.files:
+                yield plan(self.memory, self.listings, f, self.guesses)
+            return
+        import concurrent.futures
+        if self.process_pool:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                self.jobs, initializer=_init_worker,
+                initargs=(self.memory, self.listings))
+            func = _plan_in_worker
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(self.jobs)
+            func = lambda f: plan(self.memory, self.listings, f, self.guesses)
+        with executor:
+            for p in ordered_map(executor, func, self.files, self.jobs * 4):
+                yield p
+
+    @contextlib.contextmanager
+    def listening(self):
+        """Has the operator tell the guesses about the changes it makes,
+        until the block ends."""
+        if self.operator is None:
+            yield
+            return
+        self.operator.add_listener(self.guesses)
+        try:
+            yield
+        finally:
+            self.operator.remove_listener(self.guesses)
 
     def mainloop(self):
         """Runs the CLI program."""
-        for f in self.files:
-            a = assistant.Assistant(self.memory, f)
-            a.begin()
-            if not a.container_of_final_path_exists:
-                self.display_to_user("Skipping %s: its destination directory is nonexistent or not known" % f)
+        with self.listening():
+            if self.device_jobs > 1:
+                from organizer import scheduler
+                scheduler.DeviceScheduler(self, self.device_jobs).run(self.plans())
+                return
+            touched = set()
+            remaining = self.plans()
+            pending = collections.deque()
+            while True:
+                for p in remaining:
+                    pending.append(p)
+                    if len(pending) >= WINDOW:
+                        break
+                if not pending:
+                    break
+                window = self.window(pending, touched)
+                self.execute_all(window)
+                for p in window:
+                    touched.update(p.touches)
+
+    def window(self, pending, touched):
+        """Takes from the front of pending the plans that can be carried out
+        together, replanning those that the plans carried out so far, which
+        touched the paths in touched, made stale."""
+        from organizer import plans
+        window = plans.Window()
+        while pending:
+            if self.plan_is_stale(pending[0], touched):
+                pending[0] = self.replan(pending[0])
+            if not window.admits(pending[0]):
+                break
+            window.add(pending.popleft())
+        return window.plans
+
+    def replan(self, p):
+        return plan(self.memory, self.listings, p.source, self.guesses)
+
+    def plan_is_stale(self, p, touched):
+        """Returns True if the plan was made ahead of time and the execution
+        of earlier plans, which touched the paths in touched, may have
+        changed what planning found on disk."""
+        return not touched.isdisjoint(p.dependencies())
+
+    def execute_all(self, ps):
+        """Carries out plans that do not depend on one another, then
+        remembers what they taught, in the order they were made."""
+        done = set()
+        try:
+            self.carry_out_all(ps, self.display_to_user, done.add)
+        finally:
+            for p in ps:
+                if p.skip or p in done:
+                    p.persist_in_memory(self.memory)
+
+    def _operate(self, p, operation, *args):
+        """Performs an operation of the operator for the plan, adding the
+        file system accesses made to its fs_calls."""
+        with pathutil.counting() as fs_calls:
+            operation(*args)
+        if p.fs_calls is None:
+            p.fs_calls = collections.Counter()
+        p.fs_calls.update(fs_calls)
+
+    def carry_out(self, p, display):
+        """Carries out a plan, telling the user about it through display.
+        The file system accesses made are added to the fs_calls of the
+        plan."""
+        if p.skip:
+            display(p.skip)
+            return
+        self._operate(p, self.operator.take_ownership, p.path)
+        self._operate(p, self.operator.create_directories, p.container_of_final_path)
+        self._operate(p, self.operator.move_file, p.path_to_organize, p.final_path)
+        if p.removal:
+            self._operate(p, self.operator.remove_file, p.removal)
+
+    def carry_out_all(self, ps, display, done=lambda p: None):
+        """Carries out plans that do not depend on one another, telling the
+        user about them through display, and calling done with each plan
+        once it has been carried out.
+
+        Plans that duplicate an earlier plan going to the same directory are
+        skipped, as they would be if the earlier one had been carried out
+        before they were made.  The plans going to each directory are then
+        carried out together, when the first of them comes up: ownership is
+        taken of their organizees, the directory is created once, and the
+        organizees are moved in the order of their inodes, which keeps the
+        disks from seeking back and forth."""
+        moving = collections.OrderedDict()
+        for p in ps:
+            if p.skip:
                 continue
-            self.organize(a, a.nature)
-            a.persist_in_memory()
+            duplicate = self._duplicate_in(moving.get(p.container_of_final_path, ()), p)
+            if duplicate is not None:
+                p.skip = duplicate_message(p.path_to_organize, duplicate.final_path)
+            else:
+                moving.setdefault(p.container_of_final_path, []).append(p)
+        for p in ps:
+            if p.skip:
+                display(p.skip)
+                continue
+            group = moving.pop(p.container_of_final_path, None)
+            if group is None:
+                continue
+            for q in sorted(group, key=lambda q: q.path):
+                self._operate(q, self.operator.take_ownership, q.path)
+            self._operate(group[0], self.operator.create_directories, p.container_of_final_path)
+            for q in sorted(group, key=self._inode_of):
+                self._operate(q, self.operator.move_file, q.path_to_organize, q.final_path)
+                if q.removal:
+                    self._operate(q, self.operator.remove_file, q.removal)
+                done(q)
+
+    def _inode_of(self, p):
+        try:
+            return pathutil.lstat(p.path_to_organize).st_ino
+        except OSError:
+            return 0
+
+    def _duplicate_in(self, group, p):
+        """Returns the plan in group whose organizee p duplicates, if any."""
+        from organizer import dupes
+        if not group:
+            return None
+        try:
+            comparer = dupes.Comparer(p.path_to_organize, pathutil.lstat(p.path_to_organize))
+        except OSError:
+            return None
+        if not stat.S_ISREG(comparer.st.st_mode):
+            return None
+        for other in group:
+            try:
+                st = pathutil.lstat(other.path_to_organize)
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and comparer.same_as(other.path_to_organize, st):
+                return other
+        return None
 
     def organize(self, assistant, nature):
+        from organizer import dupes
         if paths_equal(nature.path_to_organize, assistant.final_path):
             self.display_to_user("Skipping %s: it appears to be already organized" % nature.path_to_organize)
             return
+        duplicate = dupes.duplicate_of(nature.path_to_organize, assistant.container_of_final_path)
+        if duplicate is not None:
+            self.display_to_user(duplicate_message(nature.path_to_organize, duplicate))
+            return
         self.operator.take_ownership(nature.path)
         self.operator.create_directories(assistant.container_of_final_path)
         self.operator.move_file(nature.path_to_organize, assistant.final_path)
@@ -70,12 +337,69 @@ class BatchProgram(object):
     def display_error(self, msg):
         print(msg, file=sys.stderr)
 
+class WatchProgram(BatchProgram):
+    """A batch program that lists the organizees it skipped in skipped."""
+
+    def __init__(self, *args, **kwargs):
+        BatchProgram.__init__(self, *args, **kwargs)
+        self.skipped = []
+
+    def execute_all(self, ps):
+        BatchProgram.execute_all(self, ps)
+        self.skipped.extend(p.source for p in ps if p.skip)
+
+class PlanningProgram(BatchProgram):
+    """A batch program that hands the plans it makes to a writer, which has
+    a write(plan) method, instead of carrying them out."""
+
+    def __init__(self, writer, mem, files, listings=None, jobs=1, process_pool=False):
+        BatchProgram.__init__(self, None, mem, files, listings, jobs, process_pool)
+        self.writer = writer
+
+    def plan_is_stale(self, p, touched):
+        # Nothing is carried out, so the disk stays as it was planned against.
+        return False
+
+    def execute_all(self, ps):
+        for p in ps:
+            self.writer.write(p)
+
+class ReportProgram(PlanningProgram):
+    """A batch program that describes the plans it makes to the user."""
+
+    def __init__(self, mem, files, listings=None, jobs=1, process_pool=False):
+        PlanningProgram.__init__(self, self, mem, files, listings, jobs, process_pool)
+
+    def write(self, p):
+        from organizer import plans
+        plans.report(p, self.display_to_user)
+
+class ApplyProgram(BatchProgram):
+    """A batch program that carries out plans read from a plan file, without
+    examining organizees or destinations again."""
+
+    def __init__(self, operator, mem, planfile):
+        BatchProgram.__init__(self, operator, mem, [])
+        self.planfile = planfile
+
+    def plans(self):
+        from organizer import plans
+        return plans.read_plans(self.planfile)
+
+    def plan_is_stale(self, p, touched):
+        # The plans are carried out as recorded, never made again.
+        return False
+
 class CLIProgram(BatchProgram):
 
     def mainloop(self):
         """Runs the CLI program."""
+        with self.listening():
+            self.assist()
+
+    def assist(self):
         for f in self.files:
-            a = assistant.Assistant(self.memory, f)
+            a = assistant.Assistant(self.memory, f, self.listings, self.guesses)
             self.current_assistant = a
             a.begin()
             last_prompt = None
@@ -143,43 +467,243 @@ class CLIProgram(BatchProgram):
             self.display_to_user("Incorrect choice %r" % read)
             return self.prompt(prompt)
 
-def mainloop():
+def open_memory(fmt):
+    """Opens the memory kept in the given format, copying what the old
+    pickled memory knew into it the first time."""
+    pickled = os.path.expanduser("~/.organizer")
+    try:
+        if fmt == "sqlite":
+            return memory.SQLiteMemory.open(os.path.expanduser("~/.organizer.sqlite"), pickled)
+        if fmt == "mapped":
+            return memory.MappedMemory.open(os.path.expanduser("~/.organizer.mmap"), pickled)
+    except Exception as e:
+        print("Cannot open %s memory, falling back to ~/.organizer: %s" % (fmt, e),
+              file=sys.stderr)
+    try:
+        memcontents = open(pickled, "rb").read()
+        return memory.SerializableMemory.deserialize(memcontents)
+    except Exception:
+        return memory.SerializableMemory()
+
+def flush_memory(mem):
+    """Writes what the memory learned to disk, if it does not do so by
+    itself as it learns."""
+    if isinstance(mem, memory.SQLiteMemory):
+        return
+    if isinstance(mem, memory.MappedMemory):
+        if mem.dirty:
+            mem.save()
+    else:
+        memcontents = mem.serialize()
+        open(os.path.expanduser("~/.organizer"), "wb").write(memcontents)
+
+def save_memory(mem):
+    flush_memory(mem)
+    if hasattr(mem, "close"):
+        mem.close()
+
+def parse_args(argv=None):
+    """Parses and checks the command line arguments."""
     parser = get_parser()
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    if args.plan and args.apply:
+        parser.error("--plan and --apply cannot be used together")
+    listed = args.files or args.files_from or args.recurse
+    if args.apply and listed:
+        parser.error("no FILES may be given with --apply")
+    if args.watch and (listed or args.plan or args.apply):
+        parser.error("no FILES, --plan or --apply may be given with --watch")
+    if not args.daemon and not args.watch and not args.apply and not listed:
+        parser.error("the following arguments are required: FILES")
+    if args.max_depth < 1:
+        parser.error("--max-depth must be at least 1")
+    if args.plan or args.apply or args.watch:
+        args.batch = True
+    if args.files_from == "-" and not args.batch:
+        parser.error("--files-from - can only be used in batch mode")
+    return args
+
+def open_organizees(args):
+    """Replaces args.files with an iterable of every organizee the
+    arguments name, read as it is iterated over.  Returns the file the
+    organizees are listed in, for the caller to close once done, or None
+    if there is none to close."""
+    files_from = opened = None
+    if args.files_from == "-":
+        files_from = sys.stdin.buffer
+    elif args.files_from:
+        files_from = opened = open(args.files_from, "rb")
+    args.files = inputs.organizees(args.files, files_from, args.null,
+                                   args.recurse, args.max_depth)
+    return opened
+
+def load_schemes():
+    with open(os.path.expanduser("~/.organizer-schemes")) as f:
+        natures.load_schemes(f)
+
+def load_listings():
     try:
-        memcontents = open(os.path.expanduser("~/.organizer"), "rb").read()
-        mem = memory.SerializableMemory.deserialize(memcontents)
+        listingscontents = open(os.path.expanduser("~/.organizer-listings"), "rb").read()
+        return destinations.Listings.deserialize(listingscontents)
     except Exception:
-        mem = memory.SerializableMemory()
+        return destinations.Listings()
 
-    gui_available = detect_gui()
-    if args.batch:
-        sys.stdin.close()
-        gui_available = False
+def save_listings(listings):
+    listingscontents = listings.serialize()
+    open(os.path.expanduser("~/.organizer-listings"), "wb").write(listingscontents)
+
+def make_operator(args, listings, gui_available=False):
+    from organizer import ops
     if args.do_nothing:
         operator = ops.CLIReportOperator()
     else:
         if gui_available:
             operator = ops.KIOOperator()
-        else:
+        elif args.external_tools:
             operator = ops.CLIOperator()
-    if args.batch:
-        program = BatchProgram(operator, mem, args.files)
+        else:
+            operator = ops.NativeOperator(args.verify_checksum)
+    if args.files_from == "-":
+        # Standard input holds the organizees, not answers to prompts.
+        operator.ask = ops.decline
+    operator.add_listener(listings)
+    return operator
+
+def make_batch_program(args, operator, mem, listings):
+    """Returns the program that runs a batch without a plan file."""
+    if args.do_nothing:
+        return ReportProgram(mem, args.files, listings,
+                             args.jobs, args.process_pool)
+    return BatchProgram(operator, mem, args.files, listings,
+                        args.jobs, args.process_pool,
+                        args.device_jobs)
+
+def watch_mainloop(args, operator, mem, listings):
+    """Organizes what settles in the folder being watched, until
+    interrupted."""
+    from organizer import watch
+
+    def organize(items):
+        if args.do_nothing:
+            program = ReportProgram(mem, items, listings, args.jobs, args.process_pool)
+        else:
+            program = WatchProgram(operator, mem, items, listings, args.jobs, args.process_pool)
+        try:
+            program.mainloop()
+        except Exception as e:
+            program.display_error("Unexpected exception while running: %s" % e)
+        try:
+            flush_memory(mem)
+        except Exception as e:
+            program.display_error("Cannot save memory: %s" % e)
+        if listings.dirty:
+            try:
+                save_listings(listings)
+            except Exception as e:
+                program.display_error("Cannot save destination listings: %s" % e)
+        # What was only reported is not reported again until it changes.
+        return items if args.do_nothing else program.skipped
+
+    try:
+        watch.watch(args.watch, organize, args.settle,
+                    os.path.expanduser("~/.organizer-watch"))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+def mainloop():
+    args = parse_args()
+    if args.daemon:
+        from organizer import daemon
+        return daemon.serve(args.memory_format)
+    if not args.stats and not args.profile:
+        return run(args)
+    from organizer import stats
+    profiler = None
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        args.jobs = args.device_jobs = 1
+    s = stats.Stats(profiler)
+    s.instrument()
+    try:
+        return run(args, s)
+    finally:
+        s.restore()
+        if args.stats:
+            s.report()
+            s.report_calls()
+        if profiler is not None:
+            profiler.dump_stats(args.profile)
+
+def run(args, stats=None):
+    """Runs the program the arguments ask for, measuring its operations
+    with stats if given."""
+    mem = open_memory(args.memory_format)
+    try:
+        load_schemes()
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        print("Cannot load schemes: %s" % e, file=sys.stderr)
+        return 16
+    listings = load_listings()
+
+    files_from = open_organizees(args)
+    try:
+        return run_program(args, stats, mem, listings)
+    finally:
+        if files_from is not None:
+            files_from.close()
+
+def run_program(args, stats, mem, listings):
+    """Runs the program the arguments ask for, once memory, schemes,
+    listings and organizees are ready."""
+    gui_available = detect_gui()
+    if args.batch and args.files_from != "-":
+        sys.stdin.close()
+        gui_available = False
+    operator = make_operator(args, listings, gui_available)
+    if stats is not None:
+        stats.instrument_operator(operator)
+    if args.watch:
+        status = watch_mainloop(args, operator, mem, listings)
+        save_memory(mem)
+        return status
+    planfile = None
+    if args.plan:
+        from organizer import plans
+        planfile = sys.stdout if args.plan == "-" else open(args.plan, "w")
+        program = PlanningProgram(plans.PlanWriter(planfile), mem, args.files,
+                                  listings, args.jobs, args.process_pool)
+    elif args.apply:
+        planfile = open(args.apply)
+        program = ApplyProgram(operator, mem, planfile)
+    elif args.batch:
+        program = make_batch_program(args, operator, mem, listings)
     else:
         if gui_available:
-            pass  # FIXME            program = GUIProgram(operator, mem, args.files)
+            pass  # FIXME            program = GUIProgram(operator, mem, args.files, listings)
         else:
-            program = CLIProgram(operator, mem, args.files)
+            program = CLIProgram(operator, mem, args.files, listings)
     try:
         program.mainloop()
     except Exception as e:
         program.display_error("Unexpected exception while running: %s" % e)
+        import traceback
         traceback.print_exc()
         return 14
+    finally:
+        if planfile not in (None, sys.stdout):
+            planfile.close()
     try:
-        memcontents = mem.serialize()
-        open(os.path.expanduser("~/.organizer"), "wb").write(memcontents)
+        save_memory(mem)
     except Exception as e:
         program.display_error("Cannot save memory: %s" % e)
         return 18
+    if listings.dirty:
+        try:
+            save_listings(listings)
+        except Exception as e:
+            program.display_error("Cannot save destination listings: %s" % e)
     return 0
@@ -0,0 +1,333 @@
+#!/usr/bin/python3
+
+'''Program tests.'''
+
+import io
+import os
+import subprocess
+import sys
+import unittest
+from organizer import destinations
+from organizer import memory
+from organizer import natures
+from organizer import ops
+from organizer import plans
+from organizer import program
+from organizer.testutil import dirtree
+
+class RecordingOperator(ops.Operator):
+
+    def __init__(self):
+        self.ops_performed = []
+
+    def take_ownership(self, f):
+        self.ops_performed.append(("take_ownership", f))
+
+    def move_file(self, original, new):
+        self.ops_performed.append(("move_file", original, new))
+
+    def create_directories(self, container):
+        self.ops_performed.append(("create_directories", container))
+
+    def remove_file(self, f):
+        self.ops_performed.append(("remove_file", f))
+
+class RecordingBatchProgram(program.BatchProgram):
+
+    def __init__(self, *args, **kwargs):
+        program.BatchProgram.__init__(self, *args, **kwargs)
+        self.displayed = []
+
+    def display_to_user(self, msg):
+        self.displayed.append(msg)
+
+def run_batch(d, organizees, **kwargs):
+    mem = memory.SerializableMemory()
+    mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+    mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+    operator = RecordingOperator()
+    files = [ os.path.join(d, f) for f in organizees ]
+    p = RecordingBatchProgram(operator, mem, files, **kwargs)
+    p.mainloop()
+    return operator.ops_performed, p.displayed, mem.destinations_for_nature
+
+class TestBatchProgram(unittest.TestCase):
+
+    tree = [
+        "dl/Bones.S01E01.avi",
+        "dl/Bones.S01E02.avi",
+        "dl/Castle.S02E01.avi",
+        "dl/Bones S01E04/Bones.S01E04.avi",
+        "TV/Bones/Season 1/Bones.S01E03.avi",
+        "TV/Castle/Season 1/Castle.S01E01.avi",
+    ]
+    organizees = [
+        "dl/Bones.S01E01.avi",
+        "dl/Castle.S02E01.avi",
+        "TV/Bones/Season 1/Bones.S01E03.avi",
+        "dl/Bones.S01E02.avi",
+        "dl/Bones S01E04",
+    ]
+
+    def test_serial(self):
+        with dirtree(self.tree) as d:
+            performed, displayed, _ = run_batch(d, self.organizees)
+            j = lambda *p: os.path.join(d, *p)
+            # Ownership is taken once per source tree, the season folder is
+            # created once, and the episodes are moved in inode order.
+            moves = sorted([
+                [("move_file", j("dl/Bones.S01E01.avi"), j("TV/Bones/Season 1/Bones.S01E01.avi"))],
+                [("move_file", j("dl/Bones.S01E02.avi"), j("TV/Bones/Season 1/Bones.S01E02.avi"))],
+                [("move_file", j("dl/Bones S01E04/Bones.S01E04.avi"), j("TV/Bones/Season 1/Bones.S01E04.avi")),
+                 ("remove_file", j("dl/Bones S01E04"))],
+            ], key=lambda m: os.lstat(m[0][1]).st_ino)
+            self.assertListEqual(performed, [
+                ("take_ownership", j("dl/Bones S01E04")),
+                ("take_ownership", j("dl/Bones.S01E01.avi")),
+                ("take_ownership", j("dl/Bones.S01E02.avi")),
+                ("create_directories", j("TV/Bones/Season 1")),
+            ] + [ o for m in moves for o in m ])
+            self.assertListEqual(displayed, [
+                "Skipping %s: its destination directory is nonexistent or not known" % j("dl/Castle.S02E01.avi"),
+                "Skipping %s: it appears to be already organized" % j("TV/Bones/Season 1/Bones.S01E03.avi"),
+            ])
+
+    def test_parallel_planning_same_as_serial(self):
+        with dirtree(self.tree) as d:
+            serial = run_batch(d, self.organizees)
+            self.assertEqual(run_batch(d, self.organizees, jobs=4), serial)
+            self.assertEqual(run_batch(d, self.organizees, jobs=2, process_pool=True), serial)
+
+    def test_device_scheduler_same_as_serial(self):
+        with dirtree(self.tree) as d:
+            performed, displayed, mem = run_batch(d, self.organizees)
+            p_performed, p_displayed, p_mem = run_batch(d, self.organizees, jobs=4, device_jobs=4)
+            self.assertEqual((p_displayed[:len(displayed)], p_mem), (displayed, mem))
+            changes = lambda ops: sorted(o for o in ops if o[0] in ("move_file", "remove_file"))
+            self.assertEqual(changes(p_performed), changes(performed))
+
+    def test_device_scheduler_carries_out_plans_one_at_a_time(self):
+        with dirtree(["TV/Bones/Season 1/.keep"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            organizees = ["dl/Bones.S01E02.avi", "dl/Bones.S01E01.avi", "dl/Bones.S01E01.720p.avi"]
+            for path in organizees:
+                os.makedirs(os.path.dirname(j(path)), exist_ok=True)
+                with open(j(path), "wb") as f:
+                    f.write(b"episode")
+            # The recording operator moves nothing, so the duplicate is not
+            # found when its plan is made again after the first move.
+            performed, displayed, _ = run_batch(d, organizees, device_jobs=2)
+            self.assertListEqual(performed, [
+                o for f in organizees for o in (
+                    ("take_ownership", j(f)),
+                    ("create_directories", j("TV/Bones/Season 1")),
+                    ("move_file", j(f), j("TV/Bones/Season 1", os.path.basename(f))),
+                )
+            ])
+            self.assertFalse([ m for m in displayed if "duplicate" in m ])
+
+    def test_parallel_planning_replans_after_moves(self):
+        # The movie folder lands in the TV destination, where it then is the
+        # best guess for the show, whose season folder is not there.
+        tree = [
+            "dl/Bonez/movie.avi",
+            "dl/Bonez.S01E01.avi",
+            "TV/Bones/Season 1/Bones.S01E03.avi",
+        ]
+        for jobs in (1, 4):
+            with dirtree(tree) as d:
+                j = lambda *p: os.path.join(d, *p)
+                mem = memory.SerializableMemory()
+                mem.remember_destination_for_nature(natures.MovieFolder, j("TV"))
+                mem.remember_destination_for_nature(natures.TVShow, j("TV"))
+                files = [ j("dl/Bonez"), j("dl/Bonez.S01E01.avi") ]
+                p = RecordingBatchProgram(ops.CLIOperator(), mem, files, jobs=jobs)
+                p.mainloop()
+                assert os.path.isfile(j("TV/Bonez/movie.avi")), jobs
+                self.assertListEqual(p.displayed, [
+                    "Skipping %s: its destination directory is nonexistent or not known" % j("dl/Bonez.S01E01.avi"),
+                ], jobs)
+
+    def test_destinations_listed_once_per_run(self):
+        episodes = [ "dl/Bones.S01E%02d.avi" % n for n in range(1, 21) ]
+        with dirtree(episodes + self.tree) as d:
+            listed = []
+            old = destinations.list_subfolders
+            def list_subfolders(path):
+                listed.append(path)
+                return old(path)
+            destinations.list_subfolders = list_subfolders
+            try:
+                performed, _, _ = run_batch(d, episodes)
+            finally:
+                destinations.list_subfolders = old
+            self.assertEqual(len([ o for o in performed if o[0] == "move_file" ]), 20)
+            self.assertEqual(listed, [ os.path.join(d, "TV") ])
+
+    def test_duplicates_are_skipped(self):
+        with dirtree(["TV/Bones/Season 1/.keep"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            for path in ("dl/Bones.S01E01.avi", "TV/Bones/Season 1/Bones.S01E01.720p.avi"):
+                os.makedirs(os.path.dirname(j(path)), exist_ok=True)
+                with open(j(path), "wb") as f:
+                    f.write(b"episode")
+            performed, displayed, _ = run_batch(d, ["dl/Bones.S01E01.avi"])
+            self.assertListEqual(performed, [])
+            self.assertListEqual(displayed, [
+                "Skipping %s: it is a duplicate of %s" % (j("dl/Bones.S01E01.avi"),
+                                                         j("TV/Bones/Season 1/Bones.S01E01.720p.avi")),
+            ])
+
+    def test_duplicates_in_one_window_are_skipped(self):
+        with dirtree(["TV/Bones/Season 1/.keep"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            for path in ("dl/Bones.S01E01.avi", "dl/Bones.S01E01.720p.avi"):
+                os.makedirs(os.path.dirname(j(path)), exist_ok=True)
+                with open(j(path), "wb") as f:
+                    f.write(b"episode")
+            performed, displayed, _ = run_batch(d, ["dl/Bones.S01E01.avi", "dl/Bones.S01E01.720p.avi"])
+            self.assertEqual([ o for o in performed if o[0] == "move_file" ], [
+                ("move_file", j("dl/Bones.S01E01.avi"), j("TV/Bones/Season 1/Bones.S01E01.avi")),
+            ])
+            self.assertListEqual(displayed, [
+                "Skipping %s: it is a duplicate of %s" % (j("dl/Bones.S01E01.720p.avi"),
+                                                         j("TV/Bones/Season 1/Bones.S01E01.avi")),
+            ])
+
+    def test_native_operator_spawns_no_processes(self):
+        spawned = []
+        old_popen = subprocess.Popen
+        class CountingPopen(old_popen):
+            def __init__(self, *args, **kwargs):
+                spawned.append(args)
+                old_popen.__init__(self, *args, **kwargs)
+        with dirtree(self.tree) as d:
+            mem = memory.SerializableMemory()
+            mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+            mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+            files = [ os.path.join(d, f) for f in self.organizees ]
+            p = RecordingBatchProgram(ops.NativeOperator(), mem, files)
+            subprocess.Popen = CountingPopen
+            try:
+                p.mainloop()
+            finally:
+                subprocess.Popen = old_popen
+            assert os.path.isfile(os.path.join(d, "TV/Bones/Season 1/Bones.S01E04.avi"))
+            assert not os.path.exists(os.path.join(d, "dl/Bones S01E04"))
+            self.assertEqual(spawned, [])
+
+class TestPlans(unittest.TestCase):
+
+    def test_plan_then_apply(self):
+        with dirtree(TestBatchProgram.tree) as d:
+            mem = memory.SerializableMemory()
+            mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+            mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+            files = [ os.path.join(d, f) for f in TestBatchProgram.organizees ]
+            out = io.StringIO()
+            program.PlanningProgram(plans.PlanWriter(out), mem, files).mainloop()
+            serial = run_batch(d, TestBatchProgram.organizees)
+
+            out.seek(0)
+            mem = memory.SerializableMemory()
+            operator = RecordingOperator()
+            p = program.ApplyProgram(operator, mem, out)
+            p.displayed = []
+            p.display_to_user = p.displayed.append
+            old_detect_nature = natures.detect_nature
+            natures.detect_nature = None
+            try:
+                p.mainloop()
+            finally:
+                natures.detect_nature = old_detect_nature
+            self.assertEqual((operator.ops_performed, p.displayed, mem.destinations_for_nature), serial)
+
+    def test_apply_does_not_plan_again(self):
+        with dirtree(TestBatchProgram.tree) as d:
+            mem = memory.SerializableMemory()
+            mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+            mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+            files = [ os.path.join(d, f) for f in TestBatchProgram.organizees ]
+            out = io.StringIO()
+            program.PlanningProgram(plans.PlanWriter(out), mem, files).mainloop()
+
+            out.seek(0)
+            operator = RecordingOperator()
+            p = program.ApplyProgram(operator, memory.SerializableMemory(), out)
+            p.display_to_user = lambda msg: None
+            detected = []
+            old_detect_nature, old_window = natures.detect_nature, program.WINDOW
+            natures.detect_nature = lambda *a, **kw: detected.append(a)
+            # More plans than fit in a window, all going to the same directory.
+            program.WINDOW = 2
+            try:
+                p.mainloop()
+            finally:
+                natures.detect_nature, program.WINDOW = old_detect_nature, old_window
+            self.assertEqual(detected, [])
+            self.assertEqual(len([ o for o in operator.ops_performed if o[0] == "move_file" ]), 3)
+
+    def test_report(self):
+        with dirtree(TestBatchProgram.tree) as d:
+            mem = memory.SerializableMemory()
+            mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+            j = lambda *p: os.path.join(d, *p)
+            p = program.ReportProgram(mem, [j("dl/Bones S01E04")])
+            displayed = []
+            p.display_to_user = displayed.append
+            p.mainloop()
+            self.assertListEqual(displayed, [
+                "Would  chown %s" % j("dl/Bones S01E04"),
+                "      create %s" % j("TV/Bones/Season 1"),
+                "        move %s" % j("dl/Bones S01E04/Bones.S01E04.avi"),
+                "          to %s" % j("TV/Bones/Season 1/Bones.S01E04.avi"),
+                "      remove %s" % j("dl/Bones S01E04"),
+            ])
+
+    def test_window(self):
+        def p(path, final, speculated=(), skip=None):
+            p = plans.Plan()
+            p.path = p.path_to_organize = path
+            p.final_path = final
+            p.container_of_final_path = os.path.dirname(final)
+            p.speculated = speculated
+            p.skip = skip
+            return p
+        w = plans.Window()
+        w.add(p("/dl/a.avi", "/TV/A/Season 1/a.avi", ("/TV",)))
+        # Another episode going to the same season folder.
+        assert w.admits(p("/dl/b.avi", "/TV/A/Season 1/b.avi", ("/TV",)))
+        # An organizee inside the tree of one in the window.
+        assert not w.admits(p("/dl/a.avi/x.avi", "/Movies/x.avi"))
+        # A folder landing in a directory whose subfolders guided guesses.
+        assert not w.admits(p("/dl/B", "/TV/B"))
+        # Something moved out of a directory that was examined.
+        assert not w.admits(p("/TV/A/Season 1/c.avi", "/Movies/c.avi"))
+        w.add(p("/dl/c.avi", "/Movies/c.avi", skip="Skipping"))
+        assert not w.admits(p("/dl/c.avi", "/Movies/c.avi"))
+        self.assertEqual(len(w), 2)
+
+    def test_not_a_plan_file(self):
+        self.assertRaises(ValueError, list, plans.read_plans(io.StringIO("[]\n")))
+
+    def test_no_prompts_when_organizees_come_from_stdin(self):
+        args = program.parse_args(["-b", "--files-from", "-"])
+        operator = program.make_operator(args, destinations.Listings())
+        old_stdin, old_stderr = sys.stdin, sys.stderr
+        sys.stdin, sys.stderr = io.StringIO("y\n/the/next/organizee\n"), io.StringIO()
+        try:
+            self.assertFalse(operator.ask("mv: overwrite 'x'? "))
+            self.assertEqual(sys.stdin.read(), "y\n/the/next/organizee\n")
+            self.assertEqual(sys.stderr.getvalue(), "mv: overwrite 'x'? \n")
+        finally:
+            sys.stdin, sys.stderr = old_stdin, old_stderr
+
+class TestStartup(unittest.TestCase):
+
+    def test_slow_modules_not_imported(self):
+        code = ("import sys; import organizer.program; "
+                "print([m for m in ('jinja2', 'difflib', 'concurrent.futures') if m in sys.modules])")
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.path.dirname(os.path.dirname(os.path.abspath(program.__file__)))
+        out = subprocess.check_output([sys.executable, "-c", code], env=env)
+        self.assertEqual(out.strip(), b"[]")
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+'''Scheduler.
+
+This code carries out plans in parallel across independent devices, while
+keeping the plans that share a device in the order they were made.'''
+
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+from organizer import pathutil
+
+def device_of(path):
+    """Returns the device that path, or its closest existing parent, lives
+    on, or None if that cannot be known."""
+    while True:
+        try:
+            return pathutil.stat(path).st_dev
+        except FileNotFoundError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        except OSError:
+            return None
+
+def size_of(path):
+    """Returns the number of bytes in the file or directory tree at path."""
+    try:
+        st = pathutil.lstat(path)
+    except OSError:
+        return 0
+    size = st.st_size
+    if pathutil.isdir(path) and not pathutil.islink(path):
+        for root, dirs, files in pathutil.walk(path):
+            for n in dirs + files:
+                try:
+                    size += pathutil.lstat(os.path.join(root, n)).st_size
+                except OSError:
+                    pass
+    return size
+
+def device_name(dev):
+    return "%d:%d" % (os.major(dev), os.minor(dev))
+
+def human_size(n):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if n < 1024:
+            return "%.1f %s" % (n, unit)
+        n = n / 1024.0
+    return "%.1f TiB" % n
+
+class _Entry(object):
+    """A plan being scheduled, along with the plans that must wait for it
+    and the number of plans it waits for."""
+
+    def __init__(self, p):
+        self.p = p
+        self.waiting = 0
+        self.successors = []
+        self.keys = []
+        self.finished = False
+        self.outcome = None
+        self.done = threading.Event()
+
+class DeviceScheduler(object):
+    """The DeviceScheduler carries out the plans of a BatchProgram in a pool
+    of threads.  A plan waits for the plans made before it that share a
+    source or target device with it, or that change on disk what it depends
+    on; all other plans run in parallel.  Plans are read from the stream as
+    they are needed, no more than AHEAD per thread ahead of the earliest
+    plan not yet finished.
+
+    Messages for the user and memory updates are still issued in the order
+    of the plans.  When a plan fails, no further plans are started, and the
+    first failure is raised once the plans already running have finished.
+
+    Each plan is carried out on its own with BatchProgram.carry_out, not
+    grouped with the other plans going to the same directory as
+    BatchProgram.carry_out_all does: the directory is created for every
+    plan, the organizees are moved in the order of the plans rather than of
+    their inodes, and an organizee that duplicates another one moved to
+    the same directory is only found out if its plan is made again, which
+    plans read from a plan file never are."""
+
+    AHEAD = 16
+
+    def __init__(self, program, jobs):
+        self.program = program
+        self.jobs = jobs
+        self.throughput = collections.defaultdict(lambda: [0, 0, 0, 0.0])
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._touched = set()
+
+    def devices(self, p):
+        devs = set([device_of(p.path)])
+        if p.container_of_final_path:
+            devs.add(device_of(p.container_of_final_path))
+        devs.discard(None)
+        return devs
+
+    def _account(self, p, elapsed):
+        if p.skip:
+            return
+        source, target = device_of(p.path_to_organize), device_of(p.container_of_final_path)
+        size = size_of(p.final_path) if source != target else 0
+        with self._lock:
+            for dev in set([source, target]):
+                if dev is None:
+                    continue
+                t = self.throughput[dev]
+                t[0] += 1
+                if source != target:
+                    t[1] += 1
+                    t[2] += size
+                    t[3] += elapsed
+
+    def _link(self, e, last):
+        """Makes e wait for the latest unfinished entries in last that share
+        a device with it or touch what it depends on, then makes it the
+        latest for its devices and the paths it touches.  Returns True if
+        e need not wait for anything."""
+        p = e.p
+        keys = [ ("device", dev) for dev in self.devices(p) ]
+        waits_on = keys + [ ("path", dep) for dep in p.dependencies() ]
+        with self._lock:
+            for key in waits_on:
+                pred = last.get(key)
+                if pred is not None and not pred.finished and e not in pred.successors:
+                    pred.successors.append(e)
+                    e.waiting += 1
+            e.keys = keys + [ ("path", t) for t in p.touches ]
+            for key in e.keys:
+                last[key] = e
+            return e.waiting == 0
+
+    def _unlink(self, e, last):
+        with self._lock:
+            for key in e.keys:
+                if last.get(key) is e:
+                    del last[key]
+
+    def _carry_out(self, executor, e):
+        p = e.p
+        messages = []
+        error = None
+        if self._stop.is_set():
+            p = None
+        else:
+            try:
+                with self._lock:
+                    touched = set(self._touched)
+                if self.program.plan_is_stale(p, touched):
+                    p = self.program.replan(p)
+                start = time.monotonic()
+                self.program.carry_out(p, messages.append)
+                self._account(p, time.monotonic() - start)
+                with self._lock:
+                    self._touched.update(p.touches)
+            except Exception as ex:
+                error = ex
+                self._stop.set()
+        e.outcome = (p, messages, error)
+        with self._lock:
+            e.finished = True
+            ready = []
+            for s in e.successors:
+                s.waiting -= 1
+                if s.waiting == 0:
+                    ready.append(s)
+            e.successors = []
+        for s in ready:
+            executor.submit(self._carry_out, executor, s)
+        e.done.set()
+
+    def run(self, plans):
+        """Carries out the plans, then reports the throughput of each
+        device that files were copied to or from."""
+        plans = iter(plans)
+        window = collections.deque()
+        last = dict()
+        failure = None
+        exhausted = False
+        with concurrent.futures.ThreadPoolExecutor(self.jobs) as executor:
+            while True:
+                while not exhausted and not self._stop.is_set() and \
+                      len(window) < self.jobs * self.AHEAD:
+                    try:
+                        e = _Entry(next(plans))
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    window.append(e)
+                    if self._link(e, last):
+                        executor.submit(self._carry_out, executor, e)
+                if not window:
+                    break
+                e = window.popleft()
+                e.done.wait()
+                self._unlink(e, last)
+                p, messages, error = e.outcome
+                for m in messages:
+                    self.program.display_to_user(m)
+                if error is not None:
+                    if failure is None:
+                        failure = error
+                elif p is not None:
+                    p.persist_in_memory(self.program.memory)
+        self.report()
+        if failure is not None:
+            raise failure
+
+    def report(self):
+        for dev, (moves, copies, size, elapsed) in sorted(self.throughput.items()):
+            line = "Device %s: %d moves" % (device_name(dev), moves)
+            if copies:
+                rate = size / elapsed if elapsed else 0
+                line += ", %d copies, %s in %.1f s (%s/s)" % (
+                    copies, human_size(size), elapsed, human_size(rate))
+            self.program.display_to_user(line)
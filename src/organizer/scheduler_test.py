@@ -0,0 +1,128 @@
+#!/usr/bin/python3
+
+'''Scheduler tests.'''
+
+import unittest
+from organizer import plans
+from organizer import scheduler
+
+def make_plan(path, container, skip=None):
+    p = plans.Plan()
+    p.source = p.path = p.path_to_organize = path
+    p.container_of_final_path = container
+    p.final_path = container + "/" + path.split("/")[-1]
+    p.skip = skip
+    return p
+
+class FakeProgram(object):
+
+    memory = None
+
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.carried_out = []
+        self.displayed = []
+
+    def plan_is_stale(self, p, touched):
+        return False
+
+    def carry_out(self, p, display):
+        if p.skip:
+            display(p.skip)
+            return
+        if p.path == self.fail_on:
+            raise OSError("cannot move %s" % p.path)
+        self.carried_out.append(p.path)
+        display("moved %s" % p.path)
+
+    def display_to_user(self, msg):
+        self.displayed.append(msg)
+
+class TestDeviceScheduler(unittest.TestCase):
+
+    devices = {
+        "/dl": 1,
+        "/movies": 2,
+        "/tv": 3,
+        "/music": 4,
+        "/usb": 5,
+    }
+
+    def setUp(self):
+        self.old_device_of = scheduler.device_of
+        scheduler.device_of = lambda path: self.devices["/" + path.split("/")[1]]
+
+    def tearDown(self):
+        scheduler.device_of = self.old_device_of
+
+    def test_waits(self):
+        ps = [
+            make_plan("/dl/a.avi", "/movies"),
+            make_plan("/usb/b.mp3", "/music"),
+            make_plan("/dl/c.avi", "/tv/C"),
+            make_plan("/usb/d.mp3", "/music/D"),
+            make_plan("/music/D", "/usb/Backup"),
+        ]
+        s = scheduler.DeviceScheduler(FakeProgram(), 4)
+        es = [ scheduler._Entry(p) for p in ps ]
+        last = dict()
+        self.assertEqual([ s._link(e, last) for e in es ], [True, True, False, False, False])
+        self.assertEqual([ e.successors for e in es ], [[es[2]], [es[3], es[4]], [], [es[4]], []])
+
+    def test_dependent_plans_wait(self):
+        ps = [
+            make_plan("/dl/Show", "/tv"),
+            make_plan("/tv/Show/x.avi", "/movies"),
+        ]
+        devices = {"/dl/Show": 1, "/tv": 2, "/tv/Show/x.avi": 3, "/movies": 4}
+        scheduler.device_of = devices.get
+        s = scheduler.DeviceScheduler(FakeProgram(), 4)
+        es = [ scheduler._Entry(p) for p in ps ]
+        last = dict()
+        self.assertEqual([ s._link(e, last) for e in es ], [True, False])
+
+    def test_plans_read_as_needed(self):
+        read = []
+        def stream():
+            for n in range(500):
+                read.append(n)
+                yield make_plan("/dl/%d.avi" % n if n % 2 else "/usb/%d.mp3" % n,
+                                "/movies" if n % 2 else "/music")
+        ahead = []
+        program = FakeProgram()
+        carry_out = program.carry_out
+        def recording_carry_out(p, display):
+            ahead.append(len(read) - len(program.carried_out))
+            carry_out(p, display)
+        program.carry_out = recording_carry_out
+        s = scheduler.DeviceScheduler(program, 2)
+        s.run(stream())
+        self.assertEqual(len(program.carried_out), 500)
+        assert max(ahead) <= 2 * s.AHEAD, max(ahead)
+
+    def test_messages_in_order(self):
+        ps = [ make_plan("/dl/%d.avi" % n if n % 2 else "/usb/%d.mp3" % n,
+                         "/movies" if n % 2 else "/music") for n in range(20) ]
+        ps[3].skip = "Skipping 3"
+        program = FakeProgram()
+        scheduler.DeviceScheduler(program, 4).run(ps)
+        expected = [ "moved %s" % p.path if not p.skip else p.skip for p in ps ]
+        self.assertEqual(program.displayed[:len(ps)], expected)
+        self.assertEqual(program.displayed[len(ps):], [
+            "Device 0:1: 9 moves, 9 copies, 0.0 B in 0.0 s (0.0 B/s)",
+            "Device 0:2: 9 moves, 9 copies, 0.0 B in 0.0 s (0.0 B/s)",
+            "Device 0:4: 10 moves, 10 copies, 0.0 B in 0.0 s (0.0 B/s)",
+            "Device 0:5: 10 moves, 10 copies, 0.0 B in 0.0 s (0.0 B/s)",
+        ])
+
+    def test_failure(self):
+        ps = [
+            make_plan("/dl/a.avi", "/movies"),
+            make_plan("/dl/b.avi", "/movies"),
+            make_plan("/dl/c.avi", "/movies"),
+        ]
+        program = FakeProgram(fail_on="/dl/b.avi")
+        s = scheduler.DeviceScheduler(program, 4)
+        self.assertRaises(OSError, s.run, ps)
+        self.assertEqual(program.carried_out, ["/dl/a.avi"])
+        self.assertEqual(program.displayed[0], "moved /dl/a.avi")
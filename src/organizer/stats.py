@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+
+'''Statistics.
+
+This code measures how long each stage of the organizer takes: detecting
+natures, resolving schemes, guessing destinations, loading and saving
+memory, and every operation carried out on disk.  The stages are wrapped
+only when measuring is enabled, so nothing is paid for otherwise.  It also
+reports the file system accesses counted by pathutil, for the whole run
+and for each organizee.'''
+
+import collections
+import functools
+import sys
+import threading
+import time
+from organizer import pathutil
+
+OPERATIONS = ("take_ownership", "create_directories", "move_file", "remove_file")
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class Stats(object):
+    """Stats keeps the duration of every call to each stage.  If profiler
+    is a cProfile.Profile, it is enabled while the stages run, and only
+    then."""
+
+    def __init__(self, profiler=None):
+        self.durations = collections.OrderedDict()
+        self.profiler = profiler
+        self._local = threading.local()
+        self._undo = []
+        self.calls_at_start = collections.Counter()
+        self.fs_calls = []
+
+    def wrap(self, stage, func):
+        """Returns func wrapped so that calls to it are measured as stage."""
+        durations = self.durations.setdefault(stage, [])
+        profiler = self.profiler
+        local = self._local
+
+        @functools.wraps(func)
+        def measured(*args, **kwargs):
+            depth = getattr(local, "depth", 0)
+            local.depth = depth + 1
+            if profiler is not None and depth == 0:
+                profiler.enable()
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - start)
+                if profiler is not None and depth == 0:
+                    profiler.disable()
+                local.depth = depth
+        return measured
+
+    def patch(self, owner, attr, stage):
+        """Replaces the attribute of owner, a module, class or instance,
+        with a measured version, until restore() is called."""
+        self.replace(owner, attr, self.wrap(stage, getattr(owner, attr)))
+
+    def replace(self, owner, attr, new):
+        had = attr in vars(owner)
+        old = getattr(owner, attr)
+        setattr(owner, attr, new)
+        if had:
+            self._undo.append(lambda: setattr(owner, attr, old))
+        else:
+            self._undo.append(lambda: delattr(owner, attr))
+
+    def instrument(self):
+        """Measures the stages the organizer goes through while planning."""
+        from organizer import destinations
+        from organizer import natures
+        from organizer import program
+        self.patch(natures, "detect_nature", "detect_nature")
+        self.patch(natures.Nature, "resolve", "resolve")
+        self.patch(destinations.Destination, "guess_best_hint", "guess_best_hint")
+        self.patch(program, "open_memory", "memory load")
+        self.patch(program, "flush_memory", "memory save")
+        self.calls_at_start = collections.Counter(pathutil.calls)
+        plan = program.plan
+        fs_calls = self.fs_calls
+
+        @functools.wraps(plan)
+        def recorded(*args, **kwargs):
+            p = plan(*args, **kwargs)
+            fs_calls.append(p.fs_calls)
+            return p
+        self.replace(program, "plan", recorded)
+
+    def instrument_operator(self, operator):
+        """Measures every operation carried out by operator."""
+        for name in OPERATIONS:
+            self.patch(operator, name, "Operator.%s" % name)
+
+    def restore(self):
+        while self._undo:
+            self._undo.pop()()
+
+    def report(self, f=sys.stderr):
+        """Prints the wall time, call count and median and 99th percentile
+        latencies of each stage that ran."""
+        print("%-28s %8s %12s %12s %12s" % ("stage", "calls", "total ms", "p50 ms", "p99 ms"), file=f)
+        for stage, durations in self.durations.items():
+            if not durations:
+                continue
+            ordered = sorted(durations)
+            print("%-28s %8d %12.1f %12.3f %12.3f" % (
+                  stage, len(ordered), sum(ordered) * 1e3,
+                  percentile(ordered, 0.5) * 1e3, percentile(ordered, 0.99) * 1e3), file=f)
+
+    def report_calls(self, f=sys.stderr):
+        """Prints the file system accesses of each kind made in the run, and
+        the mean and maximum made for each organizee planned, including
+        those made carrying its plan out."""
+        total = pathutil.calls - self.calls_at_start
+        print("%-28s %8s %12s %12s" % ("file system", "calls", "mean/item", "max/item"), file=f)
+        for kind in sorted(total):
+            per = [ c[kind] for c in self.fs_calls ] or [0]
+            print("%-28s %8d %12.1f %12d" % (
+                  kind, total[kind], sum(per) / len(per), max(per)), file=f)
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+
+'''Statistics tests.'''
+
+import cProfile
+import io
+import os
+import pstats
+import unittest
+from organizer import destinations
+from organizer import memory
+from organizer import natures
+from organizer import program
+from organizer import stats
+from organizer import program_test
+from organizer.testutil import dirtree
+
+class TestStats(unittest.TestCase):
+
+    def run_instrumented(self, d, s):
+        mem = memory.SerializableMemory()
+        mem.remember_destination_for_nature(natures.TVShow, os.path.join(d, "TV"))
+        mem.remember_destination_for_nature(natures.TVShowContainer, os.path.join(d, "TV"))
+        operator = program_test.RecordingOperator()
+        s.instrument()
+        s.instrument_operator(operator)
+        try:
+            files = [ os.path.join(d, f) for f in program_test.TestBatchProgram.organizees ]
+            program_test.RecordingBatchProgram(operator, mem, files).mainloop()
+        finally:
+            s.restore()
+        return operator
+
+    def test_stages(self):
+        originals = (natures.detect_nature, natures.Nature.resolve,
+                     destinations.Destination.guess_best_hint, program.open_memory)
+        with dirtree(program_test.TestBatchProgram.tree) as d:
+            s = stats.Stats()
+            operator = self.run_instrumented(d, s)
+        counts = dict((stage, len(durations)) for stage, durations in s.durations.items())
+        self.assertEqual(counts["detect_nature"], 5)
+        self.assertEqual(counts["Operator.move_file"], 3)
+        self.assertEqual(counts["Operator.remove_file"], 1)
+        assert counts["guess_best_hint"] > 0
+        assert counts["resolve"] > 0
+        self.assertEqual((natures.detect_nature, natures.Nature.resolve,
+                          destinations.Destination.guess_best_hint, program.open_memory), originals)
+        assert "move_file" not in vars(operator)
+        out = io.StringIO()
+        s.report(out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0].split(), ["stage", "calls", "total", "ms", "p50", "ms", "p99", "ms"])
+        self.assertEqual([ l.split()[0] for l in lines[1:] ],
+                         ["detect_nature", "resolve", "guess_best_hint",
+                          "Operator.take_ownership", "Operator.create_directories",
+                          "Operator.move_file", "Operator.remove_file"])
+
+    def test_profile_is_scoped(self):
+        with dirtree(program_test.TestBatchProgram.tree) as d:
+            profiler = cProfile.Profile()
+            self.run_instrumented(d, stats.Stats(profiler))
+        functions = set(f for _, _, f in pstats.Stats(profiler).stats)
+        assert "detect_nature" in functions
+        assert "mainloop" not in functions
+
+    def test_percentile(self):
+        ordered = list(range(100))
+        self.assertEqual(stats.percentile(ordered, 0.5), 50)
+        self.assertEqual(stats.percentile(ordered, 0.99), 99)
+        self.assertEqual(stats.percentile([3], 0.99), 3)
+
+    def test_filesystem_calls(self):
+        original = program.plan
+        with dirtree(program_test.TestBatchProgram.tree) as d:
+            s = stats.Stats()
+            self.run_instrumented(d, s)
+        self.assertEqual(len(s.fs_calls), 5)
+        out = io.StringIO()
+        s.report_calls(out)
+        lines = dict((l.split()[0], l.split()[1:]) for l in out.getvalue().splitlines()[1:])
+        assert int(lines["dirread"][0]) >= 5, lines
+        self.assertEqual(program.plan, original)
@@ -0,0 +1,315 @@
+#!/usr/bin/python3
+
+'''Tags.
+
+This code reads the artist, album and year of music files from their ID3v2
+tags, FLAC Vorbis comments and MP4 metadata atoms.  Only the blocks that
+hold the tags are read, a few kilobytes at most, never the music itself.
+What is read is cached by the identity, size and modification time of each
+file, so a file is read again only after it changes.'''
+
+import collections
+import os
+import re
+import struct
+import threading
+from organizer import pathutil
+
+HEADER_BYTES = 4096
+MAX_TAG_BYTES = 256 * 1024
+CACHE_SIZE = 100000
+
+ID3_FRAMES = {
+    b"TPE1": "artist", b"TP1": "artist",
+    b"TPE2": "albumartist", b"TP2": "albumartist",
+    b"TALB": "album", b"TAL": "album",
+    b"TYER": "year", b"TYE": "year", b"TDRC": "year",
+    b"TCMP": "compilation", b"TCP": "compilation",
+}
+
+VORBIS_FIELDS = {
+    "ARTIST": "artist",
+    "ALBUMARTIST": "albumartist",
+    "ALBUM ARTIST": "albumartist",
+    "ALBUM": "album",
+    "DATE": "year",
+    "YEAR": "year",
+    "COMPILATION": "compilation",
+}
+
+MP4_ITEMS = {
+    b"\xa9ART": "artist",
+    b"aART": "albumartist",
+    b"\xa9alb": "album",
+    b"\xa9day": "year",
+    b"cpil": "compilation",
+}
+
+VARIOUS_ARTISTS = re.compile(r"(VA$|Various[ ._-]Artists)", re.I)
+
+MP4_CONTAINERS = (b"moov", b"udta", b"meta", b"ilst")
+
+class Reader(object):
+    """Reads bounded pieces of an open file at given offsets.  The file is
+    read HEADER_BYTES at a time, and pieces within the last block read are
+    served from memory, so that small tags, and tags right after a frame
+    that was skipped over, take a single read.  Every read is counted as a
+    file system access."""
+
+    def __init__(self, fd, size):
+        self.fd = fd
+        self.size = size
+        self.offset = 0
+        self.block = b""
+        self.head = self.read(0, HEADER_BYTES)
+
+    def read(self, offset, length):
+        length = min(length, MAX_TAG_BYTES)
+        start = offset - self.offset
+        if start >= 0 and offset + length <= self.offset + len(self.block):
+            return self.block[start:start + length]
+        pathutil.count("read")
+        self.offset = offset
+        self.block = os.pread(self.fd, max(length, HEADER_BYTES), offset)
+        return self.block[:length]
+
+class BufferReader(object):
+    """Reads pieces of data already in memory, like a Reader."""
+
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def read(self, offset, length):
+        return self.data[offset:offset + length]
+
+def _syncsafe(b):
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+def _decode_id3_text(data):
+    if not data:
+        return ""
+    encoding, data = data[0], data[1:]
+    if encoding == 1:
+        text = data.decode("utf-16", "replace")
+    elif encoding == 2:
+        text = data.decode("utf-16-be", "replace")
+    elif encoding == 3:
+        text = data.decode("utf-8", "replace")
+    else:
+        text = data.decode("latin-1")
+    return text.split("\0")[0].strip()
+
+def read_id3(reader, header):
+    """Returns the tags in the ID3v2 tag at the start of the file.  Frames
+    are read one at a time, and those that hold no wanted tags, like cover
+    art, are skipped over."""
+    version, flags = header[3], header[5]
+    end = 10 + _syncsafe(header[6:10])
+    pos = 10
+    if flags & 0x80 and version < 4:
+        # The whole tag is unsynchronised, so it must be read to be parsed.
+        data = reader.read(pos, end - pos).replace(b"\xff\x00", b"\xff")
+        reader, pos, end = BufferReader(data), 0, len(data)
+    if flags & 0x40 and version > 2:
+        extsize = struct.unpack(">I", reader.read(pos, 4))[0]
+        pos += extsize if version == 4 else extsize + 4
+    idlen, headlen = (3, 6) if version == 2 else (4, 10)
+    wanted = set(ID3_FRAMES.values())
+    tags = dict()
+    while pos + headlen <= end and wanted:
+        frameheader = reader.read(pos, headlen)
+        frameid = frameheader[:idlen]
+        if len(frameheader) < headlen or not frameid.strip(b"\0"):
+            break
+        if version == 2:
+            framesize = int.from_bytes(frameheader[3:6], "big")
+        elif version == 4:
+            framesize = _syncsafe(frameheader[4:8])
+        else:
+            framesize = struct.unpack(">I", frameheader[4:8])[0]
+        key = ID3_FRAMES.get(frameid)
+        if key in wanted:
+            tags[key] = _decode_id3_text(reader.read(pos + headlen, framesize))
+            wanted.discard(key)
+        pos += headlen + framesize
+    return tags
+
+def _vorbis_comments(data):
+    tags = dict()
+    try:
+        vendorlen = struct.unpack("<I", data[:4])[0]
+        pos = 4 + vendorlen
+        count = struct.unpack("<I", data[pos:pos + 4])[0]
+        pos += 4
+        for _ in range(count):
+            length = struct.unpack("<I", data[pos:pos + 4])[0]
+            comment = data[pos + 4:pos + 4 + length].decode("utf-8", "replace")
+            pos += 4 + length
+            name, _, value = comment.partition("=")
+            key = VORBIS_FIELDS.get(name.upper())
+            if key is not None and key not in tags:
+                tags[key] = value.strip()
+    except struct.error:
+        pass
+    return tags
+
+def read_flac(reader):
+    """Returns the tags in the Vorbis comment block of a FLAC file.  The
+    metadata blocks before it are skipped over, not read."""
+    pos = 4
+    while pos < reader.size:
+        header = reader.read(pos, 4)
+        if len(header) < 4:
+            break
+        last, kind = header[0] & 0x80, header[0] & 0x7f
+        length = int.from_bytes(header[1:4], "big")
+        if kind == 4:
+            return _vorbis_comments(reader.read(pos + 4, length))
+        if last:
+            break
+        pos += 4 + length
+    return dict()
+
+def _mp4_boxes(reader, start, end):
+    """Yields the type, and the offsets of the contents and the end, of the
+    MP4 boxes between start and end."""
+    pos = start
+    while pos + 8 <= end:
+        header = reader.read(pos, 16)
+        if len(header) < 8:
+            return
+        size, kind = struct.unpack(">I4s", header[:8])
+        offset = 8
+        if size == 1 and len(header) == 16:
+            size = struct.unpack(">Q", header[8:16])[0]
+            offset = 16
+        elif size == 0:
+            size = end - pos
+        if size < offset:
+            return
+        yield kind, pos + offset, pos + size
+        pos += size
+
+def _mp4_value(key, data):
+    if key == "compilation":
+        return "1" if data.strip(b"\0") else "0"
+    return data.decode("utf-8", "replace").strip()
+
+def read_mp4(reader):
+    """Returns the tags in the metadata item list of an MP4 file, reached
+    through the moov, udta and meta boxes, skipping over the rest."""
+    start, end = 0, reader.size
+    for container in MP4_CONTAINERS:
+        for kind, content, boxend in _mp4_boxes(reader, start, end):
+            if kind == container:
+                # The meta box is a full box, with four bytes of version and flags.
+                start, end = content + (4 if kind == b"meta" else 0), boxend
+                break
+        else:
+            return dict()
+    tags = dict()
+    data = reader.read(start, end - start)
+    pos = 0
+    while pos + 8 <= len(data):
+        size, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if size < 8:
+            break
+        key = MP4_ITEMS.get(kind)
+        item = data[pos + 8:pos + size]
+        # The value is in a data box, after its type and locale.
+        if key is not None and item[4:8] == b"data":
+            tags[key] = _mp4_value(key, item[16:struct.unpack(">I", item[:4])[0]])
+        pos += size
+    return tags
+
+def read_tags(path):
+    """Returns a dictionary of the artist, albumartist, album, year and
+    compilation tags found in the music file at path.  Tags that are not
+    found are left out, and so is everything else for files that cannot
+    be read or are not in a known format."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return dict()
+    try:
+        reader = Reader(fd, os.fstat(fd).st_size)
+        header = reader.head
+        if header[:3] == b"ID3" and len(header) >= 10:
+            tags = read_id3(reader, header)
+        elif header[:4] == b"fLaC":
+            tags = read_flac(reader)
+        elif header[4:8] == b"ftyp":
+            tags = read_mp4(reader)
+        else:
+            tags = dict()
+    except (OSError, struct.error, IndexError):
+        tags = dict()
+    finally:
+        os.close(fd)
+    if "year" in tags:
+        tags["year"] = tags["year"][:4]
+    return dict((k, v) for k, v in tags.items() if v)
+
+class TagCache(object):
+    """A cache of the tags of music files, keyed by the device, inode, size
+    and modification time of each file, which holds the tags of the
+    maxsize files most recently asked about."""
+
+    def __init__(self, maxsize=CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def tags(self, path):
+        """Returns the tags of the music file at path, reading them only if
+        it changed since they were last read."""
+        try:
+            st = pathutil.stat(path)
+        except OSError:
+            return dict()
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        with self._lock:
+            try:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            except KeyError:
+                pass
+        tags = read_tags(path)
+        with self._lock:
+            self.entries[key] = tags
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+        return tags
+
+cache = TagCache()
+
+def most_common(values):
+    """Returns the value that appears the most times, the first of them to
+    appear if there is a tie, or None if there are no values."""
+    counts = collections.Counter(values)
+    if not counts:
+        return None
+    best = max(counts.values())
+    for v in values:
+        if counts[v] == best:
+            return v
+
+def album_tags(tracks):
+    """Returns the artist, album and year that most of the tracks agree on,
+    and whether they make up a compilation: their tags say so, or their
+    album artist is various artists.  The album artist is given as the
+    artist if there is one."""
+    everything = [ cache.tags(t) for t in tracks ]
+    props = dict()
+    for key in ("albumartist", "artist", "album", "year"):
+        value = most_common([ t[key] for t in everything if key in t ])
+        if value is not None:
+            props[key] = value
+    compilation = False
+    if "albumartist" in props:
+        compilation = VARIOUS_ARTISTS.match(props["albumartist"]) is not None
+        props["artist"] = props.pop("albumartist")
+    if any(t.get("compilation") == "1" for t in everything):
+        compilation = True
+    return props, compilation
@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+
+'''Tag reader tests.'''
+
+import os
+import struct
+import unittest
+from organizer import pathutil
+from organizer import tags
+from organizer.testutil import dirtree
+
+AUDIO = b"\xff\xfb" * (512 * 1024)
+
+def syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f, n & 0x7f])
+
+def id3(frames, version=3):
+    """Returns an ID3v2 tag with the frames, a list of (id, text) pairs,
+    encoded as UTF-8 text, or as raw bytes if text is bytes."""
+    body = b""
+    for frameid, text in frames:
+        data = text if isinstance(text, bytes) else b"\x03" + text.encode("utf-8")
+        size = syncsafe(len(data)) if version == 4 else struct.pack(">I", len(data))
+        body += frameid + size + b"\0\0" + data
+    return b"ID3" + bytes([version, 0, 0]) + syncsafe(len(body)) + body
+
+def flac(comments, padding=0):
+    vendor = b"reference"
+    block = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(comments))
+    for c in comments:
+        c = c.encode("utf-8")
+        block += struct.pack("<I", len(c)) + c
+    streaminfo = b"\0\0\0\x22" + b"\0" * 34
+    pad = bytes([1]) + len(padding * b"\0").to_bytes(3, "big") + b"\0" * padding
+    comment = bytes([0x84]) + len(block).to_bytes(3, "big") + block
+    return b"fLaC" + streaminfo + pad + comment
+
+def box(kind, content):
+    return struct.pack(">I", len(content) + 8) + kind + content
+
+def mp4(items):
+    ilst = b""
+    for kind, value in items:
+        ilst += box(kind, box(b"data", b"\0\0\0\x01\0\0\0\0" + value))
+    meta = box(b"meta", b"\0\0\0\0" + box(b"hdlr", b"\0" * 25) + box(b"ilst", ilst))
+    return (box(b"ftyp", b"M4A \0\0\0\0") + box(b"mdat", AUDIO) +
+            box(b"moov", box(b"mvhd", b"\0" * 100) + box(b"udta", meta)))
+
+class TestReadTags(unittest.TestCase):
+
+    def write(self, d, name, data):
+        path = os.path.join(d, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with pathutil.counting() as calls:
+            found = tags.read_tags(path)
+        return found, calls["read"]
+
+    def test_id3(self):
+        expected = {"artist": "Dyango", "album": "Corazón", "year": "1985"}
+        with dirtree([]) as d:
+            for version in (3, 4):
+                path = self.write(d, "a.mp3", id3([
+                    (b"TPE1", "Dyango"),
+                    (b"APIC", b"\0" * 200000),
+                    (b"TALB", "Corazón"),
+                    (b"TYER" if version == 3 else b"TDRC", "1985-02-01"),
+                ], version) + AUDIO)
+                found, reads = self.read(path)
+                self.assertEqual(found, expected)
+                # The header, then the frames after the cover art.
+                assert reads <= 3, reads
+
+    def test_id3_v22(self):
+        data = b"ID3\x02\0\0"
+        body = b"TP1" + (7).to_bytes(3, "big") + b"\0Dyango"
+        body += b"TCP" + (2).to_bytes(3, "big") + b"\x001"
+        with dirtree([]) as d:
+            path = self.write(d, "a.mp3", data + syncsafe(len(body)) + body + AUDIO)
+            self.assertEqual(tags.read_tags(path), {"artist": "Dyango", "compilation": "1"})
+
+    def test_flac(self):
+        with dirtree([]) as d:
+            path = self.write(d, "a.flac", flac(["ARTIST=Dyango", "album=Corazón",
+                                                 "DATE=1985", "TITLE=Corazón"],
+                                                padding=100000) + AUDIO)
+            found, reads = self.read(path)
+            self.assertEqual(found, {"artist": "Dyango", "album": "Corazón", "year": "1985"})
+            assert reads <= 3, reads
+
+    def test_mp4(self):
+        with dirtree([]) as d:
+            path = self.write(d, "a.m4a", mp4([(b"\xa9ART", b"Dyango"),
+                                               (b"aART", b"Various Artists"),
+                                               (b"\xa9alb", b"Boleros"),
+                                               (b"cpil", b"\x01")]))
+            found, reads = self.read(path)
+            self.assertEqual(found, {"artist": "Dyango", "albumartist": "Various Artists",
+                                     "album": "Boleros", "compilation": "1"})
+            # Box headers only, past the audio, then the item list.
+            assert reads <= 8, reads
+
+    def test_unknown(self):
+        with dirtree(["a.mp3"]) as d:
+            self.assertEqual(tags.read_tags(os.path.join(d, "a.mp3")), {})
+            self.assertEqual(tags.read_tags(os.path.join(d, "missing.mp3")), {})
+            path = self.write(d, "b.mp3", b"ID3\x03\0\0\x7f\x7f\x7f\x7f" + b"\xff" * 30)
+            self.assertEqual(tags.read_tags(path), {})
+
+class TestTagCache(unittest.TestCase):
+
+    def test_read_once_until_changed(self):
+        cache = tags.TagCache()
+        with dirtree([]) as d:
+            path = os.path.join(d, "a.mp3")
+            with open(path, "wb") as f:
+                f.write(id3([(b"TPE1", "Dyango")]))
+            with pathutil.counting() as calls:
+                for _ in range(3):
+                    self.assertEqual(cache.tags(path), {"artist": "Dyango"})
+            self.assertEqual(calls["read"], 1)
+            with open(path, "wb") as f:
+                f.write(id3([(b"TPE1", "Raphael")]) + b"\0")
+            self.assertEqual(cache.tags(path), {"artist": "Raphael"})
+
+    def test_bounded(self):
+        cache = tags.TagCache(maxsize=2)
+        with dirtree(["a.mp3", "b.mp3", "c.mp3"]) as d:
+            for n in "abc":
+                cache.tags(os.path.join(d, n + ".mp3"))
+            self.assertEqual(len(cache.entries), 2)
+
+class TestAlbumTags(unittest.TestCase):
+
+    def album(self, d, trackartists, albumartist=None, compilation=False):
+        tracks = []
+        for n, artist in enumerate(trackartists):
+            frames = [(b"TPE1", artist), (b"TALB", "Boleros"), (b"TYER", "1999")]
+            if albumartist:
+                frames.append((b"TPE2", albumartist))
+            if compilation:
+                frames.append((b"TCMP", "1"))
+            path = os.path.join(d, "%02d.mp3" % n)
+            with open(path, "wb") as f:
+                f.write(id3(frames))
+            tracks.append(path)
+        return tracks
+
+    def test_album(self):
+        with dirtree([]) as d:
+            props, compilation = tags.album_tags(self.album(d, ["Dyango"] * 5 + ["Raphael"]))
+            self.assertEqual(props, {"artist": "Dyango", "album": "Boleros", "year": "1999"})
+            assert not compilation
+
+    def test_compilation(self):
+        with dirtree([]) as d:
+            props, compilation = tags.album_tags(self.album(d, ["A", "B", "C", "D"], compilation=True))
+            self.assertEqual(props, {"artist": "A", "album": "Boleros", "year": "1999"})
+            assert compilation
+        with dirtree([]) as d:
+            props, compilation = tags.album_tags(self.album(d, ["A", "B"], "Various Artists"))
+            self.assertEqual(props["artist"], "Various Artists")
+            assert compilation
+
+    def test_many_artists_without_a_signal(self):
+        with dirtree([]) as d:
+            props, compilation = tags.album_tags(self.album(d, ["A", "B", "C", "D"]))
+            self.assertEqual(props["artist"], "A")
+            assert not compilation
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+
+'''Transfers.
+
+This code copies files and directory trees across file systems in chunks,
+into a partial copy that can be resumed if the transfer is interrupted,
+and without evicting everything else from the page cache.  Partial files
+are marked with the identity of their source in an extended attribute,
+and only resumed for that same source; where extended attributes are not
+supported, copies start over.'''
+
+import errno
+import hashlib
+import os
+import shutil
+import stat
+from organizer import pathutil
+
+CHUNK_BYTES = 8 * 1024 * 1024
+SYNC_BYTES = 64 * 1024 * 1024
+SOURCE_XATTR = "user.organizer.source"
+
+class TransferError(OSError):
+    """Raised when a copy does not turn out identical to its source."""
+
+def partial_name(target):
+    """Returns the name of the partial copy made while transferring to
+    target.  It lives next to target, so it can be renamed into place."""
+    return os.path.join(os.path.dirname(target),
+                        ".%s.organizer-partial" % os.path.basename(target))
+
+def _drop_cache(fd, offset, length):
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+_copy_file_range_works = hasattr(os, "copy_file_range")
+_sendfile_works = hasattr(os, "sendfile")
+
+def _copy_range(infd, outfd, offset, count):
+    """Copies up to count bytes at offset from infd to the same offset in
+    outfd, with the fastest means available, and returns how many bytes
+    were copied."""
+    global _copy_file_range_works, _sendfile_works
+    if _copy_file_range_works:
+        try:
+            return os.copy_file_range(infd, outfd, count, offset, offset)
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            _copy_file_range_works = False
+    if _sendfile_works:
+        try:
+            os.lseek(outfd, offset, os.SEEK_SET)
+            return os.sendfile(outfd, infd, offset, count)
+        except OSError as e:
+            if e.errno not in (errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+            _sendfile_works = False
+    data = os.pread(infd, count, offset)
+    return os.pwrite(outfd, data, offset)
+
+def _checksum(fd, size):
+    h = hashlib.sha256()
+    offset = 0
+    while offset < size:
+        data = os.pread(fd, min(CHUNK_BYTES, size - offset), offset)
+        if not data:
+            break
+        h.update(data)
+        _drop_cache(fd, offset, len(data))
+        offset += len(data)
+    return h.digest()
+
+def _is_complete(src_st, dst):
+    try:
+        dst_st = pathutil.lstat(dst)
+    except FileNotFoundError:
+        return False
+    return (dst_st.st_size == src_st.st_size and
+            dst_st.st_mtime_ns == src_st.st_mtime_ns)
+
+def _identity(st):
+    return ("%d:%d:%d:%d" % (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)).encode("ascii")
+
+def mark_partial(fd, src_st):
+    """Records in the partial file open as fd that it is a copy of the file
+    whose stat is src_st.  Returns False if that cannot be recorded."""
+    try:
+        os.setxattr(fd, SOURCE_XATTR, _identity(src_st))
+        return True
+    except (AttributeError, OSError):
+        return False
+
+def _is_partial_of(fd, src_st):
+    try:
+        return os.getxattr(fd, SOURCE_XATTR) == _identity(src_st)
+    except (AttributeError, OSError):
+        return False
+
+def _unmark_partial(fd):
+    try:
+        os.removexattr(fd, SOURCE_XATTR)
+    except (AttributeError, OSError):
+        pass
+
+def copy_file(src, dst, verify_checksum=False):
+    """Copies the regular file src to dst.  If dst is a partial copy of src,
+    as marked by mark_partial, the copy resumes after the data in it that
+    was known to be on disk, which is everything up to the last multiple of
+    SYNC_BYTES; anything else in dst is copied over.  A finished copy gets
+    the times of src, and is left alone if copied again.  The size of the
+    copy, and optionally its SHA-256 checksum, are checked against src."""
+    src_st = pathutil.stat(src)
+    if _is_complete(src_st, dst):
+        return
+    infd = os.open(src, os.O_RDONLY)
+    try:
+        outfd = os.open(dst, os.O_RDWR | os.O_CREAT, stat.S_IMODE(src_st.st_mode) | stat.S_IWUSR)
+        try:
+            size = src_st.st_size
+            if _is_partial_of(outfd, src_st):
+                offset = os.fstat(outfd).st_size
+                offset = min(offset, size) // SYNC_BYTES * SYNC_BYTES
+            else:
+                offset = 0
+            os.ftruncate(outfd, offset)
+            mark_partial(outfd, src_st)
+            try:
+                os.posix_fadvise(infd, offset, size - offset, os.POSIX_FADV_SEQUENTIAL)
+            except (AttributeError, OSError):
+                pass
+            synced = offset
+            while offset < size:
+                copied = _copy_range(infd, outfd, offset, min(CHUNK_BYTES, size - offset))
+                if copied == 0:
+                    break
+                offset += copied
+                if offset - synced >= SYNC_BYTES or offset == size:
+                    os.fdatasync(outfd)
+                    _drop_cache(infd, synced, offset - synced)
+                    _drop_cache(outfd, synced, offset - synced)
+                    synced = offset
+            copied_size = os.fstat(outfd).st_size
+            if copied_size != size:
+                raise TransferError(errno.EIO, "copy of %s has %d bytes instead of %d" % (src, copied_size, size), dst)
+            if verify_checksum and _checksum(infd, size) != _checksum(outfd, size):
+                raise TransferError(errno.EIO, "copy of %s does not match its checksum" % src, dst)
+            _unmark_partial(outfd)
+        finally:
+            os.close(outfd)
+    finally:
+        os.close(infd)
+    os.chmod(dst, stat.S_IMODE(src_st.st_mode))
+    os.utime(dst, ns=(src_st.st_atime_ns, src_st.st_mtime_ns))
+
+def _copy_entry(src, dst, verify_checksum):
+    st = pathutil.lstat(src)
+    if stat.S_ISLNK(st.st_mode):
+        if not pathutil.lexists(dst):
+            os.symlink(pathutil.readlink(src), dst)
+    elif stat.S_ISDIR(st.st_mode):
+        if not pathutil.isdir(dst):
+            os.mkdir(dst)
+        names = sorted(pathutil.listdir(src))
+        for name in set(pathutil.listdir(dst)).difference(names):
+            stale = os.path.join(dst, name)
+            if pathutil.isdir(stale) and not pathutil.islink(stale):
+                shutil.rmtree(stale)
+            else:
+                os.unlink(stale)
+        for name in names:
+            _copy_entry(os.path.join(src, name), os.path.join(dst, name), verify_checksum)
+        os.chmod(dst, stat.S_IMODE(st.st_mode))
+        os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+    elif stat.S_ISREG(st.st_mode):
+        copy_file(src, dst, verify_checksum)
+    else:
+        raise TransferError(errno.EINVAL, "cannot transfer special file", src)
+
+def copy_to_partial(src, target, verify_checksum=False):
+    """Copies src, a file, symbolic link or directory tree, to the partial
+    copy for target, resuming whatever an earlier, interrupted call left
+    there.  Returns the name of the partial copy, ready to be renamed to
+    target."""
+    partial = partial_name(target)
+    _copy_entry(src, partial, verify_checksum)
+    return partial
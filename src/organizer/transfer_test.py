@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+
+'''Transfer tests.'''
+
+import os
+import unittest
+from organizer import pathutil
+from organizer import transfer
+from organizer.testutil import dirtest
+
+class TestTransfer(unittest.TestCase):
+
+    def setUp(self):
+        self.old = transfer.CHUNK_BYTES, transfer.SYNC_BYTES
+        transfer.CHUNK_BYTES, transfer.SYNC_BYTES = 1000, 4000
+
+    def tearDown(self):
+        transfer.CHUNK_BYTES, transfer.SYNC_BYTES = self.old
+
+    def write(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_copy_file(self):
+        with dirtest() as d:
+            data = os.urandom(10500)
+            self.write(os.path.join(d, "a.mkv"), data)
+            partial = transfer.copy_to_partial(os.path.join(d, "a.mkv"), os.path.join(d, "b.mkv"), True)
+            self.assertEqual(partial, os.path.join(d, ".b.mkv.organizer-partial"))
+            self.assertEqual(self.read(partial), data)
+            self.assertEqual(os.stat(partial).st_mtime_ns, os.stat(os.path.join(d, "a.mkv")).st_mtime_ns)
+
+    def test_resume(self):
+        with dirtest() as d:
+            data = os.urandom(10500)
+            src = os.path.join(d, "a.mkv")
+            self.write(src, data)
+            # An interrupted copy got past the first synced 4000 bytes, but
+            # what it wrote after them may not have made it to disk.
+            partial = transfer.partial_name(os.path.join(d, "b.mkv"))
+            self.write(partial, data[:4000] + b"\0" * 2500)
+            fd = os.open(partial, os.O_RDONLY)
+            try:
+                if not transfer.mark_partial(fd, os.stat(src)):
+                    self.skipTest("extended attributes are not supported here")
+            finally:
+                os.close(fd)
+            copied = []
+            old_copy_range = transfer._copy_range
+            def copy_range(infd, outfd, offset, count):
+                copied.append(offset)
+                return old_copy_range(infd, outfd, offset, count)
+            transfer._copy_range = copy_range
+            try:
+                partial = transfer.copy_to_partial(src, os.path.join(d, "b.mkv"))
+            finally:
+                transfer._copy_range = old_copy_range
+            self.assertEqual(self.read(partial), data)
+            self.assertEqual(copied[0], 4000)
+            copied[:] = []
+            transfer._copy_range = copy_range
+            try:
+                transfer.copy_to_partial(src, os.path.join(d, "b.mkv"))
+            finally:
+                transfer._copy_range = old_copy_range
+            self.assertEqual(copied, [])
+
+    def test_partial_of_another_source_not_resumed(self):
+        with dirtest() as d:
+            data = os.urandom(10500)
+            src = os.path.join(d, "a.mkv")
+            self.write(src, data)
+            partial = transfer.partial_name(os.path.join(d, "b.mkv"))
+            self.write(partial, os.urandom(6500))
+            transfer.copy_to_partial(src, os.path.join(d, "b.mkv"))
+            self.assertEqual(self.read(partial), data)
+            self.assertRaises(OSError, os.getxattr, partial, transfer.SOURCE_XATTR)
+
+    def test_copy_tree(self):
+        with dirtest() as d:
+            src = os.path.join(d, "src")
+            os.makedirs(os.path.join(src, "Subs"))
+            self.write(os.path.join(src, "a.mkv"), b"a" * 5000)
+            self.write(os.path.join(src, "Subs", "a.srt"), b"subs")
+            os.symlink("a.mkv", os.path.join(src, "link.mkv"))
+            partial = transfer.partial_name(os.path.join(d, "dst"))
+            os.mkdir(partial)
+            self.write(os.path.join(partial, "leftover"), b"")
+            with pathutil.counting() as calls:
+                transfer.copy_to_partial(src, os.path.join(d, "dst"))
+            # Both sides of each of the two directories are listed.
+            self.assertEqual(calls["dirread"], 4)
+            self.assertEqual(sorted(os.listdir(partial)), ["Subs", "a.mkv", "link.mkv"])
+            self.assertEqual(self.read(os.path.join(partial, "Subs", "a.srt")), b"subs")
+            self.assertEqual(os.readlink(os.path.join(partial, "link.mkv")), "a.mkv")
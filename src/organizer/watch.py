@@ -0,0 +1,244 @@
+#!/usr/bin/python3
+
+'''Watcher.
+
+This code watches a download folder with inotify, and hands the items
+that appear in it to the organizer once they have stopped changing for a
+while: no writes to them were seen, and they look the same as when the
+last change was seen.  Items the organizer skipped are remembered, and only looked at
+again when they change.'''
+
+import ctypes
+import errno
+import json
+import os
+import select
+import struct
+import time
+from organizer import pathutil
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+EVENT = struct.Struct("iIII")
+
+SETTLE_SECONDS = 30
+
+class Inotify(object):
+    """A thin wrapper around an inotify file descriptor."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+        self.fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e), path)
+        return wd
+
+    def read(self, timeout):
+        """Waits up to timeout seconds, forever if None, for events, and
+        returns them as (wd, mask, name) tuples."""
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def signature(path):
+    """Returns what identifies the current state of an item, or None if it
+    is gone.  For a folder, only changes to the folder itself count; what
+    happens deeper inside is caught by the watches while the watcher runs."""
+    try:
+        st = pathutil.lstat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size]
+
+class Watcher(object):
+    """The Watcher tracks the items in folder.  Each time poll() is called,
+    it returns the items that changed, then were left alone for settle
+    seconds.  The caller reports those it skipped with skipped(), so they
+    are not returned again until they change.  Skipped items are saved to
+    statefile, if one is given, so they are not looked at again by the next
+    watcher either."""
+
+    def __init__(self, folder, settle=SETTLE_SECONDS, statefile=None):
+        self.folder = os.path.abspath(folder)
+        self.settle = settle
+        self.statefile = statefile
+        self.inotify = Inotify()
+        self.paths = dict()
+        self.pending = dict()
+        self.signatures = dict()
+        self.skipped_items = dict()
+        if statefile:
+            try:
+                with open(statefile) as f:
+                    self.skipped_items = json.load(f)
+            except FileNotFoundError:
+                pass
+        self.watch_tree(self.folder)
+        self.rescan()
+
+    def watch_tree(self, path):
+        for root, dirs, _ in pathutil.walk(path):
+            try:
+                self.paths[self.inotify.add_watch(root)] = root
+            except OSError as e:
+                if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                    raise
+
+    def item_of(self, path):
+        """Returns the item in the watched folder that path is, or is in."""
+        rel = os.path.relpath(path, self.folder)
+        return os.path.join(self.folder, rel.split(os.sep)[0])
+
+    def rescan(self):
+        """Marks as pending every item that was not skipped as it is."""
+        now = time.monotonic()
+        for item in list(self.skipped_items):
+            if not pathutil.lexists(item):
+                del self.skipped_items[item]
+        for name in pathutil.listdir(self.folder):
+            item = os.path.join(self.folder, name)
+            if self.skipped_items.get(item) != signature(item):
+                if item not in self.pending:
+                    self.pending[item] = now
+                    self.signatures[item] = signature(item)
+
+    def changed(self, item, now):
+        self.pending[item] = now
+        self.signatures[item] = signature(item)
+        self.skipped_items.pop(item, None)
+
+    def handle(self, wd, mask, name, now):
+        if mask & IN_Q_OVERFLOW:
+            self.watch_tree(self.folder)
+            self.rescan()
+            return
+        if mask & IN_IGNORED:
+            self.paths.pop(wd, None)
+            return
+        parent = self.paths.get(wd)
+        if parent is None or not name:
+            return
+        path = os.path.join(parent, name)
+        item = self.item_of(path)
+        if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+            self.watch_tree(path)
+        if parent == self.folder and mask & (IN_MOVED_FROM | IN_DELETE):
+            self.pending.pop(item, None)
+            self.signatures.pop(item, None)
+            self.skipped_items.pop(item, None)
+        elif pathutil.lexists(item):
+            self.changed(item, now)
+
+    def next_deadline(self):
+        if not self.pending:
+            return None
+        return min(self.pending.values()) + self.settle
+
+    def poll(self, timeout=None):
+        """Waits for items to settle, for at most timeout seconds, or for as
+        long as it takes if timeout is None, and returns the items that have
+        settled, in the order they were last changed.  Items that look
+        different than when they last changed, like files written through
+        means inotify does not see, start settling again instead."""
+        stop = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            deadline = self.next_deadline()
+            if deadline is not None and deadline <= now:
+                settled = self.settled(now)
+                if settled or (stop is not None and now >= stop):
+                    return settled
+                continue
+            if stop is not None:
+                if now >= stop:
+                    return []
+                deadline = stop if deadline is None else min(deadline, stop)
+            wait = None if deadline is None else max(deadline - now, 0)
+            events = self.inotify.read(wait)
+            now = time.monotonic()
+            for wd, mask, name in events:
+                self.handle(wd, mask, name, now)
+
+    def settled(self, now):
+        """Returns the items that were left alone for settle seconds and
+        still look as they did then, and forgets they are pending."""
+        settled = sorted((t, item) for item, t in self.pending.items()
+                         if t + self.settle <= now)
+        items = []
+        for _, item in settled:
+            sig = signature(item)
+            if sig is not None and sig != self.signatures.get(item):
+                self.changed(item, now)
+                continue
+            del self.pending[item]
+            self.signatures.pop(item, None)
+            if sig is not None:
+                items.append(item)
+        return items
+
+    def skipped(self, items):
+        """Remembers that items were skipped as they are now."""
+        for item in items:
+            sig = signature(item)
+            if sig is not None:
+                self.skipped_items[item] = sig
+        if self.statefile:
+            tmp = self.statefile + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(self.skipped_items, f)
+            os.rename(tmp, self.statefile)
+
+    def close(self):
+        self.inotify.close()
+
+def watch(folder, organize, settle=SETTLE_SECONDS, statefile=None):
+    """Organizes the items that settle in folder, forever.  organize is
+    called with a list of items, and returns those it skipped."""
+    w = Watcher(folder, settle, statefile)
+    try:
+        while True:
+            items = w.poll()
+            if items:
+                w.skipped(organize(items))
+    finally:
+        w.close()
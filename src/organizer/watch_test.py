@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+'''Watcher tests.'''
+
+import os
+import threading
+import time
+import unittest
+from organizer import watch
+from organizer.testutil import dirtree
+
+class TestWatcher(unittest.TestCase):
+
+    def poll_until(self, w, count, timeout=5):
+        settled = []
+        deadline = time.monotonic() + timeout
+        while len(settled) < count and time.monotonic() < deadline:
+            settled.extend(w.poll(timeout=0.5))
+        return settled
+
+    def test_settles_then_tracks_skipped(self):
+        with dirtree(["dl/old.avi", "state/.keep"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            w = watch.Watcher(j("dl"), settle=0.2, statefile=j("state/skipped"))
+            try:
+                self.assertEqual(self.poll_until(w, 1), [j("dl/old.avi")])
+                w.skipped([j("dl/old.avi")])
+
+                os.mkdir(j("dl/Show S01E01"))
+                with open(j("dl/Show S01E01/show.avi"), "wb") as f:
+                    f.write(b"x")
+                start = time.monotonic()
+                self.assertEqual(self.poll_until(w, 1), [j("dl/Show S01E01")])
+                assert time.monotonic() - start >= 0.2
+                self.assertEqual(w.poll(timeout=0.3), [])
+
+                with open(j("dl/old.avi"), "ab") as f:
+                    f.write(b"more")
+                self.assertEqual(self.poll_until(w, 1), [j("dl/old.avi")])
+                w.skipped([j("dl/old.avi")])
+            finally:
+                w.close()
+
+            w = watch.Watcher(j("dl"), settle=0.1, statefile=j("state/skipped"))
+            try:
+                self.assertEqual(self.poll_until(w, 1), [j("dl/Show S01E01")])
+            finally:
+                w.close()
+
+    def test_gone_items_are_forgotten(self):
+        with dirtree(["dl/a.avi"]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            w = watch.Watcher(j("dl"), settle=0.2)
+            try:
+                os.rename(j("dl/a.avi"), j("a.avi"))
+                self.assertEqual(w.poll(timeout=0.5), [])
+                self.assertEqual(w.pending, {})
+            finally:
+                w.close()
+
+    def test_files_being_written_do_not_settle(self):
+        with dirtree([]) as d:
+            j = lambda *p: os.path.join(d, *p)
+            os.mkdir(j("dl"))
+            w = watch.Watcher(j("dl"), settle=0.3)
+            writing = threading.Event()
+            writing.set()
+            def write():
+                with open(j("dl/a.avi"), "wb") as f:
+                    while writing.is_set():
+                        f.write(b"x" * 1024)
+                        f.flush()
+                        time.sleep(0.05)
+            writer = threading.Thread(target=write)
+            writer.start()
+            try:
+                self.assertEqual(w.poll(timeout=1), [])
+                writing.clear()
+                writer.join()
+                start = time.monotonic()
+                self.assertEqual(self.poll_until(w, 1), [j("dl/a.avi")])
+                assert time.monotonic() - start >= 0.25
+            finally:
+                writing.clear()
+                writer.join()
+                w.close()